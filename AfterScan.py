@@ -62,13 +62,29 @@ import textwrap
 import random
 import threading
 import queue
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import itertools
+from collections import deque
+from dataclasses import replace
 from matplotlib import font_manager
 from tooltip import Tooltips
 from rolling_average import RollingAverage
+from afterscan_core import HAS_TEMPORAL_DENOISE, FrameHdrInputFilenamePattern, FrameOutputFilenamePattern
+from afterscan_core import PipelineConfig, WorkerContext, encode_frame, list_source_frames, get_frame_number_from_filename
+from afterscan_core import resize_image, get_image_left_stripe, gamma_correct_image, rotate_image
+from afterscan_core import get_target_position, calculate_frame_displacement_simple, shift_image, stabilize_image
+from afterscan_core import even_image, crop_image, denoise_image, build_template_pyramid, FfmpegFrameStream, FfmpegFileStream
+from afterscan_core import FramePrefetcher, read_frame_source, load_frame_source, FrameManifest, get_folder_manifest
+from afterscan_core import FrameTransforms, OutputIndex, CompletionJournal, sharpen_filter
+from afterscan_core import FrameQueue, frame_memory_budget_default, FrameWriter
+from afterscan_core import intermediate_formats, intermediate_format_default, get_intermediate_format
+from afterscan_core import benchmark_intermediate_formats, FrameStore, FfmpegStoreStream, get_output_area
+from afterscan_core import SourceCache, source_cache_dir_default, source_cache_subfolder, create_source_stager
+from afterscan_core import hdr_proxy_merge_scale, DenoiseWindow
 import hashlib
 import uuid
 import base64
-from collections import deque
 import webbrowser
 
 try:
@@ -77,9 +93,6 @@ try:
 except ImportError:
     requests_loaded = False
 
-# Check for temporalDenoise in OpenCV at startup
-HAS_TEMPORAL_DENOISE = hasattr(cv2, 'temporalDenoising')
-
 # Frame vars
 first_absolute_frame = 0
 last_absolute_frame = 0
@@ -97,8 +110,6 @@ global work_image, base_image, original_image
 FPS_LastMinuteFrameTimes = list()
 FPS_StartTime = time.ctime()
 FPS_CalculatedValue = -1
-denoise_window_size = 3
-temp_denoise_frame_deque = deque(maxlen=denoise_window_size)
 
 # Configuration & support file vars
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -158,6 +169,14 @@ default_project_config = {
     "StabilizationThreshold": 220.0,
     "PerformStabilization": False,
     "skip_frame_regeneration": False,
+    "StreamToFfmpeg": False,
+    "KeepIntermediateFrames": False,
+    "AnalysisOnly": False,
+    "IncrementalRegeneration": False,
+    "IntermediateFormat": intermediate_format_default,
+    "FrameStore": False,
+    "HdrProxyMerge": False,
+    "HdrFastAlign": False,
     "VideoFilename": "",
     "VideoTitle": "",
     "FillBorders": False,
@@ -183,23 +202,14 @@ SourceDir = ""
 TargetDir = ""
 file_type = 'jpg'
 file_type_out = file_type
-FrameInputFilenamePatternList_jpg = "picture-?????.jpg"
-HdrInputFilenamePatternList_jpg = "picture-?????.3.jpg"   # In HDR mode, use 3rd frame as guide
-LegacyHdrInputFilenamePatternList_jpg = "hdrpic-?????.3.jpg"   # In legacy HDR mode, use 3rd frame as guide
-FrameInputFilenamePatternList_png = "picture-?????.png"
-HdrInputFilenamePatternList_png = "picture-?????.3.png"   # In HDR mode, use 3rd frame as guide
-LegacyHdrInputFilenamePatternList_png = "hdrpic-?????.3.png"   # In legacy HDR mode, use 3rd frame as guide
-FrameInputFilenamePattern = "picture-%05d.%s"   # HDR frames using standard filename (2/12/2023)
-FrameHdrInputFilenamePattern = "picture-%05d.%1d.%s"   # HDR frames using standard filename (2/12/2023)
-FrameOutputFilenamePattern = "picture_out-%05d.%s"
+source_frame_type = file_type   # File type of source frames, used by intermediate format 'Same as source'
+intermediate_benchmark_frames = 5   # Frames of the reel used to benchmark intermediate formats
 TitleOutputFilenamePattern = "picture_out(title)-%05d.%s"
 FrameOutputFilenamePattern_for_ffmpeg = "picture_out-%05d."
 TitleOutputFilenamePattern_for_ffmpeg = "picture_out(title)-%05d."
 FrameCheckOutputFilenamePattern = "picture_out-?????.%s"  # Req. for ffmpeg gen.
-HdrSetInputFilenamePattern = "hdrpic-%05d.%1d.%s"   # Req. to fetch each HDR frame set
 HdrFilesOnly = False   # No HDR by default. Updated when building file list from input folder
-MergeMertens = None
-AlignMtb = None
+HdrSetsPresent = False  # HDR bracketed sets (any naming) in source folder. Updated as HdrFilesOnly
 
 SourceDirFileList = []
 TargetDirFileList = []
@@ -344,7 +354,9 @@ CsvPathName = ""
 CsvFile = 0
 CsvFramesOffPercent = 0
 match_level_average = None
-horizontal_offset_average = None
+match_evaluations_average = None    # Template matches performed per frame (threshold search)
+transforms_cache_lookups = 0    # Frames stabilized in current encoding, and how many of them found in transforms cache
+transforms_cache_hits = 0
 
 SavedWithVersion = None # Used to retrieve version from config file (with wich version was this config last saved)
 
@@ -362,6 +374,36 @@ LAST_ITEM_TOKEN = "LAST_ITEM"
 last_displayed_image = 0
 active_threads = 0
 num_threads = 0
+use_process_engine = False  # Encode frames in a pool of worker processes instead of threads
+process_pool = None
+pipeline_config = None  # Settings snapshot (PipelineConfig) for the job being encoded
+ui_worker_context = None    # Worker context used by UI thread (preview, FrameSync viewer)
+process_worker_config = None    # Worker process: Copy of pipeline_config received from the UI process
+process_worker_context = None   # Worker process: Worker context of the process
+headless_thread_data = threading.local()    # Headless mode: Worker context of each thread of the pool
+headless_worker_ids = itertools.count()
+frame_stream = None     # FfmpegFrameStream receiving the frames being generated, when streaming them to ffmpeg
+frame_dispatcher = None     # Thread feeding frame_encoding_queue (see frame_dispatch_thread)
+frames_dispatched = 0       # Frame following the last one added to frame_encoding_queue by frame_dispatcher
+num_writer_threads = 2      # Threads saving generated frames, apart from encoding threads (0 to save in encoding threads)
+frame_writer = None         # FrameWriter saving the frames being generated (thread engine only)
+frame_generation_ui_period = 50     # ms between refreshes of the UI while generating frames (see frame_generation_loop)
+# Memory for frames waiting in queues (bytes): An eighth for previews waiting to be displayed, rest for frames waiting
+# to be written or sent to ffmpeg (see frame_stream_memory_budget)
+frame_memory_budget = frame_memory_budget_default
+num_io_threads = 4      # Threads reading source frames ahead of the encoding workers (0 to disable)
+frame_prefetcher = None     # FramePrefetcher reading source frames of the job being encoded
+source_manifest = None      # FrameManifest of source folder (cached in the folder)
+# Local copy of source files, for source folders in network shares (see SourceCache). Disabled if size is 0
+source_cache_size = 0       # Bytes
+source_cache_dir = source_cache_dir_default
+source_cache = None
+target_manifest = None      # FrameManifest of target folder (not cached, size and time of files not required)
+frame_transforms = None     # FrameTransforms recording hole detection results of the job being encoded
+output_index = None         # OutputIndex of target folder, if only frames changed are generated (incremental regeneration)
+frames_up_to_date = set()   # Frames not to be generated again: Up to date (incremental regeneration), or already generated (resume)
+completion_journal = None   # CompletionJournal of the job being encoded, to resume it if interrupted
+frame_store = None          # FrameStore of the job being encoded, if frames are saved in a single file
 
 
 """
@@ -383,6 +425,7 @@ class Template:
             self.template = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
 
             self.scaled_template = resize_image(self.template, self.scale)
+            self.pyramid = build_template_pyramid(self.scaled_template, self.scale)
             # Calculate the white on black proportion to help with detection
             self.white_pixel_count = cv2.countNonZero(self.scaled_template)
             total_pixels = self.scaled_template.size
@@ -393,6 +436,7 @@ class Template:
         else:
             self.template = None
             self.scaled_template = None
+            self.pyramid = ()
             self.wb_proportion = 0.5
             self.size = (0,0)
             self.scaled_size = (0,0)
@@ -400,6 +444,7 @@ class Template:
     def refresh(self):
         self.template = cv2.imread(self.filename, cv2.IMREAD_GRAYSCALE)
         self.scaled_template = resize_image(self.template, self.scale)
+        self.pyramid = build_template_pyramid(self.scaled_template, self.scale)
         self.white_pixel_count = cv2.countNonZero(self.scaled_template)
         total_pixels = self.scaled_template.size
         self.wb_proportion = self.white_pixel_count / total_pixels
@@ -464,6 +509,9 @@ class TemplateList:
     def get_active_template(self):
         return self.active_template.scaled_template
 
+    def get_active_pyramid(self):
+        return self.active_template.pyramid
+
     def get_active_name(self):
         return self.active_template.name
 
@@ -495,6 +543,7 @@ class TemplateList:
                 t.scaled_position = (int(t.position[0] * new_scale),
                                     int(t.position[1] * new_scale))
                 t.scaled_template = resize_image(t.template, new_scale)
+                t.pyramid = build_template_pyramid(t.scaled_template, new_scale)
                 t.scaled_size = (int(t.size[0] * new_scale),
                                 int(t.size[1] * new_scale))
 
@@ -554,6 +603,9 @@ def set_project_defaults():
     global perform_cropping, generate_video, resolution_dropdown_selected
     global frame_slider, encode_all_frames, frames_to_encode_str
     global perform_stabilization, skip_frame_regeneration, ffmpeg_preset
+    global stream_to_ffmpeg, keep_intermediate_frames
+    global analysis_only, incremental_regeneration, intermediate_format_selected, use_frame_store
+    global hdr_proxy_merge, hdr_fast_align
     global video_filename_str, video_title_str
     global frame_from_str, frame_to_str
     global frame_fill_type, extended_stabilization, low_contrast_custom_template
@@ -587,6 +639,23 @@ def set_project_defaults():
     extended_stabilization.set(project_config["ExtendedStabilization"])
     project_config["skip_frame_regeneration"] = False
     skip_frame_regeneration.set(project_config["skip_frame_regeneration"])
+    project_config["StreamToFfmpeg"] = False
+    stream_to_ffmpeg.set(project_config["StreamToFfmpeg"])
+    project_config["KeepIntermediateFrames"] = False
+    keep_intermediate_frames.set(project_config["KeepIntermediateFrames"])
+    project_config["AnalysisOnly"] = False
+    analysis_only.set(project_config["AnalysisOnly"])
+    project_config["IncrementalRegeneration"] = False
+    incremental_regeneration.set(project_config["IncrementalRegeneration"])
+    project_config["IntermediateFormat"] = intermediate_format_default
+    intermediate_format_selected.set(project_config["IntermediateFormat"])
+    update_file_type_out()
+    project_config["FrameStore"] = False
+    use_frame_store.set(project_config["FrameStore"])
+    project_config["HdrProxyMerge"] = False
+    hdr_proxy_merge.set(project_config["HdrProxyMerge"])
+    project_config["HdrFastAlign"] = False
+    hdr_fast_align.set(project_config["HdrFastAlign"])
     project_config["VideoFilename"] = ""
     video_filename_str.set(project_config["VideoFilename"])
     project_config["VideoTitle"] = ""
@@ -768,6 +837,10 @@ def save_project_config():
     project_config["TargetDir"] = TargetDir
     project_config["CurrentFrame"] = CurrentFrame
     project_config["skip_frame_regeneration"] = skip_frame_regeneration.get()
+    project_config["StreamToFfmpeg"] = stream_to_ffmpeg.get()
+    project_config["KeepIntermediateFrames"] = keep_intermediate_frames.get()
+    project_config["AnalysisOnly"] = analysis_only.get()
+    project_config["IncrementalRegeneration"] = incremental_regeneration.get()
     project_config["FFmpegPreset"] = ffmpeg_preset.get()
     project_config["ProjectConfigDate"] = str(datetime.now())
     project_config["PerformCropping"] = perform_cropping.get()
@@ -1043,6 +1116,17 @@ def decode_project_config():
         skip_frame_regeneration.set(project_config["skip_frame_regeneration"])
     else:
         skip_frame_regeneration.set(False)
+    stream_to_ffmpeg.set(project_config.get("StreamToFfmpeg", False))
+    keep_intermediate_frames.set(project_config.get("KeepIntermediateFrames", False))
+    analysis_only.set(project_config.get("AnalysisOnly", False))
+    incremental_regeneration.set(project_config.get("IncrementalRegeneration", False))
+    if project_config.get("IntermediateFormat", intermediate_format_default) not in intermediate_formats:
+        project_config["IntermediateFormat"] = intermediate_format_default
+    intermediate_format_selected.set(project_config.get("IntermediateFormat", intermediate_format_default))
+    update_file_type_out()
+    use_frame_store.set(project_config.get("FrameStore", False))
+    hdr_proxy_merge.set(project_config.get("HdrProxyMerge", False))
+    hdr_fast_align.set(project_config.get("HdrFastAlign", False))
     if 'FFmpegPreset' in project_config:
         ffmpeg_preset.set(project_config["FFmpegPreset"])
     else:
@@ -1194,6 +1278,8 @@ def job_list_add_current():
             description = description + "medium Q. video"
         if skip_frame_regeneration.get():
             description = description + ", skip FG"
+        elif stream_to_ffmpeg.get():
+            description = description + ", streamed"
         description = description + f", {VideoFps} FPS"
         if resolution_dropdown_selected.get():
             description = description + ", " + resolution_dropdown_selected.get()
@@ -1838,6 +1924,10 @@ def widget_status_update(widget_state=0, button_action=0):
     global force_4_3_crop_checkbox, force_16_9_crop_checkbox
     global custom_stabilization_btn, low_contrast_custom_template_checkbox
     global generate_video_checkbox, skip_frame_regeneration_cb
+    global stream_to_ffmpeg_cb, keep_intermediate_frames_cb
+    global analysis_only_checkbox, incremental_regeneration_checkbox
+    global intermediate_format_dropdown, intermediate_format_benchmark_btn, frame_store_checkbox, frame_store_export_btn
+    global hdr_proxy_merge_checkbox, hdr_fast_align_checkbox
     global video_target_dir, video_target_folder_btn
     global video_filename_label, video_title_label, video_title_name
     global video_fps_dropdown
@@ -1878,6 +1968,14 @@ def widget_status_update(widget_state=0, button_action=0):
         stabilization_threshold_match_label.config(state=widget_state if perform_stabilization.get() else DISABLED)
         stabilization_shift_label.config(state=widget_state if perform_stabilization.get() else DISABLED)
         stabilization_shift_spinbox.config(state=widget_state if perform_stabilization.get() else DISABLED)
+        analysis_only_checkbox.config(state=widget_state if perform_stabilization.get() else DISABLED)
+        incremental_regeneration_checkbox.config(state=widget_state if not perform_denoise.get() else DISABLED)
+        intermediate_format_dropdown.config(state=widget_state if not analysis_only_active() else DISABLED)
+        intermediate_format_benchmark_btn.config(state=widget_state if not analysis_only_active() else DISABLED)
+        frame_store_checkbox.config(state=widget_state if not analysis_only_active() else DISABLED)
+        frame_store_export_btn.config(state=widget_state if use_frame_store.get() else DISABLED)
+        hdr_proxy_merge_checkbox.config(state=widget_state if HdrSetsPresent and not analysis_only_active() else DISABLED)
+        hdr_fast_align_checkbox.config(state=widget_state if HdrSetsPresent and not analysis_only_active() else DISABLED)
         low_contrast_custom_template_checkbox.config(state=widget_state)
         video_filename_name.config(state=widget_state if project_config["GenerateVideo"] else DISABLED)
         ffmpeg_preset_rb1.config(state=widget_state if project_config["GenerateVideo"] else DISABLED)
@@ -1903,6 +2001,8 @@ def widget_status_update(widget_state=0, button_action=0):
         film_type_R8_rb.config(state=DISABLED if template_list.get_active_type() == 'custom' else widget_state)
         generate_video_checkbox.config(state=widget_state if ffmpeg_installed else DISABLED)
         skip_frame_regeneration_cb.config(state=widget_state if project_config["GenerateVideo"] else DISABLED)
+        stream_to_ffmpeg_cb.config(state=widget_state if project_config["GenerateVideo"] else DISABLED)
+        keep_intermediate_frames_cb.config(state=widget_state if project_config["GenerateVideo"] and stream_to_ffmpeg.get() else DISABLED)
         video_target_dir.config(state=widget_state if project_config["GenerateVideo"] else DISABLED)
         video_target_folder_btn.config(state=widget_state if project_config["GenerateVideo"] else DISABLED)
         video_filename_label.config(state=widget_state if project_config["GenerateVideo"] else DISABLED)
@@ -2023,6 +2123,106 @@ def perform_stabilization_selection():
     FrameSync_Viewer_popup_update_widgets(NORMAL)
 
 
+def analysis_only_selection():
+    project_config["AnalysisOnly"] = analysis_only.get()
+    widget_status_update(NORMAL)
+
+
+def incremental_regeneration_selection():
+    project_config["IncrementalRegeneration"] = incremental_regeneration.get()
+    widget_status_update(NORMAL)
+
+
+# Format of generated frames (see intermediate_formats): Files written by frame generation and read back by ffmpeg
+def set_intermediate_format(selected):
+    project_config["IntermediateFormat"] = selected
+    update_file_type_out()
+
+
+def update_file_type_out():
+    global file_type_out
+    file_type_out = get_intermediate_format(project_config.get("IntermediateFormat", intermediate_format_default),
+                                            source_frame_type)[0]
+
+
+def frame_store_selection():
+    project_config["FrameStore"] = use_frame_store.get()
+    widget_status_update(NORMAL)
+
+
+def hdr_proxy_merge_selection():
+    project_config["HdrProxyMerge"] = hdr_proxy_merge.get()
+
+
+def hdr_fast_align_selection():
+    project_config["HdrFastAlign"] = hdr_fast_align.get()
+
+
+# Exports the frames in the frame store of the target folder to image files (in the selected frame format), for
+# tools requiring a file per frame
+def export_frame_store():
+    store = FrameStore(TargetDir)
+    if not store.load():
+        tk.messagebox.showwarning("No frame store", "There is no frame store in the target folder")
+        return
+    win.config(cursor="watch")
+    app_status_label.config(text="Status: Exporting frames...", fg='black')
+    win.update()
+
+    def report_progress(count, total):
+        if count % 50 == 0:
+            app_status_label.config(text=f"Status: Exporting frames {count * 100 // total}%", fg='black')
+            win.update()
+
+    exported = store.export(TargetDir, file_type_out,
+                            get_intermediate_format(project_config.get("IntermediateFormat", intermediate_format_default),
+                                                    source_frame_type)[1],
+                            num_writer_threads, report_progress)
+    store.close()
+    win.config(cursor="")
+    logging.info(f"{exported} frames exported from frame store to {TargetDir}")
+    app_status_label.config(text=f"Status: {exported} frames exported", fg='green')
+
+
+# Encodes a few frames of the current reel, generated with the current settings, with each intermediate format, and
+# displays time and size per frame of each one
+def benchmark_intermediate_format_selection():
+    if len(SourceDirFileList) == 0:
+        return
+    config = build_pipeline_config()
+    step = max(1, len(SourceDirFileList) // intermediate_benchmark_frames)
+    images = []
+    win.config(cursor="watch")
+    win.update()
+    for frame_idx in range(0, len(SourceDirFileList), step)[:intermediate_benchmark_frames]:
+        img, _ = encode_frame(frame_idx, config, ui_worker_context, do_save=False)
+        if img is not None:
+            images.append(img)
+    results = benchmark_intermediate_formats(images, source_frame_type) if len(images) > 0 else []
+    win.config(cursor="")
+    if len(results) == 0:
+        return
+    lines = [f"{name}: write {encode_ms:.0f} ms, read {decode_ms:.0f} ms, {size_mb:.2f} MB"
+             for name, encode_ms, decode_ms, size_mb in results]
+    for line in lines:
+        logging.info(f"Frame format benchmark - {line}")
+    tk.messagebox.showinfo("Frame format benchmark",
+                           f"Time and size per frame ({len(images)} frames of this reel):\r\n\r\n" + "\r\n".join(lines))
+
+
+# Incremental regeneration: Only frames which settings or source changed are generated (see OutputIndex). Not possible
+# if frames are streamed to ffmpeg, as it would require the images of the frames not generated, nor if frames are
+# denoised, as each one depends on the frames before it (see DenoiseWindow)
+def incremental_regeneration_active():
+    return (incremental_regeneration.get() and not skip_frame_regeneration.get() and not analysis_only_active()
+            and not stream_to_ffmpeg_active() and not perform_denoise.get())
+
+
+# Analysis pass: holes are detected and stored in the transforms sidecar, no frames nor video are generated
+def analysis_only_active():
+    return perform_stabilization.get() and analysis_only.get() and not skip_frame_regeneration.get()
+
+
 def low_contrast_custom_template_selection():
     global low_contrast_custom_template
 
@@ -2087,6 +2287,7 @@ def perform_denoise_selection():
     global perform_denoise
 
     project_config["PerformDenoise"] = perform_denoise.get()
+    widget_status_update(NORMAL)
     if ui_init_done:
         win.after(5, scale_display_update)
 
@@ -2147,6 +2348,16 @@ def generate_video_selection():
     FrameSync_Viewer_popup_update_widgets(NORMAL)
 
 
+def stream_to_ffmpeg_selection():
+    project_config["StreamToFfmpeg"] = stream_to_ffmpeg.get()
+    widget_status_update(NORMAL)
+
+
+# Frames are streamed to ffmpeg if video is generated from newly generated frames, and option is selected
+def stream_to_ffmpeg_active():
+    return generate_video.get() and stream_to_ffmpeg.get() and not skip_frame_regeneration.get()
+
+
 def set_fps(selected):
     global VideoFps
 
@@ -3190,7 +3401,7 @@ def debug_template_refresh_template():
         hole_template_pos = template_list.get_active_position()
         # Resize factor calculated when settign source folder
         aux = resize_image(template_list.get_active_template(), FrameSync_Images_Factor)
-        _, top, bottom = get_target_position(0, aux, 'v')  # get positions to draw template limits
+        _, top, bottom = get_target_position(0, aux, build_pipeline_config(), ui_worker_context, 'v')  # get positions to draw template limits
         template_canvas.config(width=int(template_list.get_active_size()[0]*FrameSync_Images_Factor))
         DisplayableImage = ImageTk.PhotoImage(Image.fromarray(aux))
         template_canvas.image = DisplayableImage #keep reference
@@ -3237,6 +3448,8 @@ def load_current_frame_image():
         file = file3
     else:
         file = SourceDirFileList[CurrentFrame]
+    if source_cache is not None:    # Same frames are displayed again and again, read them from local copy
+        file = source_cache.get_file(SourceDir, os.path.basename(file))
     return cv2.imread(file, cv2.IMREAD_UNCHANGED)
 
 
@@ -3262,17 +3475,14 @@ def scale_display_update(offset_x = 0, offset_y = 0, update_filters=True):
             set_hole_search_area(img)
         if not frame_scale_refresh_pending:
             if perform_rotation.get():
-                img = rotate_image(img)
+                img = rotate_image(img, RotationAngle)
             if perform_stabilization.get() or FrameSync_Viewer_opened:
-                img = stabilize_image(CurrentFrame, img, img, offset_x, offset_y)
+                img, stabilization_info = stabilize_image(CurrentFrame, img, img, build_pipeline_config(), ui_worker_context, offset_x, offset_y)
+                report_stabilization_info(CurrentFrame, stabilization_info)
             if update_filters:  # Only when changing values in UI, not when moving from frame to frame
                 if perform_denoise.get():
-                    img = denoise_image(img)
+                    img = denoise_image(img, ui_worker_context.denoise_frames)
                 if perform_sharpness.get():
-                    # Sharpness code taken from https://www.educative.io/answers/how-to-sharpen-a-blurred-image-using-opencv
-                    sharpen_filter = np.array([[-1, -1, -1],
-                                            [-1, 9, -1],
-                                            [-1, -1, -1]])
                     # applying kernels to the input image to get the sharpened image
                     img = cv2.filter2D(img, -1, sharpen_filter)
                 if perform_gamma_correction.get():
@@ -3323,6 +3533,54 @@ def get_stabilization_threshold():
     return StabilizationThreshold_default if ConvertLoopRunning else StabilizationThreshold
 
 
+def build_pipeline_config():
+    # Template is the only mutable object in the configuration: Workers receive a read-only copy
+    template = template_list.get_active_template()
+    if template is not None:
+        template = template.copy()
+        template.setflags(write=False)
+    return PipelineConfig(
+        source_dir=SourceDir,
+        target_dir=TargetDir,
+        first_absolute_frame=first_absolute_frame,
+        file_type=file_type,
+        file_type_out=file_type_out,
+        output_params=get_intermediate_format(project_config.get("IntermediateFormat", intermediate_format_default),
+                                              source_frame_type)[1],
+        hdr_files_only=HdrFilesOnly,
+        hdr_fast_align=project_config.get("HdrFastAlign", False),
+        hdr_merge_scale=hdr_proxy_merge_scale if project_config.get("HdrProxyMerge", False) else 1.0,
+        perform_rotation=perform_rotation.get(),
+        rotation_angle=float(RotationAngle),
+        perform_stabilization=perform_stabilization.get(),
+        detect_holes=FrameSync_Viewer_opened,
+        use_simple_stabilization=use_simple_stabilization,
+        film_type=film_type.get(),
+        stabilization_threshold=float(get_stabilization_threshold()),
+        threshold_sweep=ConvertLoopRunning,
+        low_contrast_custom_template=low_contrast_custom_template.get(),
+        precise_template_match=precise_template_match,
+        template=template,
+        template_position=template_list.get_active_position(),
+        template_pyramid=template_list.get_active_pyramid(),
+        stabilization_shift=StabilizationShift,
+        frame_fill_type=frame_fill_type.get(),
+        fill_missing_rows=ConvertLoopRunning or CorrectLoopRunning,
+        perform_cropping=perform_cropping.get(),
+        crop_top_left=CropTopLeft,
+        crop_bottom_right=CropBottomRight,
+        perform_denoise=perform_denoise.get(),
+        perform_sharpness=perform_sharpness.get(),
+        perform_gamma_correction=perform_gamma_correction.get(),
+        gamma_correction_value=float(gamma_correction_str.get()),
+        debug_images=FrameSync_Viewer_opened,
+        save_frames=(not stream_to_ffmpeg_active() or keep_intermediate_frames.get()) and not analysis_only_active(),
+        frame_store=use_frame_store.get(),
+        analysis_only=analysis_only_active(),
+        source_manifest=source_manifest if source_manifest is not None and source_manifest.folder == SourceDir else None,
+        source_cache=source_cache)
+
+
 def detect_film_type():
     global template_list
     global CurrentFrame, SourceDirFileList
@@ -3346,12 +3604,21 @@ def detect_film_type():
             "Templates to detect film type are missing, please set film type manually.")
         return
 
+    # Only relative position of the holes is required: Frames are decoded at half resolution, directly in grayscale
+    template_1 = cv2.resize(template_1, (template_1.shape[1] // 2, template_1.shape[0] // 2), interpolation=cv2.INTER_AREA)
+    template_2 = cv2.resize(template_2, (template_2.shape[1] // 2, template_2.shape[0] // 2), interpolation=cv2.INTER_AREA)
+
     # Create a list with 5 evenly distributed values between CurrentFrame and len(SourceDirFileList) - CurrentFrame
     num_frames = min(10,len(SourceDirFileList)-CurrentFrame)
     FramesToCheck = np.linspace(CurrentFrame, len(SourceDirFileList) - CurrentFrame - 1, num_frames).astype(int).tolist()
+    # Read all of them in parallel
+    file_list = SourceDirFileList
+    prefetcher = FramePrefetcher(lambda frame_idx: cv2.imread(file_list[frame_idx], cv2.IMREAD_REDUCED_GRAYSCALE_2),
+                                 FramesToCheck, max(1, num_io_threads), len(FramesToCheck))
     for frame_to_check in FramesToCheck:
-        img = cv2.imread(SourceDirFileList[frame_to_check], cv2.IMREAD_UNCHANGED)
-        img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        img_gray = prefetcher.get(frame_to_check)
+        if img_gray is None:    # Not read ahead (repeated in list)
+            img_gray = cv2.imread(file_list[frame_to_check], cv2.IMREAD_REDUCED_GRAYSCALE_2)
         img_bw = cv2.threshold(img_gray, StabilizationThreshold_default, 255, cv2.THRESH_BINARY)[1]
         search_img = get_image_left_stripe(img_bw, 0.2)
         result = cv2.matchTemplate(search_img, template_1, cv2.TM_CCOEFF_NORMED)
@@ -3364,6 +3631,7 @@ def detect_film_type():
             count1 += 1
         else:
             count2 += 1
+    prefetcher.close()
     if not BatchJobRunning and count1 > count2:
         if tk.messagebox.askyesno(
             "Wrong film type detected",
@@ -3499,10 +3767,10 @@ def select_rectangle_area(is_cropping=False):
         original_image = get_image_left_stripe(original_image, 0.2)
     # Rotate image if required
     if perform_rotation.get():
-        original_image = rotate_image(original_image)
+        original_image = rotate_image(original_image, RotationAngle)
     # Stabilize image to make sure target image matches user visual definition
     if is_cropping and perform_stabilization.get():
-        original_image = stabilize_image(CurrentFrame, original_image, original_image)
+        original_image, _ = stabilize_image(CurrentFrame, original_image, original_image, build_pipeline_config(), ui_worker_context)
     # Try to find best template
     if not is_cropping and (template_list.get_active_position() == (0, 0) or template_list.get_active_size() == (0, 0)): # If no template defined,set default
         ix = 0
@@ -3724,7 +3992,7 @@ def select_custom_template():
                 file = file3
             img = cv2.imread(file, cv2.IMREAD_UNCHANGED)
             # test to stabilize custom template itself using simple algorithm
-            move_x, move_y = calculate_frame_displacement_simple(CurrentFrame, img)
+            move_x, move_y = calculate_frame_displacement_simple(CurrentFrame, img, build_pipeline_config(), ui_worker_context)
             img = shift_image(img, img.shape[1], img.shape[0], move_x, move_y)
 
             img = crop_image(img, RectangleTopLeft, RectangleBottomRight)
@@ -3849,89 +4117,6 @@ def is_valid_template_size():
         return True
 
 
-# img is directly the left stripe (search area)
-def match_template(frame_idx, template, img):
-    global min_thres
-
-    tw = template.shape[1]
-    th = template.shape[0]
-    iw = img.shape[1]
-    ih = img.shape[0]
-
-    if (tw >= iw or th >= ih):
-        logging.error("Template (%ix%i) bigger than search area (%ix%i)",
-                      tw, th, iw, ih)
-        return 0, (0, 0), 0, 0
-
-    Done = False
-    local_threshold = get_stabilization_threshold()
-    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)    # reduced left stripe to calculate white on black proportion
-    # Init processing variables
-    limit_threshold = 0
-    step_threshold = 0
-    back_percent_checked = False
-    best_match_level = 0
-    best_thres = 0
-    best_top_left = None
-    best_maxVal = None
-    best_img_final = None
-    while not Done:
-        # convert img to grey, checking various thresholds
-        # in order to calculate the white on black proportion correctly, we saved the number of white pixels in the
-        # template, but we divide it by the number of pixels in the search area, as it is wider
-        if low_contrast_custom_template.get():
-            # Apply Otsu's thresholding
-            best_thres, img_final = cv2.threshold(img_gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            local_threshold = best_thres    # So that it is taken as best for OTSU in the code below
-            Done = True # Only one try with OTSU, best threshold is whathever it returns
-        else:
-            # Not interested in best threshold returned usign this algorithm
-            _, img_final = cv2.threshold(img_gray, local_threshold, 255, cv2.THRESH_BINARY)
-
-        #img_edges = cv2.Canny(image=img_bw, threshold1=100, threshold2=1)  # Canny Edge Detection
-        aux = cv2.matchTemplate(img_final, template, cv2.TM_CCOEFF_NORMED)
-        (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(aux)
-        top_left = maxLoc
-        if not ConvertLoopRunning:
-            best_match_level = round(maxVal,2)
-            best_thres = local_threshold
-            best_top_left = top_left
-            best_maxVal = maxVal
-            best_img_final = img_final
-            Done = True
-        if not Done:
-            if round(maxVal,2) >= best_match_level: # Keep best values in any case
-                best_match_level = round(maxVal,2)
-                best_thres = local_threshold
-                best_top_left = top_left
-                best_maxVal = maxVal
-                best_img_final = img_final
-            if round(maxVal,2) >= 0.85: # Quality not good enough, try another threshold
-                if not precise_template_match or best_match_level >= 0.95 or best_match_level > 0.7 and round(maxVal,2) < best_match_level / 2:
-                    Done = True # If threshold if really good, or much worse than best so far (means match level started decreasing in this loop), then end
-            if not Done:
-                if not back_percent_checked:
-                    back_percent_checked = True
-                    local_threshold = 259   # 254 + 5 to accound for deduction on first loop
-                    limit_threshold = 150
-                    step_threshold = -5
-                    #local_threshold = 145   # 254 + 5 to accound for deduction on first loop
-                    #limit_threshold = 255
-                    #step_threshold = +5
-                local_threshold += step_threshold
-                if (step_threshold < 0 and local_threshold <= limit_threshold) or (step_threshold > 0 and local_threshold >= limit_threshold) :
-                    Done = True # End when reaching the limit (code for both directions, only one apply, as direction is harcoded in the vars)
-                elif abs(limit_threshold-local_threshold) <= 6:
-                    step_threshold = -1 if step_threshold < 0 else 1     # Fine tune when near the limit
-
-    if best_maxVal == None:
-        logging.error(f"Match level not determined: frame_idx {frame_idx}, best_thres: {best_thres}, best_top_left: {best_top_left}, "
-                        "best_maxVal: {best_maxVal}, step_threshold: {step_threshold}, local_threshold: {local_threshold}, limit_threshold: {limit_threshold}")
-        best_maxVal = 0.0
-
-    return int(best_thres), best_top_left, round(best_maxVal,2), best_img_final
-
-
 """
 #################################
 Multiprocessing Support functions
@@ -3939,29 +4124,75 @@ Multiprocessing Support functions
 """
 
 
-def start_threads():
+def start_threads(config):
     global num_threads, active_threads
     global frame_encoding_thread_list
     global frame_encoding_event, frame_encoding_queue
+    global process_pool
+
+    if process_engine_active(config):
+        # Frames are encoded in a pool of worker processes, each one receiving a copy of the job settings.
+        # Threads below are still used to dispatch frames to the pool and to report results to the UI
+        process_pool = ProcessPoolExecutor(max_workers=num_threads, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=process_engine_init,
+                                           initargs=(replace(config, debug_images=False),))
+        logging.debug(f"Process pool with {num_threads} workers initialized")
+    elif use_process_engine:
+        logging.info("Temporal denoise enabled: Frames encoded by threads instead of worker processes")
 
     frame_encoding_thread_list = []
     frame_encoding_event = threading.Event()
     for i in range(0, num_threads):
         logging.debug(f"Thread {i} initialized")
-        frame_encoding_thread_list.append(threading.Thread(target=frame_encoding_thread, args=(frame_encoding_queue, frame_encoding_event, i)))
+        frame_encoding_thread_list.append(threading.Thread(target=frame_encoding_thread, args=(frame_encoding_queue, frame_encoding_event, i, config)))
         frame_encoding_thread_list[i].start()
         active_threads += 1
     logging.debug(f"{num_threads} threads initialized")
 
 
+# Feeds frame_encoding_queue with the frames to encode, from a thread of its own, so that dispatching does not depend
+# on the latency of the UI event loop (workers starved while the UI was busy). Waits while the queue is full, and
+# stops when event is set (encoding terminated)
+def frame_dispatch_thread(encoding_queue, event, first_frame, end_frame):
+    global frames_dispatched
+
+    for frame_idx in range(first_frame, end_frame):
+        while not event.is_set():
+            try:
+                encoding_queue.put(("encode_frame", frame_idx), timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        if event.is_set():
+            break
+        frames_dispatched = frame_idx + 1
+    logging.debug(f"Frame dispatcher exiting, {frames_dispatched - first_frame} frames dispatched")
+
+
+def start_frame_dispatcher(first_frame, end_frame):
+    global frame_dispatcher, frames_dispatched
+
+    frames_dispatched = first_frame
+    frame_dispatcher = threading.Thread(target=frame_dispatch_thread, daemon=True,
+                                        args=(frame_encoding_queue, frame_encoding_event, first_frame, end_frame))
+    frame_dispatcher.start()
+
+
 def terminate_threads(user_terminated):
     global win, num_threads, active_threads
     global frame_encoding_thread_list, frame_encoding_event
     global last_displayed_image
+    global process_pool, frame_prefetcher, frame_transforms, output_index, frames_up_to_date, completion_journal
+    global frame_dispatcher, frame_writer
 
     # Terminate threads
     logging.debug("Signaling exit event for threads")
     frame_encoding_event.set()
+    if pipeline_config is not None and pipeline_config.denoise_window is not None:
+        pipeline_config.denoise_window.close()
+    if frame_dispatcher is not None:   # Stop dispatching before inserting end tokens
+        frame_dispatcher.join()
+        frame_dispatcher = None
     while active_threads > 0:
         if frame_encoding_queue.qsize() <= 4:
             frame_encoding_queue.put((END_TOKEN, 0))
@@ -3997,6 +4228,40 @@ def terminate_threads(user_terminated):
         logging.debug(item)
     logging.debug("<<<<Thread Queues content (after join)")
 
+    # All dispatching threads are done, no more work for the worker processes
+    if process_pool is not None:
+        process_pool.shutdown(wait=True, cancel_futures=True)
+        process_pool = None
+        logging.debug("Process pool terminated")
+
+    # Wait for frames pending to be written, before saving the list of frames generated
+    if frame_writer is not None:
+        frame_writer.close()
+        frames_written, latency, write_time, latency_max = frame_writer.get_stats()
+        logging.info(f"{frames_written} frames written, latency {latency * 1000:.1f} ms "
+                     f"({write_time * 1000:.1f} ms writing), maximum {latency_max * 1000:.1f} ms")
+        frame_writer = None
+
+    if frame_prefetcher is not None:
+        frame_prefetcher.close()
+        frame_prefetcher = None
+    if source_cache is not None:
+        source_cache.save()
+
+    # Results recorded up to now are kept even if encoding was stopped
+    if frame_transforms is not None:
+        frame_transforms.save()
+        frame_transforms = None
+    if output_index is not None:
+        output_index.save()
+        output_index = None
+    if frame_store is not None:     # Closed once video is encoded from it (see generation_exit)
+        frame_store.flush()
+    if completion_journal is not None:  # Kept if stopped by user, to resume the job when started again
+        completion_journal.close(not user_terminated)
+        completion_journal = None
+    frames_up_to_date = set()
+
     # Reinitilize variables used to avoid out-of-order UI update
     last_displayed_image = 0
 
@@ -4026,12 +4291,13 @@ def debug_display_image(window_name, img, factor=1):
             cv2.destroyWindow(window_name)
 
 
-def display_image(img):
+def display_image(img, resize=True):
     global PreviewWidth, PreviewHeight
     global draw_capture_canvas, left_area_frame
     global perform_cropping
 
-    img = resize_image(img, PreviewRatio)
+    if resize:  # Images coming from worker processes are already reduced
+        img = resize_image(img, PreviewRatio)
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     DisplayableImage = ImageTk.PhotoImage(Image.fromarray(img))
 
@@ -4056,25 +4322,25 @@ def display_image(img):
 def display_output_frame_by_number(frame_number):
     global StartFrame
     global TargetDirFileList, file_type_out
+    global target_manifest
+
+    if use_frame_store.get():
+        store = FrameStore(TargetDir)
+        if store.load():
+            img = store.read(first_absolute_frame + frame_number)
+            if img is not None:
+                display_image(img)
+            store.close()
+        return
 
     TargetFile = TargetDir + '/' + FrameOutputFilenamePattern % (StartFrame + frame_number, file_type_out)
 
-    if TargetFile in TargetDirFileList:
+    target_manifest = get_folder_manifest(target_manifest, TargetDir, stat_files=False)
+    if target_manifest.exists(os.path.basename(TargetFile)):
         img = cv2.imread(TargetFile, cv2.IMREAD_UNCHANGED)
         display_image(img)
 
 
-def resize_image(img, ratio):
-    # Calculate the proportional size of original image
-    width = int(img.shape[1] * ratio)
-    height = int(img.shape[0] * ratio)
-
-    dsize = (width, height)
-
-    # resize image
-    return cv2.resize(img, dsize)
-
-
 # This old code was supposed to optimize the size of the search area, as it was assumed that the smaller the area, 
 # the fastest OpenCV would be in finding the template. However, once simplified (hardcoded to 20% left stripe of 
 # the image), it does not seem to cause any additional delay. We leav ethe old code here for the moment.
@@ -4095,13 +4361,6 @@ def get_image_left_stripe_old(img):
     vertical_range = (HoleSearchTopLeft[1], HoleSearchBottomRight[1])
     return np.copy(img[vertical_range[0]:vertical_range[1], horizontal_range[0]:horizontal_range[1]])
 
-def get_image_left_stripe(img, factor):
-    global HoleSearchTopLeft, HoleSearchBottomRight
-    global template_list
-
-    return np.copy(img[0:img.shape[1], 0:int(img.shape[0] * factor)])
-
-
 def gamma_correct_image_old(src, gamma):
     invGamma = 1 / gamma
 
@@ -4110,372 +4369,56 @@ def gamma_correct_image_old(src, gamma):
 
     return cv2.LUT(src, table)
 
-def gamma_correct_image(src, gamma):
-    """Apply gamma correction to an image using a lookup table."""
-    if gamma <= 0:
-        raise ValueError("Gamma must be positive")
-    
-    # Ensure uint8 input
-    if src.dtype != np.uint8:
-        src = cv2.convertScaleAbs(src, alpha=(255.0/src.max()))
-    
-    invGamma = 1 / gamma
-    table = np.array([((i / 255) ** invGamma) * 255 for i in range(256)], dtype=np.uint8)
-    
-    return cv2.LUT(src, table)
-
-
-def rotate_image(img):
-    global RotationAngle
-    # grab the dimensions of the image and calculate the center of the
-    # image
-    (h, w) = img.shape[:2]
-    (cX, cY) = (w // 2, h // 2)
-    # rotate our image by 45 degrees around the center of the image
-    M = cv2.getRotationMatrix2D((cX, cY), float(RotationAngle), 1.0)
-    rotated = cv2.warpAffine(img, M, (w, h))
-    return rotated
-
-
-# Factorize code to find the target positions, vertical and horizontal:
-# Vertical target: Vertical middle of the hole for S8, middle of the inter-hole space for R8
-# Horizontal target: Hole right edge (both for S8 and R8)
-def get_target_position(frame_idx, img, orientation='v', threshold=10, slice_width=10):
-    global draw_capture_canvas
-
-    # Get dimensions of the binary image
-    height = img.shape[0]
-    width = img.shape[1]
-
-    # Set horizontal rows to make several atempts if required
-    pos_list = []
-    if orientation == 'v':
-        pos_list.append(0)
-    else:
-        if film_type.get() == 'S8':
-            pos_list.append(height // 2 - int(height*0.07) - slice_width // 2)
-            pos_list.append(height // 2 - slice_width // 2)
-            pos_list.append(height // 2 + int(height*0.07) - slice_width // 2)
-        else:
-            # For R8, Get a slice on the top or bottom of the image
-            slice_height = 0 # use the top hole
-            #slice_height = height - int(height*0.15))    # use bottom hole
-            pos_list.append(slice_height)
-            pos_list.append(slice_height + int(height*0.05))
-            pos_list.append(slice_height + int(height*0.10))
-            sliced_image = img[slice_height:slice_height+slice_width, :int(width*0.15)]    # Don't need a full horizontal slice, holes must be in the leftmost 15%
-
-    # Calculate the middle of the vertical and horizontal coordinated
-    if film_type.get() == 'S8':
-        vertical_middle = height // 2
-    else:
-        vertical_middle = (height // 2) - int(height*0.05)
-
-    for pos in pos_list:
-        # First, determine the vertical displacement
-        if orientation == 'v':
-            # Get a vertical slice on the left of the image
-            if slice_width > width:
-                raise ValueError("Slice width exceeds image width")
-            sliced_image = img[:, pos:pos+slice_width]
-        else:
-            sliced_image = img[pos:pos+slice_width, :int(width*0.15)]    # Don't need a full horizontal slice, holes must be in the leftmost 15%
-
-        # Convert to pure black and white (binary image)
-        _, binary_img = cv2.threshold(sliced_image, get_stabilization_threshold(), 255, cv2.THRESH_BINARY)
-
-        # Sum along the width to get a 1D array representing white pixels at each height
-        height_profile = np.sum(binary_img, axis=1 if orientation == 'v' else 0)
-        
-        # Find where the sum is non-zero (white) for S8 or horizontal search, or zero (black) for R8
-        if (film_type.get() == 'R8' and orientation == 'v'):
-            slice_values = np.where(height_profile == 0)[0]
-        else:
-            slice_values = np.where(height_profile > 0)[0]
-
-        areas = []
-        start = None
-        min_gap_size = int((height*0.08) if orientation == 'v' else (width*0.05))  # Determine minimum hole size depending on the orientation
-        previous = None
-        for i in slice_values:
-            if start is None:
-                start = i
-            if previous is not None and i-previous > 1: # end of first ares, check size
-                if previous-start > min_gap_size:  # min_gap_size is minimum number of consecutive pixels to skip small gaps
-                    areas.append((start, previous - 1))
-                start = i
-            previous = i
-        if start is not None and slice_values[-1]-start > min_gap_size:  # Add the last area if it exists
-            areas.append((start, slice_values[-1]))
-        
-        result = 0
-        bigger = 0
-        area_count = 0
-        for start, end in areas:
-            area_count += 1
-            if area_count > 2:
-                break
-            if end-start > bigger:
-                bigger = end-start
-                result = (start + end) // 2 if orientation == 'v' else end
-                result_start = start
-                result_end = end
-
-    if (area_count > 0):
-        if orientation == 'v':
-            offset = vertical_middle-result   # Return offset of the center of the biggest area with respect to the frame enter
-            if abs(offset) > 300:
-                logging.warning(f"Frame {frame_idx}: Vertical offset too big {offset}.")
-        else:
-            offset = int(width*0.08) - result   # Return offset of the hole vertical edge with respect to the expected position
-            # Difference between actual horizontal offset and average one should be smaller than 30 pixels (not much horizontal movement expected)
-            if horizontal_offset_average.get_average() is not None and abs(horizontal_offset_average.get_average()-offset) > 30:
-                logging.warning(f"Frame {frame_idx}: Too much deviation of horizontal offset {offset}, respect to average {int(horizontal_offset_average.get_average())}.")
-                offset = horizontal_offset_average.get_average()
-            else:
-                horizontal_offset_average.add_value(offset)
-    else:
-        offset = 0
-        result_start = 0
-        result_end = 0
-
-    return int(offset), result_start, result_end
-
-
-# Based on FrameAlignmentChecker 'is_frame_centered' algorithm
-# Templates to be dropped, vertical displacement to be calculated based on position 
-# of the center of the hole (S8) or the space between two holes (R8)
-def calculate_frame_displacement_simple(frame_idx, img, threshold=10, slice_width=10):
-    vertical_offset, _, _ = get_target_position(frame_idx, img, 'v')
-    horizontal_offset, _, _ = get_target_position(frame_idx, img, 'h')
-
-    return horizontal_offset, vertical_offset
-
-# Original algorithm based on templates
-# Extracted code to calculate displacement to use with the manual option
-def calculate_frame_displacement_with_templates(frame_idx, img_ref, img_ref_alt = None, id = -1):
-    # Set hole template expected position
-    hole_template_pos = template_list.get_active_position()
-    film_hole_template = template_list.get_active_template()
-
-    # Search film hole pattern
-    best_match_level = 0
-    best_top_left = [0,0]
-
-    # Get sprocket hole area
-    left_stripe_image = get_image_left_stripe(img_ref, 0.3)
-    img_ref_alt_used = False
-    while True:
-        frame_treshold, top_left, match_level, img_matched = match_template(frame_idx, film_hole_template, left_stripe_image)
-        match_level = max(0, match_level)   # in some cases, not sure why, match level is negative
-        if match_level >= 0.85:
-            break
-        else:
-            if match_level >= best_match_level:
-                best_match_level = match_level
-                best_top_left = top_left
-                best_img_matched = img_matched
-        if not img_ref_alt_used and img_ref_alt is not None:
-            left_stripe_image = get_image_left_stripe(img_ref_alt, 0.3)
-            img_ref_alt_used = True
-        else:
-            match_level = best_match_level
-            top_left = best_top_left
-            img_matched = best_img_matched
-            break
-
-    if top_left[1] != -1 and match_level > 0.1:
-        move_x = hole_template_pos[0] - top_left[0]
-        move_y = hole_template_pos[1] - top_left[1]
-        if abs(move_x) > 200 or abs(move_y) > 600:  # if shift too big, ignore it, probably for the better
-            logging.warning(f"Frame {frame_idx:5d}: Shift too big ({move_x}, {move_y}), ignoring it.")
-            move_x = 0
-            move_y = 0
-    else:   # If match is not good, keep the frame where it is, will probably look better
-        logging.warning(f"Frame {frame_idx:5d}: Template match not good ({match_level}""), ignoring it.")
-        move_x = 0
-        move_y = 0
-    log_line = f"T{id} - " if id != -1 else ""
-    logging.debug(log_line+f"Frame {frame_idx:5d}: threshold: {frame_treshold:3d}, template: ({hole_template_pos[0]:4d},{hole_template_pos[1]:4d}), top left: ({top_left[0]:4d},{top_left[1]:4d}), move_x:{move_x:4d}, move_y:{move_y:4d}")
-    debug_template_display_frame_raw(img_matched, top_left[0], top_left[1] - stabilization_shift_value.get(), film_hole_template.shape[1], film_hole_template.shape[0], match_level_color_bgr(match_level))
-    debug_template_display_info(frame_idx, frame_treshold, top_left, move_x, move_y)
-
-    return move_x, move_y, top_left, match_level, frame_treshold
-
-
-def shift_image(img, width, height, move_x, move_y):
-    translation_matrix = np.array([
-        [1, 0, move_x],
-        [0, 1, move_y]
-    ], dtype=np.float32)
-    # Apply the translation to the image
-    return cv2.warpAffine(src=img, M=translation_matrix, dsize=(width, height))
-
-
-def stabilize_image(frame_idx, img, img_ref, offset_x = 0, offset_y = 0, img_ref_alt = None, id = -1):
-    global SourceDirFileList
-    global first_absolute_frame, StartFrame
-    global HoleSearchTopLeft, HoleSearchBottomRight
-    global CropTopLeft, CropBottomRight, win
-    global project_name
-    global frame_fill_type, extended_stabilization
-    global CsvFramesOffPercent
-    global stabilization_threshold_match_label
-    global FrameSync_Viewer_opened
-    global perform_stabilization
-    global template_list
-
-    # Get image dimensions to perform image shift later
-    width = img_ref.shape[1]
-    height = img_ref.shape[0]
+# Updates UI with the results of stabilize_image. Called from the UI thread only (Tk is not thread-safe): Results of
+# frames encoded by worker threads are queued, and reported by frame_generation_loop
+def report_stabilization_info(frame_idx, info):
+    record_stabilization_info(frame_idx, info)
+    display_stabilization_info(frame_idx, info)
 
-    if use_simple_stabilization:  # Standard stabilization using templates
-        move_x, move_y = calculate_frame_displacement_simple(frame_idx, img_ref)
-        match_level = 1
-        frame_threshold = get_stabilization_threshold()
-    else:
-        move_x, move_y, top_left, match_level, frame_threshold  = calculate_frame_displacement_with_templates(frame_idx, img_ref, img_ref_alt, id)
-        
-    # Try to figure out if there will be a part missing
-    # at the bottom, or the top
-    missing_rows = 0
-    missing_bottom = 0
-    missing_top = 0
-    if move_y < 0:
-        if height + move_y < CropBottomRight[1]:
-            missing_bottom = -(CropBottomRight[1] - (height + move_y))
-        missing_rows = -missing_bottom
-    if move_y > 0:
-        if move_y > CropTopLeft[1]:
-            missing_top = CropTopLeft[1] - move_y
-        missing_rows = -missing_top
-
-    if missing_rows > 0 and perform_rotation.get():
-        missing_rows = missing_rows + 10  # If image is rotated, add 10 to cover gap between image and fill
 
+# Adds the results of stabilize_image to the statistics of the encoding session (and to the bad frame list)
+def record_stabilization_info(frame_idx, info):
+    global transforms_cache_lookups, transforms_cache_hits
+    match_level = info['match_level']
+    missing_rows = info['missing_rows']
+    top_left = info['top_left']
     # Log frame alignment info for analysis (only when in convert loop)
     # Items logged: Tag, project id, Frame number, missing pixel rows, location (bottom/top), Vertical shift
-    stabilization_threshold_match_label.config(fg='white', bg=match_level_color(match_level),
-                                               text=str(int(match_level * 100)))
     if ConvertLoopRunning:
         # Calculate rolling average of match level
         match_level_average.add_value(match_level)
+        match_evaluations_average.add_value(info['match_evaluations'])
+        transforms_cache_lookups += 1
+        transforms_cache_hits += info.get('cached', False)
         if missing_rows > 0 or match_level < 0.9:
             if match_level < 0.7 if not high_sensitive_bad_frame_detection else 0.9:   # Only add really bad matches
-                if FrameSync_Viewer_opened:  # Generate bad frame list only if popup opened
+                if FrameSync_Viewer_opened and not info.get('corrected', False):    # Keep corrections already done  # Generate bad frame list only if popup opened
                     insert_or_replace_sorted(bad_frame_list, {'frame_idx': frame_idx, 'x': 0, 'y': 0, 
                                                               'original_x' : top_left[0], 'original_y': top_left[1],
-                                                              'threshold': frame_threshold, 'original_threshold': frame_threshold, 
+                                                              'threshold': info['threshold'], 'original_threshold': info['threshold'], 
                                                               'is_frame_saved': True})
                     if stabilization_bounds_alert.get():
                         win.bell()
             if GenerateCsv:
                 CsvFile.write('%i, %i, %i\n' % (first_absolute_frame+frame_idx, missing_rows, int(match_level*100)))
-    if match_level < 0.4:   # If match level is too bad, revert to simple algorithm
-        move_x, move_y = calculate_frame_displacement_simple(frame_idx, img)
-    # Create the translation matrix using move_x and move_y (NumPy array): This is the actual stabilization
-    # We double-check the check box since this function might be called just to debug template detection
-    if perform_stabilization.get():
-        move_x += offset_x
-        move_y += offset_y
-        # Check if frame fill is enabled, and required: Extract missing fragment
-        if frame_fill_type.get() == 'fake' and (ConvertLoopRunning or CorrectLoopRunning) and missing_rows > 0:
-            # Perform temporary horizontal stabilization only first, to extract missing fragment
-            translated_image = shift_image(img, width, height, move_x, 0)
-            if missing_top < 0:
-                missing_fragment = translated_image[CropBottomRight[1]-missing_rows:CropBottomRight[1],0:width]
-            elif missing_bottom < 0:
-                missing_fragment = translated_image[CropTopLeft[1]:CropTopLeft[1]+missing_rows, 0:width]
-        # Add vertical offset as decided by user, to compensate for vertically assimmetrical films
-        translated_image = shift_image(img, width, height, move_x, move_y + StabilizationShift)
-        # Check if frame fill is enabled, and required: Add missing fragment
-        # Check if there is a gap in the frame, if so, and one of the 'fill' functions is enabled, fill accordingly
-        if missing_rows > 0 and (ConvertLoopRunning or CorrectLoopRunning):
-            if frame_fill_type.get() == 'fake':
-                if missing_top < 0:
-                    translated_image[CropTopLeft[1]:CropTopLeft[1]+missing_rows,0:width] = missing_fragment
-                elif missing_bottom < 0:
-                    translated_image[CropBottomRight[1]-missing_rows:CropBottomRight[1],0:width] = missing_fragment
-            elif frame_fill_type.get() == 'dumb':
-                if missing_top < 0:
-                    translated_image = translated_image[missing_rows+CropTopLeft[1]:height,0:width]
-                    translated_image = cv2.copyMakeBorder(src=translated_image, top=missing_rows+CropTopLeft[1], bottom=0, left=0, right=0,
-                                                          borderType=cv2.BORDER_REPLICATE)
-                elif missing_bottom < 0:
-                    translated_image = translated_image[0:CropBottomRight[1]-missing_rows, 0:width]
-                    translated_image = cv2.copyMakeBorder(src=translated_image, top=0, bottom=CropBottomRight[1]-missing_rows, left=0, right=0,
-                                                          borderType=cv2.BORDER_REPLICATE)
-    else:
-        translated_image = img
-    # Draw stabilization rectangles only for image in popup debug window to allow having it activated while encoding
-    if not use_simple_stabilization and FrameSync_Viewer_opened and top_left[1] != -1 :
-        if not perform_stabilization.get():
-            move_x = 0
-            move_y = 0
-        else:   # Do not move rectangle when manually stabilizing frames
-            move_x -= offset_x
-            move_y -= offset_y
-        left_stripe_img = get_image_left_stripe(translated_image, 0.2)
-        # No need for a search area rectangle, since the image in the debug popup is already that rectangle
-        debug_template_display_frame_stabilized(left_stripe_img, top_left[0] + move_x, top_left[1] + move_y,
-                                                template_list.get_active_size()[0], template_list.get_active_size()[1],
-                                                match_level_color_bgr(match_level))
-
-    return translated_image
-
-
-def even_image(img):
-    # Get image dimensions to check whether one dimension is odd
-    width = img.shape[1]
-    height = img.shape[0]
-
-    X_end = width
-    Y_end = height
-
-    # FFmpeg does not like odd dimensions
-    # Adjust (decreasing BottomRight)in case of odd width/height
-    if width % 2 == 1:
-        X_end -= 1
-    if height % 2 == 1:
-        Y_end -= 1
-    if X_end != 0 or Y_end != 0:
-        return img[0:Y_end, 0:X_end]
-    else:
-        return img
-
-
-def crop_image(img, top_left, botton_right):
-    # Get image dimensions to perform image shift later
-    width = img.shape[1]
-    height = img.shape[0]
 
-    Y_start = top_left[1]
-    Y_end = min(botton_right[1], height)
-    X_start = top_left[0]
-    X_end = min (botton_right[0], width)
 
-    # FFmpeg does not like odd dimensions
-    # Adjust (decreasing BottomRight)in case of odd width/height
-    if (X_end - X_start) % 2 == 1:
-        X_end -= 1
-    if (Y_end - Y_start) % 2 == 1:
-        Y_end -= 1
-
-    return img[Y_start:Y_end, X_start:X_end]
-
-
-def denoise_image(img):
-    temp_denoise_frame_deque.append(img)
-    if len(temp_denoise_frame_deque) == denoise_window_size:
-        if not HAS_TEMPORAL_DENOISE:
-            # denoised_img = np.median(np.array(list(temp_denoise_frame_deque)), axis=0).astype(np.uint8)   # Temporal median filtering does not work very well for moving images
-            denoised_img = cv2.fastNlMeansDenoisingColored(img, None, 5, 5, 21, 7)
-        else:
-            denoised_img = cv2.temporalDenoising(np.array(list(temp_denoise_frame_deque)), None, 3)
-    else:
-        # For the first denoise_window_size frames, return the original frame
-        denoised_img = img 
-    return denoised_img
+# Displays the results of stabilize_image (match level, and template match in FrameSync viewer)
+def display_stabilization_info(frame_idx, info):
+    match_level = info['match_level']
+    top_left = info['top_left']
+    stabilization_threshold_match_label.config(fg='white', bg=match_level_color(match_level),
+                                               text=str(int(match_level * 100)))
+    # Draw stabilization rectangles only for image in popup debug window to allow having it activated while encoding
+    if FrameSync_Viewer_opened and 'stripe_matched' in info:
+        template_size = template_list.get_active_size()
+        debug_template_display_frame_raw(info['stripe_matched'], top_left[0], top_left[1] - stabilization_shift_value.get(),
+                                         template_size[0], template_size[1], match_level_color_bgr(match_level))
+        # No need for a search area rectangle, since the image in the debug popup is already that rectangle
+        debug_template_display_frame_stabilized(info['stripe_stabilized'], info['stripe_stabilized_pos'][0], info['stripe_stabilized_pos'][1],
+                                                template_size[0], template_size[1], match_level_color_bgr(match_level))
+    if FrameSync_Viewer_opened and not use_simple_stabilization:
+        debug_template_display_info(frame_idx, info['threshold'], top_left, info['move_x'], info['move_y'])
 
 
 def is_ffmpeg_installed():
@@ -4518,59 +4461,25 @@ def get_source_dir_file_list():
     global frame_slider
     global area_select_image_factor, screen_height
     global frames_target_dir
-    global HdrFilesOnly
+    global HdrFilesOnly, HdrSetsPresent
     global CropBottomRight
-    global file_type, file_type_out
+    global file_type, source_frame_type
     global FrameSync_Images_Factor
     global skip_frame_regeneration
+    global source_manifest
 
     if not os.path.isdir(SourceDir):
         return
 
-    if skip_frame_regeneration.get():
-        logging.debug("Skip Mode enabled. Searching for any JPG/PNG sequence in Source folder.")
-        # In skip mode, we are flexible and look for any JPG or PNG files.
-        SourceDirFileList_jpg = sorted(list(glob(os.path.join(SourceDir, "*.jpg"))))
-        SourceDirFileList_png = sorted(list(glob(os.path.join(SourceDir, "*.png"))))
-        SourceDirFileList = SourceDirFileList_jpg + SourceDirFileList_png
-        
-        if len(SourceDirFileList_png) > 0 and len(SourceDirFileList_jpg) == 0:
-            file_type_out = 'png'
-            logging.debug("Found only PNG files.")
-        else:
-            file_type_out = 'jpg'
-            logging.debug("Found JPG files (or a mix). Defaulting to JPG.")
-        
-        HdrFilesOnly = False
-    else:
-        # Original logic when not skipping frame generation
-        SourceDirFileList_jpg = list(glob(os.path.join(SourceDir, FrameInputFilenamePatternList_jpg)))
-        if len(SourceDirFileList_jpg) == 0:
-            SourceDirFileList_png = list(glob(os.path.join(SourceDir, FrameInputFilenamePatternList_png)))
-            SourceDirFileList = sorted(SourceDirFileList_png)
-            file_type_out = 'png'
-        else:
-            SourceDirFileList = sorted(SourceDirFileList_jpg)
-            file_type_out = 'jpg'
-
-        SourceDirHdrFileList_jpg = list(glob(os.path.join(SourceDir, HdrInputFilenamePatternList_jpg)))
-        SourceDirHdrFileList_png = list(glob(os.path.join(SourceDir, HdrInputFilenamePatternList_png)))
-        SourceDirHdrFileList = sorted(SourceDirHdrFileList_jpg + SourceDirHdrFileList_png)
-        if len(SourceDirHdrFileList_png) != 0:
-            file_type_out = 'png'
-        elif len(SourceDirHdrFileList_jpg) != 0:
-            file_type_out = 'jpg'
-
-        SourceDirLegacyHdrFileList_jpg = list(glob(os.path.join(SourceDir, LegacyHdrInputFilenamePatternList_jpg)))
-        SourceDirLegacyHdrFileList_png = list(glob(os.path.join(SourceDir, LegacyHdrInputFilenamePatternList_png)))
-        SourceDirLegacyHdrFileList = sorted(SourceDirLegacyHdrFileList_jpg + SourceDirLegacyHdrFileList_png)
-        if len(SourceDirLegacyHdrFileList_png) != 0:
-            file_type_out = 'png'
-        elif len(SourceDirLegacyHdrFileList_jpg) != 0:
-            file_type_out = 'jpg'
-
+    # Source folder is listed again only if modified since last time
+    source_manifest = get_folder_manifest(source_manifest, SourceDir, save_cache=True)
+    SourceDirFileList, SourceDirLegacyHdrFileList, NumHdrFiles, source_frame_type = \
+        list_source_frames(SourceDir, skip_frame_regeneration.get(), source_manifest)
+    update_file_type_out()
+    if len(source_manifest.gaps) > 0:
+        logging.warning(f"Source folder: {len(source_manifest.gaps)} gaps in frame sequence, first one at frame {source_manifest.gaps[0][0]}")
+    if not skip_frame_regeneration.get():
         NumFiles = len(SourceDirFileList)
-        NumHdrFiles = len(SourceDirHdrFileList)
         NumLegacyHdrFiles = len(SourceDirLegacyHdrFileList)
         if NumFiles != 0 and NumLegacyHdrFiles != 0:
             if tk.messagebox.askyesno(
@@ -4584,6 +4493,10 @@ def get_source_dir_file_list():
         elif NumFiles == 0 and NumHdrFiles == 0:
             SourceDirFileList = SourceDirLegacyHdrFileList
         HdrFilesOnly = NumLegacyHdrFiles > NumFiles
+        HdrSetsPresent = HdrFilesOnly or NumHdrFiles > 0
+    else:
+        HdrFilesOnly = False
+        HdrSetsPresent = False
 
     if len(SourceDirFileList) == 0:
         tk.messagebox.showerror("Error!", "The source folder does not contain supported images.")
@@ -4727,12 +4640,13 @@ def get_target_dir_file_list():
     global TargetDirFileList
     global out_frame_width, out_frame_height
     global file_type_out
+    global target_manifest
 
     if not os.path.isdir(TargetDir):
         return
 
-    TargetDirFileList = sorted(list(glob(os.path.join(
-        TargetDir, FrameCheckOutputFilenamePattern % file_type_out))))
+    target_manifest = get_folder_manifest(target_manifest, TargetDir, stat_files=False)
+    TargetDirFileList = list(target_manifest.match(FrameCheckOutputFilenamePattern % file_type_out))
     if len(TargetDirFileList) != 0:
         # read image
         img = cv2.imread(TargetDirFileList[0], cv2.IMREAD_UNCHANGED)
@@ -4746,13 +4660,15 @@ def get_target_dir_file_list():
 def valid_generated_frame_range():
     global StartFrame, frames_to_encode, first_absolute_frame
     global TargetDirFileList, file_type_out
+    global target_manifest
 
+    target_manifest = get_folder_manifest(target_manifest, TargetDir, stat_files=False)
     file_count = 0
     for i in range(first_absolute_frame + StartFrame,
                    first_absolute_frame + StartFrame + frames_to_encode):
         file_to_check = os.path.join(TargetDir,
                                      FrameOutputFilenamePattern % (i, file_type_out))
-        if file_to_check in TargetDirFileList:
+        if target_manifest.exists(os.path.basename(file_to_check)):
             file_count += 1
         else:
             # Double check if file really does not exist
@@ -4814,17 +4730,6 @@ Core top level functions
 ########################
 """
 
-def get_frame_number_from_filename(filename):
-    try:
-        name_part = os.path.splitext(os.path.basename(filename))[0]
-        numbers = re.findall(r'\d+', name_part)
-        if numbers:
-            return int(numbers[-1])
-        else:
-            return None
-    except:
-        return None
-
 def get_frame_time(frame_idx):
     fps = 18 if film_type.get() == 'S8' else 16
     return f"{(frame_idx // fps) // 60:02}:{(frame_idx // fps) % 60:02}"
@@ -4846,13 +4751,17 @@ def start_convert():
     global CsvFilename, CsvPathName, CsvFile
     global FPS_LastMinuteFrameTimes
     global current_bad_frame_index
+    global pipeline_config, frame_stream, frame_prefetcher, frame_transforms, output_index, frames_up_to_date
+    global completion_journal, frame_writer, frame_store
+    global transforms_cache_lookups, transforms_cache_hits
 
     if ConvertLoopRunning:
         ConvertLoopExitRequested = True
         ConvertLoopRunning = False
     else:
         get_source_dir_file_list()
-        if not skip_frame_regeneration.get() and not delete_detected_bad_frames():
+        # FrameSync corrections are applied by incremental regeneration, no need to delete them
+        if not skip_frame_regeneration.get() and not incremental_regeneration_active() and not delete_detected_bad_frames():
             return
         gamma_enforce_min_value()
         save_general_config()
@@ -4902,36 +4811,38 @@ def start_convert():
                     generation_exit()
                     return
 
-        ConvertLoopRunning = True
-        
-    if not skip_frame_regeneration.get():
-            if GenerateCsv:
-                CsvFilename = video_filename_str.get()
-                name, ext = os.path.splitext(CsvFilename)
-                if name == "":
-                    name = "AfterScan-"
-                CsvFilename = datetime.now().strftime("%Y_%m_%d-%H-%M-%S_") + name + '.csv'
-                CsvPathName = os.path.join(resources_dir, CsvFilename)
-                CsvFile = open(CsvPathName, "w")
-            match_level_average.clear()
-            horizontal_offset_average.clear()
-            FrameSync_Viewer_popup_update_widgets(DISABLED)
-            start_threads()
-            win.after(1, frame_generation_loop)
-    elif generate_video.get():
-        if (project_config["VideoResolution"] not in resolution_dict or (project_config["VideoResolution"] != "Unchanged" and resolution_dict[project_config["VideoResolution"]] == '')):
-            if not BatchJobRunning:
-                tk.messagebox.showerror("Error!", "Specifies a video resolution.")
-            else:
+        if generate_video.get() and not skip_frame_regeneration.get() and not analysis_only_active():
+            if (project_config["VideoResolution"] not in resolution_dict
+                or (project_config["VideoResolution"] != "Unchanged"
+                and resolution_dict[project_config["VideoResolution"]] == '')):
                 logging.error(f"Cannot generate video {TargetVideoFilename}, no video resolution selected")
-            generation_exit(success=False)
-        else:
-            ffmpeg_success = False
-            ffmpeg_encoding_status = ffmpeg_state.Pending
-            win.after(1000, video_generation_loop)
-        
-    if not skip_frame_regeneration.get():
+                if not BatchJobRunning:
+                    tk.messagebox.showerror("Error!", "Please specify video resolution.")
+                generation_exit(success = False)
+                return
+            if stream_to_ffmpeg_active() and video_title_str.get() != "":
+                logging.warning("Video title is not generated when streaming frames to FFmpeg")
+            elif use_frame_store.get() and video_title_str.get() != "":
+                logging.warning("Video title is not generated when frames are saved in a frame store")
+
+        # Frame store is allocated for the whole reel before starting, as it might not fit in the target folder
+        config = build_pipeline_config()
+        if config.frame_store and config.save_frames and not config.analysis_only and not skip_frame_regeneration.get():
+            x_start, y_start, x_end, y_end = get_output_area(frame_width, frame_height, config)
+            frame_store = FrameStore(TargetDir)
+            try:
+                frame_store.open(first_absolute_frame, len(SourceDirFileList), (x_end - x_start, y_end - y_start))
+            except OSError as e:
+                logging.error(f"Cannot create frame store: {e}")
+                if not BatchJobRunning:
+                    tk.messagebox.showerror("Error!", f"Cannot create frame store: {e}")
+                frame_store = None
+                generation_exit(success = False)
+                return
 
+        ConvertLoopRunning = True
+
+        if not skip_frame_regeneration.get():
             # Check if CSV option selected
             if GenerateCsv:
                 CsvFilename = video_filename_str.get()
@@ -4945,29 +4856,129 @@ def start_convert():
                 CsvPathName = os.path.join(CsvPathName, CsvFilename)
                 CsvFile = open(CsvPathName, "w")
             match_level_average.clear()
-            horizontal_offset_average.clear()
+            match_evaluations_average.clear()
+            transforms_cache_lookups = 0
+            transforms_cache_hits = 0
             # Disable manual stabilize popup widgets
             FrameSync_Viewer_popup_update_widgets(DISABLED)
+            # Take snapshot of settings for the workers, no UI variables are accessed while encoding
+            pipeline_config = build_pipeline_config()
+            frame_transforms = create_frame_transforms(pipeline_config)
+            if frame_transforms is not None:
+                pipeline_config = replace(pipeline_config, frame_transforms=frame_transforms)
+            if pipeline_config.perform_denoise and not pipeline_config.analysis_only:
+                pipeline_config = replace(pipeline_config, denoise_window=DenoiseWindow(StartFrame))
+            if incremental_regeneration_active():
+                pipeline_config = replace(pipeline_config, frame_corrections=get_frame_corrections(bad_frame_list))
+                output_index = OutputIndex(TargetDir, frame_store)
+                output_index.load()
+                frames_up_to_date = output_index.check_frames(pipeline_config, range(StartFrame, StartFrame + frames_to_encode))
+                logging.info(f"Incremental regeneration: {len(frames_up_to_date)} frames up to date, "
+                             f"{frames_to_encode - len(frames_up_to_date)} to be generated")
+            # Resume job if interrupted before (frames are skipped as in incremental regeneration)
+            if pipeline_config.save_frames and not pipeline_config.analysis_only and not stream_to_ffmpeg_active() \
+                    and not pipeline_config.perform_denoise:
+                completion_journal = CompletionJournal(TargetDir)
+                resumed = completion_journal.open(pipeline_config, range(StartFrame, StartFrame + frames_to_encode),
+                                                  frame_store)
+                if len(resumed) > 0:
+                    logging.info(f"Resuming interrupted job: {len(resumed)} frames already generated")
+                    frames_up_to_date = frames_up_to_date | resumed
+            if generate_video.get() and not pipeline_config.analysis_only:
+                frame_stream = create_frame_stream()
+            frame_prefetcher = create_frame_prefetcher(pipeline_config, [frame_idx for frame_idx in range(
+                StartFrame, StartFrame + frames_to_encode) if frame_idx not in frames_up_to_date])
+            # Worker processes save the frames themselves
+            if pipeline_config.save_frames and not pipeline_config.analysis_only and not process_engine_active(pipeline_config) and \
+                    frame_store is None and num_writer_threads > 0:
+                frame_writer = FrameWriter(num_writer_threads, frame_stream_memory_budget())
             # Multiprocessing: Start all threads before encoding
-            start_threads()
-            win.after(1, frame_generation_loop)
-    elif generate_video.get():
-        if (project_config["VideoResolution"] not in resolution_dict
-            or (project_config["VideoResolution"] != "Unchanged"
-            and resolution_dict[project_config["VideoResolution"]] == '')):
-            if not BatchJobRunning:
-                logging.error("Error, no video resolution selected")
-                tk.messagebox.showerror("Error!", "Please specify video resolution.")
+            start_threads(pipeline_config)
+            start_frame_dispatcher(StartFrame, StartFrame + frames_to_encode)
+            win.after(frame_generation_ui_period, frame_generation_loop)
+        elif generate_video.get():
+            if (project_config["VideoResolution"] not in resolution_dict
+                or (project_config["VideoResolution"] != "Unchanged"
+                and resolution_dict[project_config["VideoResolution"]] == '')):
+                if not BatchJobRunning:
+                    logging.error("Error, no video resolution selected")
+                    tk.messagebox.showerror("Error!", "Please specify video resolution.")
+                else:
+                    logging.error(f"Cannot generate video {TargetVideoFilename}, no video resolution selected")
+                generation_exit(success = False)
             else:
-                logging.error(f"Cannot generate video {TargetVideoFilename}, no video resolution selected")
-            generation_exit(success = False)
-        else:
-            ffmpeg_success = False
-            ffmpeg_encoding_status = ffmpeg_state.Pending
-            win.after(1000, video_generation_loop)
+                ffmpeg_success = False
+                ffmpeg_encoding_status = ffmpeg_state.Pending
+                win.after(1000, video_generation_loop)
+
+# Creates the stream to send generated frames to ffmpeg, with the video settings of the current project: Images
+# (streaming mode), frame files (follow mode) or frames in the frame store. Returns None if video has to be encoded
+# once all frames are generated (title requested, as title frames go first and are created from the generated frames)
+# Command line is built once the size of the frames is known, from a worker thread, so no UI is accessed there
+def create_frame_stream():
+    output_path = os.path.join(video_target_dir_str.get(), TargetVideoFilename)
+    resolution = project_config["VideoResolution"]
+    denoise = perform_denoise.get()
+    preset = ffmpeg_preset.get()
+    video_fps = VideoFps
+    count = frames_to_encode
+    if stream_to_ffmpeg_active():
+        return FfmpegFrameStream(lambda frame_size: build_ffmpeg_command(None, None, 0, count, video_fps, resolution, frame_size,
+                                                                         denoise, preset, output_path, pipe_input='rawvideo'),
+                                 StartFrame, frame_stream_memory_budget())
+    elif frame_store is not None:
+        return FfmpegStoreStream(lambda frame_size: build_ffmpeg_command(None, None, 0, count, video_fps, resolution, frame_size,
+                                                                         denoise, preset, output_path, pipe_input='rawvideo'),
+                                 StartFrame, frame_store, first_absolute_frame)
+    elif video_title_str.get() == "":
+        target_dir = TargetDir
+        first_frame = first_absolute_frame
+        out_type = file_type_out
+        return FfmpegFileStream(lambda frame_size: build_ffmpeg_command(None, None, 0, count, video_fps, resolution, frame_size,
+                                                                        denoise, preset, output_path, pipe_input='image2pipe'),
+                                StartFrame,
+                                lambda frame_idx: os.path.join(target_dir, FrameOutputFilenamePattern % (first_frame + frame_idx, out_type)))
+    return None
+
+
+# Creates the prefetcher reading source frames ahead of the encoding workers (None if disabled). Worker processes
+# receive the file contents and decode them: Much smaller to transfer than decoded images, and decoding is done
+# in parallel anyway. Worker threads receive decoded images (OpenCV releases the GIL while decoding)
+# If source cache is enabled, frames are copied to it further ahead (see create_source_stager)
+def create_frame_prefetcher(config, frames):
+    if num_io_threads <= 0:
+        return None
+    if process_engine_active(config):
+        return FramePrefetcher(lambda frame_idx: read_frame_source(frame_idx, config), frames, num_io_threads,
+                               4 * num_threads, create_source_stager(config, frames))
+    return FramePrefetcher(lambda frame_idx: load_frame_source(frame_idx, config), frames, num_io_threads,
+                           num_threads + num_io_threads, create_source_stager(config, frames))
+
+
+# Corrections done in FrameSync viewer (offsets and threshold) of the frames in a bad frame list, as expected by
+# PipelineConfig (frame_corrections). Frames detected as misaligned but not corrected are not included
+def get_frame_corrections(bad_frames):
+    corrections = {}
+    for bad_frame in bad_frames:
+        if (bad_frame['x'] != 0 or bad_frame['y'] != 0
+                or bad_frame['threshold'] != bad_frame.get('original_threshold', bad_frame['threshold'])):
+            corrections[bad_frame['frame_idx']] = (bad_frame['x'], bad_frame['y'], bad_frame['threshold'])
+    return corrections
+
+
+# Creates the table of hole detection results of the frames (None if not stabilizing): Loaded from the transforms
+# cache for frames already processed with the same settings, recorded while encoding for the others
+def create_frame_transforms(config):
+    if not config.perform_stabilization:
+        return None
+    transforms = FrameTransforms(config.source_dir, config, len(SourceDirFileList))
+    loaded = transforms.load()
+    logging.info(f"Frame transforms cached for {loaded} frames, holes detected only for the remaining ones")
+    return transforms
+
 
 def generation_exit(success = True):
-    global win
+    global win, frame_store
     global ConvertLoopExitRequested
     global ConvertLoopRunning
     global Go_btn, save_bg, save_fg
@@ -4977,6 +4988,10 @@ def generation_exit(success = True):
     go_suspend = False
     stop_batch = False
 
+    if frame_store is not None:
+        frame_store.close()
+        frame_store = None
+
     if BatchJobRunning:
         if ConvertLoopExitRequested or CurrentJobEntry == -1:
             stop_batch = True
@@ -5016,115 +5031,145 @@ def generation_exit(success = True):
         time.sleep(2)
 
 
-def frame_encode(frame_idx, id, do_save = True, offset_x = 0, offset_y = 0):
-    global SourceDir, TargetDir
-    global HdrFilesOnly , first_absolute_frame, frames_to_encode
-    global FrameInputFilenamePattern, HdrSetInputFilenamePattern, FrameHdrInputFilenamePattern, FrameOutputFilenamePattern
-    global CropTopLeft, CropBottomRight
-    global app_status_label
-    global subprocess_event_queue
-    global FrameSync_Viewer_opened
-    global file_type, file_type_out
-
-    images_to_merge = []
-    img_ref_aux = None
+def frame_encode(frame_idx, id, do_save = True, offset_x = 0, offset_y = 0, config = None, ctx = None, stream = None,
+                 prefetcher = None):
+    if config is None:  # Not part of an encoding job (FrameSync viewer), use current settings
+        config = build_pipeline_config()
+    if ctx is None:
+        ctx = ui_worker_context
 
     if dev_debug_enabled:
         logging.debug(f"Thread {id}, starting to encode Frame {frame_idx}")
 
-    # Get current file(s)
-    if HdrFilesOnly:    # Legacy HDR (before 2 Dec 2023): Dedicated filename
-        images_to_merge.clear()
-        file1 = os.path.join(SourceDir, HdrSetInputFilenamePattern % (frame_idx + first_absolute_frame, 1, file_type))
-        img_ref = cv2.imread(file1, cv2.IMREAD_UNCHANGED)   # Keep first frame of the set for stabilization reference
-        images_to_merge.append(img_ref)
-        file2 = os.path.join(SourceDir, HdrSetInputFilenamePattern % (frame_idx + first_absolute_frame, 2, file_type))
-        images_to_merge.append(cv2.imread(file2, cv2.IMREAD_UNCHANGED))
-        file3 = os.path.join(SourceDir, HdrSetInputFilenamePattern % (frame_idx + first_absolute_frame, 3, file_type))
-        images_to_merge.append(cv2.imread(file3, cv2.IMREAD_UNCHANGED))
-        file4 = os.path.join(SourceDir, HdrSetInputFilenamePattern % (frame_idx + first_absolute_frame, 4, file_type))
-        images_to_merge.append(cv2.imread(file4, cv2.IMREAD_UNCHANGED))
-        AlignMtb.process(images_to_merge, images_to_merge)
-        img = MergeMertens.process(images_to_merge)
-        img = img - img.min()  # Now between 0 and 8674
-        img = img / img.max() * 255
-        img = np.uint8(img)
-    else:
-        file1 = os.path.join(SourceDir, FrameInputFilenamePattern % (frame_idx + first_absolute_frame, file_type))
-        if not os.path.isfile(file1):
-            file_type = 'png' if file_type == 'jpg' else 'jpg'  # Try with the other file type
-            file1 = os.path.join(SourceDir, FrameInputFilenamePattern % (frame_idx + first_absolute_frame, file_type))
-        # read image
-        img = cv2.imread(file1, cv2.IMREAD_UNCHANGED)
-        img_ref = img   # Reference image is the same image for standard capture
-        # Check if HDR frames exist. Can handle between 2 and 5
-        file2 = os.path.join(SourceDir, FrameHdrInputFilenamePattern % (frame_idx + first_absolute_frame, 2, file_type))
-        if os.path.isfile(file2):   # If hdr frames exist, add them
-            images_to_merge.clear()
-            images_to_merge.append(img_ref)     # Add first frame
-            img_ref_aux = img_ref
-            img_ref = cv2.imread(file2, cv2.IMREAD_UNCHANGED) # Override stabilization reference with HDR#2
-            images_to_merge.append(img_ref)
-            file3 = os.path.join(SourceDir, FrameHdrInputFilenamePattern % (frame_idx + first_absolute_frame, 3, file_type))
-            if os.path.isfile(file3):  # If hdr frames exist, add them
-                images_to_merge.append(cv2.imread(file3, cv2.IMREAD_UNCHANGED))
-                file4 = os.path.join(SourceDir, FrameHdrInputFilenamePattern % (frame_idx + first_absolute_frame, 4, file_type))
-                if os.path.isfile(file4):  # If hdr frames exist, add them
-                    images_to_merge.append(cv2.imread(file4, cv2.IMREAD_UNCHANGED))
-                    file5 = os.path.join(SourceDir, FrameHdrInputFilenamePattern % (frame_idx + first_absolute_frame, 5, file_type))
-                    if os.path.isfile(file5):  # If hdr frames exist, add them
-                        images_to_merge.append(cv2.imread(file5, cv2.IMREAD_UNCHANGED))
-
-            AlignMtb.process(images_to_merge, images_to_merge)
-            img = MergeMertens.process(images_to_merge)
-            img = img - img.min()  # Now between 0 and 8674
-            img = img / img.max() * 255
-            img = np.uint8(img)
+    source = prefetcher.get(frame_idx) if prefetcher is not None else None
+    img, frame_info = encode_frame(frame_idx, config, ctx, do_save, offset_x, offset_y, source,
+                                   frame_writer if ConvertLoopRunning else None)
+    write = frame_info.pop('write', None)
+    if img is not None:
+        report_encoded_frame(frame_idx, img, frame_info)
+    if write is not None:   # Frame being saved by frame_writer: Reported once written
+        write.add_done_callback(lambda future: report_written_frame(frame_idx, future.result(), stream))
+    if stream is not None and (stream.needs_images or write is None):
+        # Frame files sent only if actually saved (left out of the video otherwise)
+        stream.put(frame_idx, img if stream.needs_images else frame_info.get('saved', False))
 
-    if img is None:
-        logging.error(
-            "Error reading frame %i, skipping", frame_idx)
-    else:
-        register_frame()
-        if perform_rotation.get():
-            img = rotate_image(img)
-        if perform_stabilization.get() or FrameSync_Viewer_opened:
-            img = stabilize_image(frame_idx, img, img_ref, offset_x, offset_y, img_ref_aux, id)
-        if perform_cropping.get():
-            img = crop_image(img, CropTopLeft, CropBottomRight)
-        else:
-            img = even_image(img)
-        if perform_denoise.get():
-            img = denoise_image(img)
-        if perform_sharpness.get():
-            # Sharpness code taken from https://www.educative.io/answers/how-to-sharpen-a-blurred-image-using-opencv
-            sharpen_filter = np.array([[-1, -1, -1],
-                                       [-1, 9, -1],
-                                       [-1, -1, -1]])
-            # applying kernels to the input image to get the sharpened image
-            img = cv2.filter2D(img, -1, sharpen_filter)
-        if perform_gamma_correction.get():
-            img = gamma_correct_image(img, float(gamma_correction_str.get()))
-
-        # Before we used to display every other frame, but just discovered that it makes no difference to performance
-        # Instead of displaying image, we add it to a queue to be processed in main loop
-        if ConvertLoopRunning:
-            queue_item = tuple(("processed_image", frame_idx, img, len(images_to_merge) != 0))
-            subprocess_event_queue.put(queue_item)
+    if dev_debug_enabled:
+        logging.debug(f"Thread {id}, finalized to encode Frame {frame_idx}")
+
+    return frame_info['merged']
 
-        if img.shape[1] % 2 == 1 or img.shape[0] % 2 == 1:
-            logging.error("Target size, one odd dimension")
-            status_str = "Status: Frame %d - odd size" % frame_idx
-            app_status_label.config(text=status_str, fg='red')
-            frame_idx = StartFrame + frames_to_encode - 1
 
-        if do_save and os.path.isdir(TargetDir):
-            target_file = os.path.join(TargetDir, FrameOutputFilenamePattern % (first_absolute_frame + frame_idx, file_type_out))
-            cv2.imwrite(target_file, img)
+# Encode frame in one of the processes of the pool. Called from the encoding threads, which in this case
+# only dispatch the frames and report the results (the GIL is released while waiting for the worker process)
+def frame_encode_in_process(frame_idx, id):
     if dev_debug_enabled:
-        logging.debug(f"Thread {id}, finalized to encode Frame {frame_idx}")
+        logging.debug(f"Thread {id}, dispatching Frame {frame_idx} to process pool")
+    stream = frame_stream
+    prefetcher = frame_prefetcher
+    try:
+        source = prefetcher.get(frame_idx) if prefetcher is not None else None
+        preview, frame_info, img = process_pool.submit(process_engine_encode, frame_idx, PreviewRatio,
+                                                       stream is not None and stream.needs_images, source).result()
+    except Exception as e:
+        logging.error(f"Thread {id}: Exception while encoding frame {frame_idx} in process pool: {e}")
+        if stream is not None:
+            stream.put(frame_idx, None)     # Do not hold the frames after this one
+        return False
+
+    if preview is not None:
+        report_encoded_frame(frame_idx, preview, frame_info, True)
+    if stream is not None:
+        stream.put(frame_idx, img if stream.needs_images else frame_info.get('saved', False))
+
+    return frame_info['merged']
+
+
+# Frames are encoded in worker processes if requested (-p), unless they are denoised: Frames are denoised in sequence
+# order, with the frames before them encoded by other workers (see DenoiseWindow), which worker processes cannot share
+def process_engine_active(config):
+    return use_process_engine and not (config.perform_denoise and not config.analysis_only)
+
+
+# Memory for frames waiting to be written or sent to ffmpeg: All of frame_memory_budget in headless mode (no previews)
+def frame_stream_memory_budget(headless = False):
+    return frame_memory_budget if headless else frame_memory_budget - frame_memory_budget // 8
+
+
+# Records a frame saved in the target folder
+def record_saved_frame(frame_idx):
+    if output_index is not None:
+        output_index.record_frame(frame_idx, pipeline_config)
+    if completion_journal is not None:
+        completion_journal.record(frame_idx)
+
+
+# Called from frame_writer threads once a frame has been written. Frame files are sent to ffmpeg only once written
+def report_written_frame(frame_idx, saved, stream):
+    if saved:
+        record_saved_frame(frame_idx)
+    if stream is not None and not stream.needs_images:
+        stream.put(frame_idx, saved)
+
+
+# Records the results of a frame encoding. Called from the encoding threads during an encoding session: Results
+# (with a reduced copy of the image, full image is saved or sent to ffmpeg by the worker already) are queued, UI is
+# updated with them by frame_generation_loop, as Tk is not thread-safe
+def report_encoded_frame(frame_idx, img, frame_info, is_preview = False):
+    register_frame()
+    if frame_info.get('saved', False):
+        record_saved_frame(frame_idx)
+    if 'stabilization' in frame_info and frame_transforms is not None:
+        frame_transforms.record(frame_idx, frame_info['stabilization'])
+
+    if threading.current_thread() is not threading.main_thread():
+        preview = img if is_preview or not ConvertLoopRunning else resize_image(img, PreviewRatio)
+        queue_item = tuple(("processed_preview", frame_idx, preview, frame_info['merged'], frame_info))
+        subprocess_event_queue.put(queue_item)
+    else:
+        report_frame_info(frame_idx, frame_info)
+
+
+# Updates UI (and variables owned by the UI) with the results of a frame encoding. UI thread only
+# Widgets are updated only if display is set (most recent frame of those reported by workers)
+def report_frame_info(frame_idx, frame_info, display = True):
+    if 'stabilization' in frame_info:
+        record_stabilization_info(frame_idx, frame_info['stabilization'])
+        if display:
+            display_stabilization_info(frame_idx, frame_info['stabilization'])
+    if frame_info['odd_size']:
+        logging.error("Target size, one odd dimension")
+        status_str = "Status: Frame %d - odd size" % frame_idx
+        app_status_label.config(text=status_str, fg='red')
+
+
+# Process engine: Functions below run in the worker processes, where no UI exists
+def process_engine_init(config):
+    global process_worker_config, process_worker_context
+
+    process_worker_config = config
+    process_worker_context = WorkerContext(os.getpid())
+
+
+def process_engine_encode(frame_idx, preview_ratio, return_image = False, source = None):
+    img, frame_info = encode_frame(frame_idx, process_worker_config, process_worker_context, source=source)
+    # Frame is saved by the worker, only a reduced copy for the preview is sent back to the UI process
+    # Full image is sent back as well only if requested (frames streamed to ffmpeg as images)
+    preview = resize_image(img, preview_ratio) if img is not None else None
+    return preview, frame_info, img if return_image else None
+
+
+# Headless mode: No preview required, only report if frame could be encoded (and the image, if requested)
+def process_engine_encode_only(frame_idx, return_image = False, source = None):
+    img, frame_info = encode_frame(frame_idx, process_worker_config, process_worker_context, source=source)
+    return img is not None, frame_info, img if return_image else None
+
+
+# Hit rate of the transforms cache, for the status line (empty if not stabilizing)
+def transforms_cache_status():
+    if transforms_cache_lookups == 0:
+        return ""
+    return f" - Cache: {transforms_cache_hits * 100 // transforms_cache_lookups}%"
 
-    return len(images_to_merge) != 0
 
 def frame_update_ui(frame_idx, merged):
     global first_absolute_frame, StartFrame, frames_to_encode, FPS_CalculatedValue
@@ -5133,31 +5178,38 @@ def frame_update_ui(frame_idx, merged):
     frame_selected.set(frame_idx)
     frame_slider.set(frame_idx)
     refresh_current_frame_ui_info(frame_idx, first_absolute_frame)
-    status_str = f"Status: Generating{' merged' if merged else ''} frames {((frame_idx - StartFrame+1) * 100 / frames_to_encode):.1f}%"
+    action = "Analyzing" if pipeline_config.analysis_only else "Generating"
+    status_str = f"Status: {action}{' merged' if merged else ''} frames {((frame_idx - StartFrame+1) * 100 / frames_to_encode):.1f}%"
     if FPS_CalculatedValue != -1:  # FPS not calculated yet, display some indication
         status_str = status_str + f' (FPS:{FPS_CalculatedValue:.1f})'
+    status_str = status_str + transforms_cache_status()
     app_status_label.config(text=status_str, fg='black')
 
 
-def frame_encoding_thread(queue, event, id):
-    global SourceDir
+def frame_encoding_thread(queue, event, id, config):
     global ConvertLoopExitRequested, ConvertLoopRunning
     global active_threads, working_threads
     global last_displayed_image
 
     try:
         logging.debug(f"Thread {id} started")
+        ctx = WorkerContext(id)
         while not event.is_set():
             message = queue.get()
-            if not os.path.isdir(SourceDir):
-                logging.error(f"Source dir {SourceDir} unmounted: Stop encoding session")
-            if message[0] == "encode_frame":
-                # Encode frame
-                merged = frame_encode(message[1], id)
-                # Update UI with progress so far (double check we have not ended, it might happen during frame encoding)
-                if ConvertLoopRunning:
-                    if message[1] >= last_displayed_image:
-                        frame_update_ui(message[1], merged)
+            if not os.path.isdir(config.source_dir):
+                logging.error(f"Source dir {config.source_dir} unmounted: Stop encoding session")
+            if message[0] == "encode_frame" and message[1] in frames_up_to_date:
+                # Incremental regeneration: Frame already generated with current settings
+                if frame_stream is not None:
+                    frame_stream.put(message[1], True)
+                subprocess_event_queue.put(("skipped_frame", message[1]))
+            elif message[0] == "encode_frame":
+                # Encode frame (progress displayed by frame_generation_loop, from the results reported)
+                if process_pool is not None:
+                    frame_encode_in_process(message[1], id)
+                else:
+                    frame_encode(message[1], id, config=config, ctx=ctx, stream=frame_stream,
+                                 prefetcher=frame_prefetcher)
             elif message[0] == END_TOKEN:
                 logging.debug(f"Thread {id}: Received terminate token, exiting")
                 break
@@ -5179,18 +5231,10 @@ def check_subprocess_event_queue(user_terminated):
     # Process requests coming from workers
     while not subprocess_event_queue.empty():
         message = subprocess_event_queue.get()
-        # Display encoded images from queue
-        if message[0] == "processed_image":
-            img = message[2]
+        # Display encoded images from queue (results of the frames are recorded all the same, for the session statistics)
+        if message[0] == "processed_preview":
             frame_idx = message[1]
-            if img.shape[1] % 2 == 1 or img.shape[0] % 2 == 1:
-                logging.error("Target size, one odd dimension")
-                status_str = "Status: Frame %d - odd size" % message[1]
-                app_status_label.config(text=status_str, fg='red')
-                #frame_idx = StartFrame + frames_to_encode - 1
-            if os.path.isdir(TargetDir):
-                target_file = os.path.join(TargetDir, FrameOutputFilenamePattern % (first_absolute_frame + frame_idx, file_type_out))
-                cv2.imwrite(target_file, img)
+            report_frame_info(frame_idx, message[4], False)
             if not user_terminated:    # Display image
                 if frame_idx >= last_displayed_image:
                     last_displayed_image = frame_idx
@@ -5214,27 +5258,42 @@ def frame_generation_loop():
     global ffmpeg_success, ffmpeg_encoding_status
     global TargetDirFileList
     global frame_slider
-    global MergeMertens
     global FPS_CalculatedValue
     global HdrFilesOnly
     global frame_encoding_queue
     global last_displayed_image, working_threads
     global frame_encoding_queue, subprocess_event_queue
     global file_type_out
+    global frame_stream
+    global target_manifest
 
-    # Display encoded images from queue
-    if not subprocess_event_queue.empty():
+    # Process results reported by workers since last refresh. Only the most recent frame is displayed
+    preview = None
+    for i in range(subprocess_event_queue.qsize()):
         message = subprocess_event_queue.get()
-        if message[0] == "processed_image" and message[1] > last_displayed_image:
+        if message[0] == "processed_preview":
+            report_frame_info(message[1], message[4], False)
+            if message[1] > last_displayed_image:
+                last_displayed_image = message[1]
+                preview = message
+        elif message[0] == "skipped_frame" and message[1] > last_displayed_image:
             last_displayed_image = message[1]
-            if subprocess_event_queue.qsize() < 5:
-                display_image(message[2])
-            
+    if preview is not None and ConvertLoopRunning:
+        display_image(preview[2], False)
+        frame_update_ui(preview[1], preview[3])
+        if 'stabilization' in preview[4]:
+            display_stabilization_info(preview[1], preview[4]['stabilization'])
+    # Frames are added to encoding queue by frame_dispatcher
+    CurrentFrame = frames_dispatched
+    project_config["CurrentFrame"] = CurrentFrame
+
 
     if CurrentFrame >= StartFrame + frames_to_encode and last_displayed_image+1 >= StartFrame + frames_to_encode:
         FPS_CalculatedValue = -1
         # write average match quality in the status line, and in the widget
-        status_str = f"Status: Frame generation OK - AvgQ: {int(match_level_average.get_average()*100)}"
+        status_str = f"Status: Frame generation OK - AvgQ: {int(match_level_average.get_average()*100)}{transforms_cache_status()}"
+        if match_evaluations_average.get_average() is not None:
+            logging.debug(f"Average template matches per frame (last 50 frames): {match_evaluations_average.get_average():.1f}")
         app_status_label.config(text=status_str, fg='green')
         stabilization_threshold_match_label.config(fg='white', bg=match_level_color(match_level_average.get_average()),
                                                    text=str(int(match_level_average.get_average() * 100)))
@@ -5242,9 +5301,10 @@ def frame_generation_loop():
         # subprocess_event_queue.queue.clear()
         last_displayed_image = 0
         win.update()
-        # Refresh Target dir file list
-        TargetDirFileList = sorted(list(glob(os.path.join(
-            TargetDir, FrameCheckOutputFilenamePattern % file_type_out))))
+        # Refresh Target dir file list (no frame files if saved in frame store)
+        if frame_store is None:
+            target_manifest = get_folder_manifest(target_manifest, TargetDir, stat_files=False)
+            TargetDirFileList = list(target_manifest.match(FrameCheckOutputFilenamePattern % file_type_out))
         if GenerateCsv:
             CsvFile.close()
             name, ext = os.path.splitext(CsvPathName)
@@ -5255,7 +5315,11 @@ def frame_generation_loop():
         # Sort bad frame list
         bad_frame_list.sort(key=lambda x: x['frame_idx'])
         # Generate video if requested or terminate
-        if generate_video.get():
+        if frame_stream is not None:    # Frames being sent to ffmpeg already, wait for it to complete the video
+            frame_stream.close()
+            ffmpeg_encoding_status = ffmpeg_state.Running
+            win.after(100, video_stream_loop)
+        elif generate_video.get() and not pipeline_config.analysis_only:
             ffmpeg_success = False
             ffmpeg_encoding_status = ffmpeg_state.Pending
             win.after(1000, video_generation_loop)
@@ -5280,6 +5344,10 @@ def frame_generation_loop():
         if GenerateCsv:
             CsvFile.close()
             os.unlink(CsvPathName)  # Processing was stopped half-way, delete csv file as results are not representative
+        # Stop ffmpeg before workers, as they might be waiting to deliver a frame to it
+        if frame_stream is not None:
+            frame_stream.abort()
+            frame_stream = None
         # Stop workers
         terminate_threads(True)
         # Sort bad frame list
@@ -5299,18 +5367,7 @@ def frame_generation_loop():
         win.update()
         return
 
-    # Add item to encoding queue
-    if CurrentFrame < StartFrame + frames_to_encode and not frame_encoding_queue.full():
-        frame_encoding_queue.put(("encode_frame", CurrentFrame))
-        # If inserting the first few frames, add a delay so that workers are interleaved
-        # Improves visual preview, no effect on processing speed
-        if CurrentFrame < StartFrame + num_threads:
-            time.sleep(0.3)
-        CurrentFrame += 1
-        project_config["CurrentFrame"] = CurrentFrame
-        win.after(1, frame_generation_loop)
-    else:   # If queue is full, wait a bit longer
-        win.after(100, frame_generation_loop)
+    win.after(frame_generation_ui_period, frame_generation_loop)
 
 
 def get_text_dimensions(text_string, font):
@@ -5409,6 +5466,68 @@ def video_create_title():
         title_duration = 0
         title_num_frames = 0
 
+# Derives ffmpeg input pattern (printf style) from the name of the first file of a numbered sequence
+# Returns None if the filename contains no number
+def get_ffmpeg_sequence_pattern(filename):
+    file_name_part, file_ext_part = os.path.splitext(os.path.basename(filename))
+    numbers_found = re.findall(r'\d+', file_name_part)
+    if not numbers_found:
+        return None
+    last_number_str = numbers_found[-1]
+    padding = len(last_number_str)
+    pattern_base = file_name_part.rsplit(last_number_str, 1)
+    return f"{pattern_base[0]}%0{padding}d{pattern_base[1]}{file_ext_part}"
+
+
+# Builds ffmpeg command line to encode a video from a frame sequence, without accessing UI
+# video_resolution is a key of resolution_dict, frame_size (width, height) is used if no resolution is selected there
+# If pipe_input is set, frames are read from standard input instead of from files: 'rawvideo' (bgr24, see
+# FfmpegFrameStream) or 'image2pipe' (image files, see FfmpegFileStream). input_dir and pattern are not used then
+def build_ffmpeg_command(input_dir, pattern, start_number, frames_to_encode, video_fps, video_resolution, frame_size,
+                         denoise, preset, output_path, title_pattern = None, pipe_input = None):
+    user_selected_resolution = False
+    video_width, video_height = str(frame_size[0]), str(frame_size[1])
+    if video_resolution in resolution_dict and resolution_dict[video_resolution] != '':
+        user_selected_resolution = True
+        video_width, video_height = resolution_dict[video_resolution].split(':')
+
+    cmd_ffmpeg = [FfmpegBinName, '-y', '-loglevel', 'info', '-stats', '-flush_packets', '1']
+
+    if title_pattern is not None:
+        cmd_ffmpeg.extend(['-f', 'image2', '-framerate', str(video_fps), '-start_number', str(start_number), '-i', os.path.join(input_dir, title_pattern)])
+
+    if pipe_input == 'rawvideo':
+        cmd_ffmpeg.extend(['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{frame_size[0]}x{frame_size[1]}", '-framerate', str(video_fps), '-i', '-'])
+    elif pipe_input == 'image2pipe':
+        cmd_ffmpeg.extend(['-f', 'image2pipe', '-framerate', str(video_fps), '-i', '-'])
+    else:
+        cmd_ffmpeg.extend(['-f', 'image2', '-framerate', str(video_fps), '-start_number', str(start_number), '-i', os.path.join(input_dir, pattern)])
+
+    filter_complex_options = ''
+    main_video_input_stream = '[0:v]'
+    if title_pattern is not None:
+        main_video_input_stream = '[1:v]'
+        filter_complex_options += f'[0:v]scale={video_width}:{video_height}:force_original_aspect_ratio=decrease,pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2,setsar=1'
+        if denoise: filter_complex_options += ',hqdn3d=8:6:4:3'
+        filter_complex_options += '[v0];'
+
+    filter_complex_options += f'{main_video_input_stream}trim=start_frame=0:end_frame={frames_to_encode},setpts=PTS-STARTPTS'
+    if user_selected_resolution:
+        filter_complex_options += f',scale={video_width}:{video_height}:force_original_aspect_ratio=decrease,pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2,setsar=1'
+    if denoise: filter_complex_options += ',hqdn3d=8:6:4:3'
+
+    if title_pattern is not None:
+        filter_complex_options += '[v_main];'
+        filter_complex_options += '[v0][v_main]concat=n=2:v=1[v]'
+    else:
+        filter_complex_options += '[v]'
+
+    cmd_ffmpeg.extend(['-filter_complex', filter_complex_options])
+    cmd_ffmpeg.extend(['-an', '-vcodec', 'libx264', '-preset', preset, '-crf', '18', '-pix_fmt', 'yuv420p', '-map', '[v]', '-frames:v', str(frames_to_encode), output_path])
+
+    return cmd_ffmpeg
+
+
 def call_ffmpeg():
     global VideoTargetDir, TargetDir, SourceDir, cmd_ffmpeg, ffmpeg_preset, FfmpegBinName
     global TargetVideoFilename, StartFrame, first_absolute_frame, frames_to_encode
@@ -5417,60 +5536,27 @@ def call_ffmpeg():
     global subprocess_event_queue
 
     try:
-        user_selected_resolution = False
-        video_width, video_height = str(frame_width), str(frame_height)
-        if project_config["VideoResolution"] in resolution_dict and resolution_dict[project_config["VideoResolution"]] != '':
-            user_selected_resolution = True
-            video_width, video_height = resolution_dict[project_config["VideoResolution"]].split(':')
-
-        cmd_ffmpeg = [FfmpegBinName, '-y', '-loglevel', 'info', '-stats', '-flush_packets', '1']
-        
         input_dir = SourceDir if skip_frame_regeneration.get() else TargetDir
         start_num_for_ffmpeg = first_absolute_frame if skip_frame_regeneration.get() else StartFrame + first_absolute_frame
+        title_pattern = None
 
         if skip_frame_regeneration.get():
             if not SourceDirFileList:
                 subprocess_event_queue.put(('ffmpeg_error', "La lista dei file di origine è vuota."))
                 return
-            first_filename = os.path.basename(SourceDirFileList[0])
-            file_name_part, file_ext_part = os.path.splitext(first_filename)
-            numbers_found = re.findall(r'\d+', file_name_part)
-            if not numbers_found:
+            pattern = get_ffmpeg_sequence_pattern(SourceDirFileList[0])
+            if pattern is None:
                 subprocess_event_queue.put(('ffmpeg_error', "Nessun numero trovato nei nomi dei file."))
                 return
-            last_number_str = numbers_found[-1]
-            padding = len(last_number_str)
-            pattern_base = file_name_part.rsplit(last_number_str, 1)
-            pattern = f"{pattern_base[0]}%0{padding}d{pattern_base[1]}{file_ext_part}"
         else:
             pattern = FrameOutputFilenamePattern_for_ffmpeg + file_type_out
             if title_num_frames > 0:
                 title_pattern = TitleOutputFilenamePattern_for_ffmpeg + file_type_out
-                cmd_ffmpeg.extend(['-f', 'image2', '-framerate', str(VideoFps), '-start_number', str(start_num_for_ffmpeg), '-i', os.path.join(input_dir, title_pattern)])
-
-        cmd_ffmpeg.extend(['-f', 'image2', '-framerate', str(VideoFps), '-start_number', str(start_num_for_ffmpeg), '-i', os.path.join(input_dir, pattern)])
-
-        filter_complex_options = ''
-        main_video_input_stream = '[0:v]'
-        if title_num_frames > 0 and not skip_frame_regeneration.get():
-            main_video_input_stream = '[1:v]'
-            filter_complex_options += f'[0:v]scale={video_width}:{video_height}:force_original_aspect_ratio=decrease,pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2,setsar=1'
-            if perform_denoise.get(): filter_complex_options += ',hqdn3d=8:6:4:3'
-            filter_complex_options += '[v0];'
-
-        filter_complex_options += f'{main_video_input_stream}trim=start_frame=0:end_frame={frames_to_encode},setpts=PTS-STARTPTS'
-        if user_selected_resolution:
-            filter_complex_options += f',scale={video_width}:{video_height}:force_original_aspect_ratio=decrease,pad={video_width}:{video_height}:(ow-iw)/2:(oh-ih)/2,setsar=1'
-        if perform_denoise.get(): filter_complex_options += ',hqdn3d=8:6:4:3'
-        
-        if title_num_frames > 0 and not skip_frame_regeneration.get():
-            filter_complex_options += '[v_main];'
-            filter_complex_options += '[v0][v_main]concat=n=2:v=1[v]'
-        else:
-            filter_complex_options += '[v]'
 
-        cmd_ffmpeg.extend(['-filter_complex', filter_complex_options])
-        cmd_ffmpeg.extend(['-an', '-vcodec', 'libx264', '-preset', ffmpeg_preset.get(), '-crf', '18', '-pix_fmt', 'yuv420p', '-map', '[v]', '-frames:v', str(frames_to_encode), os.path.join(video_target_dir_str.get(), TargetVideoFilename)])
+        cmd_ffmpeg = build_ffmpeg_command(input_dir, pattern, start_num_for_ffmpeg, frames_to_encode, VideoFps,
+                                          project_config["VideoResolution"], (frame_width, frame_height),
+                                          perform_denoise.get(), ffmpeg_preset.get(),
+                                          os.path.join(video_target_dir_str.get(), TargetVideoFilename), title_pattern)
 
         logging.debug("Generated ffmpeg command: %s", cmd_ffmpeg)
         
@@ -5574,6 +5660,521 @@ def video_generation_loop():
         
         generation_exit(success=ffmpeg_success)
 
+
+# Streaming/follow mode: Frame generation has finished, wait for ffmpeg to encode the frames still in its input
+def video_stream_loop():
+    global frame_stream, ffmpeg_success, ffmpeg_encoding_status
+
+    if ConvertLoopExitRequested:
+        frame_stream.abort()
+    if frame_stream.is_running():
+        percent = min(100.0, frame_stream.encoded_frames * 100 / frames_to_encode)
+        app_status_label.config(text=f"Status: Generating video {percent:.1f}%", fg='black')
+        frame_slider.set(StartFrame + frame_stream.encoded_frames)
+        win.after(100, video_stream_loop)
+        return
+
+    ffmpeg_success = frame_stream.wait()
+    if frame_stream.frames_skipped > 0:
+        logging.warning(f"{frame_stream.frames_skipped} frames could not be generated, not included in the video")
+    frame_stream = None
+    ffmpeg_encoding_status = ffmpeg_state.Completed
+    video_generation_loop()
+
+"""
+#########################
+Headless batch processing
+#########################
+"""
+
+# Activates the template to be used by a project (custom one if defined, otherwise the one for the film type),
+# scaled to the size of the frames. UI-free equivalent of the template part of decode_project_config
+def headless_set_template(project, frame_width):
+    film = project.get("FilmType", 'S8')
+    custom_filename = None
+    if project.get("CustomTemplateDefined", False):
+        template_name = project.get("CustomTemplateName", os.path.split(project["SourceDir"])[-1])
+        custom_filename = project.get("CustomTemplateFilename",
+                                      os.path.join(resources_dir, f"Pattern.custom.{template_name}.jpg"))
+        if os.path.isfile(custom_filename):
+            template_list.add(template_name, custom_filename, "custom",
+                              tuple(project.get("CustomTemplateExpectedPos", (0, 0))))
+        else:
+            logging.warning(f"Custom template {custom_filename} not found, using default {film} template")
+            custom_filename = None
+    if custom_filename is None and not template_list.set_active(film, film):
+        return False
+    template_list.set_scale(frame_width)
+    return True
+
+
+def headless_stream_to_ffmpeg(project):
+    return project.get("GenerateVideo", False) and project.get("StreamToFfmpeg", False)
+
+
+# Builds the settings snapshot for a job straight from its project dictionary (as saved in the job list)
+# Corrections done in FrameSync viewer for a source folder (saved in its bad frame list, see get_bad_frame_list_filename)
+def headless_frame_corrections(source_dir):
+    filename = os.path.join(resources_dir, f"{os.path.split(source_dir)[-1]}.badframes.json")
+    try:
+        with open(filename) as f:
+            bad_frames = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if len(bad_frames) > 0 and isinstance(bad_frames[0], list):   # Old format, see load_bad_frame_list
+        bad_frames = [{'frame_idx': bad_frame[0], 'x': bad_frame[1], 'y': bad_frame[2], 'threshold': bad_frame[3]}
+                      for bad_frame in bad_frames]
+    return get_frame_corrections(bad_frames)
+
+
+def headless_analysis_only(project):
+    return project.get("PerformStabilization", False) and project.get("AnalysisOnly", False)
+
+
+def headless_pipeline_config(project, first_frame, file_type_out, hdr_files_only, frame_size, source_manifest = None,
+                             output_params = ()):
+    template = template_list.get_active_template().copy()
+    template.setflags(write=False)
+    if 'CropRectangle' in project:
+        crop_top_left = tuple(project["CropRectangle"][0])
+        crop_bottom_right = tuple(project["CropRectangle"][1])
+        perform_crop = project.get("PerformCropping", False)
+    else:
+        crop_top_left = (0, 0)
+        crop_bottom_right = (0, 0)
+        perform_crop = False
+    if crop_bottom_right == (0, 0):
+        crop_bottom_right = frame_size
+    gamma = float(project.get("GammaCorrectionValue", 2.2))
+    if gamma <= 0:
+        gamma = 0.1
+    return PipelineConfig(
+        source_dir=project["SourceDir"],
+        target_dir=project["TargetDir"],
+        first_absolute_frame=first_frame,
+        file_type=file_type,
+        file_type_out=file_type_out,
+        output_params=output_params,
+        frame_store=project.get("FrameStore", False),
+        source_cache=source_cache,
+        hdr_files_only=hdr_files_only,
+        hdr_fast_align=project.get("HdrFastAlign", False),
+        hdr_merge_scale=hdr_proxy_merge_scale if project.get("HdrProxyMerge", False) else 1.0,
+        perform_rotation=project.get("PerformRotation", False),
+        rotation_angle=float(project.get("RotationAngle", 0)),
+        perform_stabilization=project.get("PerformStabilization", False),
+        use_simple_stabilization=use_simple_stabilization,
+        film_type=project.get("FilmType", 'S8'),
+        stabilization_threshold=float(StabilizationThreshold_default),
+        threshold_sweep=True,
+        low_contrast_custom_template=project.get("LowContrastCustomTemplate", False),
+        precise_template_match=project.get("PreciseTemplateMatch", precise_template_match),
+        template=template,
+        template_position=template_list.get_active_position(),
+        template_pyramid=template_list.get_active_pyramid(),
+        stabilization_shift=project.get("StabilizationShift", 0),
+        frame_fill_type=project.get("FrameFillType", 'fake'),
+        fill_missing_rows=True,
+        perform_cropping=perform_crop,
+        crop_top_left=crop_top_left,
+        crop_bottom_right=crop_bottom_right,
+        perform_denoise=project.get("PerformDenoise", False),
+        perform_sharpness=project.get("PerformSharpness", False),
+        perform_gamma_correction=project.get("PerformGammaCorrection", False),
+        gamma_correction_value=gamma,
+        save_frames=(not headless_stream_to_ffmpeg(project) or project.get("KeepIntermediateFrames", False))
+                    and not headless_analysis_only(project),
+        analysis_only=headless_analysis_only(project),
+        source_manifest=source_manifest)
+
+
+# Thread pool worker for headless mode: Each thread keeps its own worker context
+# If writer is provided, frame is saved by it (see FrameWriter), and frame info contains the Future of the write
+def headless_encode_in_thread(frame_idx, config, return_image = False, prefetcher = None, writer = None):
+    if not hasattr(headless_thread_data, 'ctx'):
+        headless_thread_data.ctx = WorkerContext(next(headless_worker_ids))
+    source = prefetcher.get(frame_idx) if prefetcher is not None else None
+    img, frame_info = encode_frame(frame_idx, config, headless_thread_data.ctx, source=source, writer=writer)
+    return img is not None, frame_info, img if return_image else None
+
+
+# Submits frames to executor, yielding results in frame order. No more than window frames are submitted ahead of
+# the one being yielded, so results waiting to be consumed (which might include full images) are limited
+# If prefetcher is provided, source frame read by it is passed to fn as well (as last argument)
+# Frames in skip (up to date, see OutputIndex) are not submitted, a result flagged as 'skipped' is yielded instead
+def headless_ordered_results(executor, fn, frame_range, args, window, prefetcher = None, skip = ()):
+    pending = deque()
+    for frame_idx in frame_range:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        if frame_idx in skip:
+            skipped = Future()
+            skipped.set_result((True, {'merged': False, 'odd_size': False, 'skipped': True}, None))
+            pending.append(skipped)
+        elif prefetcher is not None:
+            pending.append(executor.submit(fn, frame_idx, *args, prefetcher.get(frame_idx)))
+        else:
+            pending.append(executor.submit(fn, frame_idx, *args))
+    while pending:
+        yield pending.popleft().result()
+
+
+# If stream is provided, generated frames are sent to it (in order) as well
+# If outputs is provided (incremental regeneration), frames up to date are not generated again
+# If store is provided, frames are saved to it (see FrameStore)
+def headless_generate_frames(label, config, start_frame, frames_to_encode, stream = None, transforms = None,
+                             outputs = None, store = None):
+    frame_range = range(start_frame, start_frame + frames_to_encode)
+    if config.perform_denoise and not config.analysis_only:
+        config = replace(config, denoise_window=DenoiseWindow(start_frame))
+    up_to_date = set()
+    if outputs is not None:
+        up_to_date = outputs.check_frames(config, frame_range)
+        print(f"[{label}] {len(up_to_date)} frames up to date, {frames_to_encode - len(up_to_date)} to be generated", flush=True)
+    # Resume job if interrupted before (not possible if frames are not saved, ffmpeg requires their images, or frames
+    # are denoised, see incremental_regeneration_active)
+    journal = None
+    if config.save_frames and not config.analysis_only and (stream is None or not stream.needs_images) \
+            and not config.perform_denoise:
+        journal = CompletionJournal(config.target_dir)
+        resumed = journal.open(config, frame_range, store)
+        if len(resumed) > 0:
+            print(f"[{label}] Resuming interrupted job: {len(resumed)} frames already generated", flush=True)
+            up_to_date = up_to_date | resumed
+    prefetcher = create_frame_prefetcher(config, [frame_idx for frame_idx in frame_range if frame_idx not in up_to_date])
+    writer = None
+    if use_process_engine and not process_engine_active(config):
+        print(f"[{label}] Temporal denoise enabled: Frames encoded by threads instead of worker processes", flush=True)
+    if process_engine_active(config):
+        executor = ProcessPoolExecutor(max_workers=num_threads, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=process_engine_init, initargs=(config,))
+        results = headless_ordered_results(executor, process_engine_encode_only, frame_range,
+                                           (stream is not None and stream.needs_images,), 4 * num_threads, prefetcher,
+                                           up_to_date)
+    else:
+        # Frames saved by writer threads, apart from encoding ones
+        if config.save_frames and not config.analysis_only and store is None and num_writer_threads > 0:
+            writer = FrameWriter(num_writer_threads, frame_stream_memory_budget(True))
+        executor = ThreadPoolExecutor(max_workers=num_threads)
+        results = headless_ordered_results(executor, headless_encode_in_thread, frame_range,
+                                           (config, stream is not None and stream.needs_images, prefetcher, writer),
+                                           4 * num_threads, skip=up_to_date)
+    encoded = 0
+    errors = 0
+    match_level_total = 0.0
+    match_level_count = 0
+    match_evaluations_total = 0
+    match_tracked_count = 0
+    cache_hits = 0
+    allocated_bytes_total = 0   # Only if allocations are traced (python -X tracemalloc), see encode_frame
+    buffer_allocations_total = 0
+    traced_count = 0
+    last_percent = -1
+    start_time = time.time()
+    completed = False
+    try:
+        for frame_idx, (ok, frame_info, img) in zip(frame_range, results):
+            encoded += 1
+            if not ok:
+                errors += 1
+            if 'write' in frame_info:   # Wait for the frame to be written (frames written in order are reported)
+                frame_info['saved'] = frame_info.pop('write').result()
+            if stream is not None:   # Frame files sent only if saved (or up to date already)
+                stream.put(frame_idx, img if stream.needs_images
+                           else frame_info.get('saved', False) or frame_info.get('skipped', False))
+            if outputs is not None and frame_info.get('saved', False):
+                outputs.record_frame(frame_idx, config)
+            if journal is not None and frame_info.get('saved', False):
+                journal.record(frame_idx)
+            if 'stabilization' in frame_info:
+                match_level_total += frame_info['stabilization']['match_level']
+                match_evaluations_total += frame_info['stabilization']['match_evaluations']
+                match_tracked_count += frame_info['stabilization']['match_tracked']
+                cache_hits += frame_info['stabilization'].get('cached', False)
+                match_level_count += 1
+                if transforms is not None:
+                    transforms.record(frame_idx, frame_info['stabilization'])
+            if 'allocated_bytes' in frame_info:
+                allocated_bytes_total += frame_info['allocated_bytes']
+                buffer_allocations_total += frame_info['buffer_allocations']
+                traced_count += 1
+            percent = encoded * 100 // frames_to_encode
+            if percent != last_percent:
+                last_percent = percent
+                fps = encoded / max(time.time() - start_time, 0.001)
+                avg_q = f", AvgQ {int(match_level_total * 100 / match_level_count)}" if match_level_count > 0 else ""
+                print(f"[{label}] {'Analyzing' if config.analysis_only else 'Generating'} frames: {encoded}/{frames_to_encode} ({percent}%), {fps:.1f} FPS{avg_q}", flush=True)
+        completed = True
+    finally:
+        if config.denoise_window is not None:
+            config.denoise_window.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+        if prefetcher is not None:
+            prefetcher.close()
+        if writer is not None:
+            writer.close()
+        if journal is not None:     # Kept if interrupted, to resume the job when run again
+            journal.close(completed)
+
+    if match_level_count > 0:
+        print(f"[{label}] Template matches per frame: {match_evaluations_total / match_level_count:.2f}, "
+              f"hole found by tracker in {match_tracked_count * 100 / match_level_count:.0f}% of frames, "
+              f"transforms cache hits {cache_hits * 100 / match_level_count:.0f}%", flush=True)
+    if writer is not None and writer.get_stats()[0] > 0:
+        frames_written, latency, write_time, latency_max = writer.get_stats()
+        print(f"[{label}] {frames_written} frames written, latency {latency * 1000:.1f} ms "
+              f"({write_time * 1000:.1f} ms writing), maximum {latency_max * 1000:.1f} ms", flush=True)
+    if traced_count > 0:
+        print(f"[{label}] Memory allocated per frame: {allocated_bytes_total / traced_count / 1048576:.1f} MB, "
+              f"{buffer_allocations_total} worker buffers allocated", flush=True)
+    if errors > 0:
+        print(f"[{label}] {errors} frames could not be read", flush=True)
+    return errors == 0
+
+
+# Returns resolution, fps and output file of the video to generate for a job, or None if no valid resolution is set
+def headless_video_settings(label, project):
+    resolution = project.get("VideoResolution", '1600x1200 (UXGA)')
+    if resolution not in resolution_dict or (resolution != "Unchanged" and resolution_dict[resolution] == ''):
+        print(f"[{label}] Cannot generate video, no video resolution selected", flush=True)
+        return None
+    video_filename = project.get("VideoFilename", "")
+    name, ext = os.path.splitext(video_filename)
+    if video_filename == "":
+        video_filename = "AfterScan-" + datetime.now().strftime("%Y_%m_%d-%H-%M-%S") + ".mp4"
+    elif ext.lower() not in ['.mp4', '.mkv']:
+        video_filename += ".mp4"
+    video_target_dir = project.get("VideoTargetDir", project["TargetDir"])
+    if not os.path.isdir(video_target_dir):
+        video_target_dir = project["TargetDir"]
+    if project.get("VideoTitle", "") != "":
+        logging.warning(f"Job {label}: Video title is not generated in headless mode")
+    video_fps = project.get("VideoFps", '18' if project.get("FilmType", 'S8') == 'S8' else '16')
+    return resolution, video_fps, os.path.join(video_target_dir, video_filename)
+
+
+def headless_generate_video(label, project, input_dir, pattern, start_number, frames_to_encode, frame_size):
+    video_settings = headless_video_settings(label, project)
+    if video_settings is None:
+        return False
+    resolution, video_fps, video_path = video_settings
+
+    cmd_ffmpeg = build_ffmpeg_command(input_dir, pattern, start_number, frames_to_encode, video_fps, resolution,
+                                      frame_size, project.get("PerformDenoise", False),
+                                      project.get("FFmpegPreset", "veryfast"), video_path)
+    logging.debug("Generated ffmpeg command: %s", cmd_ffmpeg)
+
+    ffmpeg_process = sp.Popen(cmd_ffmpeg, stdout=sp.PIPE, stderr=sp.STDOUT, universal_newlines=True, encoding='utf-8', errors='ignore')
+    last_percent = -1
+    for line in iter(ffmpeg_process.stdout.readline, ''):
+        line = line.strip()
+        if not line:
+            continue
+        logging.debug(line)
+        match = re.search(r"frame=\s*(\d+)", line)
+        if match:
+            percent = min(100, int(match.group(1)) * 100 // frames_to_encode)
+            if percent != last_percent:
+                last_percent = percent
+                print(f"[{label}] Generating video: {percent}%", flush=True)
+    ffmpeg_process.stdout.close()
+    success = ffmpeg_process.wait() == 0
+    print(f"[{label}] Video {video_path} {'generated' if success else 'generation failed'}", flush=True)
+    return success
+
+
+# Generates frames sending them to ffmpeg as they are produced, instead of encoding the video from the frame files
+# afterwards: Images are sent directly in streaming mode, frame files are sent as they are written otherwise
+def headless_generate_frames_and_video(label, project, config, start_frame, frames_to_encode, transforms = None,
+                                       outputs = None, store = None):
+    video_settings = headless_video_settings(label, project)
+    if video_settings is None:
+        return False
+    resolution, video_fps, video_path = video_settings
+    denoise = project.get("PerformDenoise", False)
+    preset = project.get("FFmpegPreset", "veryfast")
+    if headless_stream_to_ffmpeg(project):
+        stream = FfmpegFrameStream(lambda frame_size: build_ffmpeg_command(None, None, 0, frames_to_encode, video_fps, resolution,
+                                                                           frame_size, denoise, preset, video_path,
+                                                                           pipe_input='rawvideo'),
+                                   start_frame, frame_stream_memory_budget(True))
+    elif store is not None:
+        stream = FfmpegStoreStream(lambda frame_size: build_ffmpeg_command(None, None, 0, frames_to_encode, video_fps, resolution,
+                                                                           frame_size, denoise, preset, video_path,
+                                                                           pipe_input='rawvideo'),
+                                   start_frame, store, config.first_absolute_frame)
+    else:
+        stream = FfmpegFileStream(lambda frame_size: build_ffmpeg_command(None, None, 0, frames_to_encode, video_fps, resolution,
+                                                                          frame_size, denoise, preset, video_path,
+                                                                          pipe_input='image2pipe'),
+                                  start_frame,
+                                  lambda frame_idx: os.path.join(config.target_dir, FrameOutputFilenamePattern % (
+                                      config.first_absolute_frame + frame_idx, config.file_type_out)))
+    try:
+        if not headless_generate_frames(label, config, start_frame, frames_to_encode, stream, transforms, outputs,
+                                        store):
+            stream.abort()
+            return False
+    except BaseException:
+        stream.abort()
+        raise
+    print(f"[{label}] Frames generated, waiting for ffmpeg to complete video", flush=True)
+    success = stream.wait()
+    print(f"[{label}] Video {video_path} {'generated' if success else 'generation failed'}", flush=True)
+    return success
+
+
+# Runs a single job from the job list without UI: Frame generation and, if requested, video generation
+def headless_run_job(label, project):
+    source_dir = project.get("SourceDir", "")
+    target_dir = project.get("TargetDir", "")
+    skip_generation = project.get("skip_frame_regeneration", False)
+
+    if not os.path.isdir(source_dir):
+        print(f"[{label}] Source folder '{source_dir}' does not exist", flush=True)
+        return False
+    if not skip_generation and not os.path.isdir(target_dir):
+        print(f"[{label}] Target folder '{target_dir}' does not exist", flush=True)
+        return False
+
+    manifest = FrameManifest(source_dir, save_cache=True)
+    file_list, legacy_hdr_file_list, num_hdr_files, out_type = list_source_frames(source_dir, skip_generation, manifest)
+    if len(manifest.gaps) > 0:
+        print(f"[{label}] Warning: {len(manifest.gaps)} gaps in source frame sequence, first one at frame {manifest.gaps[0][0]}", flush=True)
+    # If both standard and legacy HDR files exist, use the most numerous (interactive mode asks the user)
+    hdr_files_only = len(legacy_hdr_file_list) > len(file_list)
+    if hdr_files_only:
+        file_list = legacy_hdr_file_list
+    if len(file_list) == 0:
+        print(f"[{label}] The source folder does not contain supported images", flush=True)
+        return False
+    first_frame = get_frame_number_from_filename(file_list[0])
+    if first_frame is None:
+        print(f"[{label}] Files in the source folder do not have sequential numbers in their names", flush=True)
+        return False
+
+    if project.get("EncodeAllFrames", True):
+        start_frame = 0
+        frames_to_encode = len(file_list)
+    else:
+        start_frame = int(project.get("FrameFrom", 0))
+        frames_to_encode = int(project.get("FrameTo", 0)) - start_frame + 1
+        frames_to_encode = min(frames_to_encode, len(file_list) - start_frame)
+    if frames_to_encode <= 0:
+        print(f"[{label}] The number of frames to process is zero", flush=True)
+        return False
+
+    # Take frame size from a frame 10% ahead in the set, like in interactive mode
+    sample_frame = start_frame + int((len(file_list) - start_frame) * 0.1)
+    sample_image = cv2.imread(file_list[sample_frame], cv2.IMREAD_UNCHANGED)
+    if sample_image is None:
+        print(f"[{label}] Cannot read frame {file_list[sample_frame]}", flush=True)
+        return False
+    frame_size = (sample_image.shape[1], sample_image.shape[0])
+
+    if project.get("GenerateVideo", False) and not ffmpeg_installed:
+        print(f"[{label}] Cannot generate video, ffmpeg is not installed", flush=True)
+        return False
+
+    if skip_generation:
+        pattern = get_ffmpeg_sequence_pattern(file_list[0])
+        if pattern is None:
+            print(f"[{label}] No number found in source file names", flush=True)
+            return False
+        if project.get("GenerateVideo", False):
+            return headless_generate_video(label, project, source_dir, pattern, first_frame, frames_to_encode, frame_size)
+        return True
+
+    if not headless_set_template(project, frame_size[0]):
+        print(f"[{label}] Cannot set template for film type {project.get('FilmType', 'S8')}", flush=True)
+        return False
+    out_type, output_params = get_intermediate_format(project.get("IntermediateFormat", intermediate_format_default),
+                                                      out_type)
+    config = headless_pipeline_config(project, first_frame, out_type, hdr_files_only, frame_size, manifest,
+                                      output_params)
+    # Hole detection results are taken from the transforms cache if available (see create_frame_transforms)
+    transforms = None
+    if config.perform_stabilization:
+        transforms = FrameTransforms(source_dir, config, len(file_list))
+        print(f"[{label}] Frame transforms cached for {transforms.load()} frames", flush=True)
+        config = replace(config, frame_transforms=transforms)
+    # Frame store allocated for the whole reel (see FrameStore)
+    store = None
+    if config.frame_store and config.save_frames and not config.analysis_only:
+        x_start, y_start, x_end, y_end = get_output_area(frame_size[0], frame_size[1], config)
+        store = FrameStore(target_dir)
+        try:
+            store.open(first_frame, len(file_list), (x_end - x_start, y_end - y_start))
+        except OSError as e:
+            print(f"[{label}] Cannot create frame store: {e}", flush=True)
+            return False
+    # Incremental regeneration, applying corrections done in FrameSync viewer (see incremental_regeneration_active)
+    outputs = None
+    if (project.get("IncrementalRegeneration", False) and not config.analysis_only and not config.perform_denoise
+            and not (project.get("GenerateVideo", False) and headless_stream_to_ffmpeg(project))):
+        config = replace(config, frame_corrections=headless_frame_corrections(source_dir))
+        outputs = OutputIndex(target_dir, store)
+        outputs.load()
+    try:
+        if project.get("GenerateVideo", False) and not config.analysis_only:   # Video is encoded while frames are generated
+            return headless_generate_frames_and_video(label, project, config, start_frame, frames_to_encode, transforms,
+                                                      outputs, store)
+        return headless_generate_frames(label, config, start_frame, frames_to_encode, transforms=transforms,
+                                        outputs=outputs, store=store)
+    finally:
+        if store is not None:
+            store.close()
+        if source_cache is not None:
+            source_cache.save()
+        if transforms is not None:
+            transforms.save()
+        if outputs is not None:
+            outputs.save()
+
+
+def headless_save_job_list(jobs, filename):
+    if not IgnoreConfig:
+        with open(filename, 'w+') as f:
+            json.dump(jobs, f, indent=4)
+
+
+# Headless entry point: Runs all pending jobs in the job list, printing progress to stdout.
+# Job 'attempted' and 'done' flags are updated in the job list file as jobs run
+def headless_run_job_list(filename):
+    try:
+        with open(filename) as f:
+            jobs = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Cannot load job list {filename}: {e}", flush=True)
+        return False
+
+    for entry in jobs:
+        jobs[entry]['attempted'] = jobs[entry]['done']  # Reset attempted flag for those not done yet
+    pending = [entry for entry in jobs if not jobs[entry]['done']]
+    print(f"Job list {filename}: {len(jobs)} jobs, {len(pending)} pending", flush=True)
+
+    failed = 0
+    for entry in pending:
+        jobs[entry]['attempted'] = True
+        headless_save_job_list(jobs, filename)
+        print(f"[{entry}] Starting job: {jobs[entry].get('description', '')}", flush=True)
+        start_time = time.time()
+        try:
+            success = headless_run_job(entry, jobs[entry]['project'])
+        except Exception as e:
+            logging.exception(f"Job {entry}: Exception while processing")
+            print(f"[{entry}] Exception while processing job: {e}", flush=True)
+            success = False
+        jobs[entry]['done'] = success
+        headless_save_job_list(jobs, filename)
+        if not success:
+            failed += 1
+        print(f"[{entry}] Job {'completed' if success else 'failed'} in {time.time() - start_time:.0f} s", flush=True)
+
+    print(f"Job list completed: {len(pending) - failed} jobs done, {failed} failed", flush=True)
+    return failed == 0
+
+
 """
 ###############################
 Application top level functions
@@ -5616,15 +6217,16 @@ def multiprocessing_init():
     if num_threads == 0:
         if num_cores is not None:
             logging.debug(f"{num_cores} cores available")
-            num_threads = int(num_cores/2)
+            # Worker processes are not limited by the GIL, use all cores but one (left for UI and dispatching)
+            num_threads = max(1, num_cores - 1) if use_process_engine else max(1, num_cores // 2)
         else:
             logging.debug("Unable to determine number of cores available")
             num_threads = 4
 
-    logging.debug(f"Creating {num_threads} threads")
+    logging.debug(f"Creating {num_threads} {'worker processes' if use_process_engine else 'threads'}")
 
     frame_encoding_queue = queue.Queue(maxsize=20)
-    subprocess_event_queue = queue.Queue(maxsize=20)
+    subprocess_event_queue = FrameQueue(frame_memory_budget // 8, 20)
 
 
 def init_display():
@@ -5679,7 +6281,7 @@ def init_logging():
     logging.info("Log file: %s", log_file_fullpath)
 
 
-def verify_templates():
+def verify_templates(interactive = True):
     retvalue = True
     error_message = ""
     files_missing = []
@@ -5703,10 +6305,44 @@ def verify_templates():
         if len(files_invalid) > 0:
             error_message += f"Invalid files: {', '.join(files_invalid)}"
         error_message += f"\r\nPlease install the correct template files for AfterScan {__version__} and try again."
-        tk.messagebox.showerror("Error!", error_message)
+        if interactive:
+            tk.messagebox.showerror("Error!", error_message)
     return retvalue, error_message
 
 
+def detect_ffmpeg():
+    global FfmpegBinName
+    global IsWindows, IsLinux, IsMac
+
+    ffmpeg_installed = False
+    if platform.system() == 'Windows':
+        IsWindows = True
+        logging.debug("Detected Windows OS")
+        FfmpegBinName = 'ffmpeg.exe'
+        if is_ffmpeg_installed():
+            ffmpeg_installed = True
+        else:
+            logging.warning("ffmpeg.exe not found in the PATH, the default path C:\\ffmpeg\\bin\\ffmpeg.exe is attempted.")
+            FfmpegBinName = 'C:\\ffmpeg\\bin\\ffmpeg.exe'
+            if is_ffmpeg_installed():
+                ffmpeg_installed = True
+    else:
+        if platform.system() == 'Linux':
+            IsLinux = True
+            logging.debug("Detected Linux OS")
+        elif platform.system() == 'Darwin':
+            IsMac = True
+            logging.debug("Detected Darwin (MacOS) OS")
+        else:
+            logging.debug("OS not recognized: " + platform.system())
+        
+        FfmpegBinName = 'ffmpeg'
+        if is_ffmpeg_installed():
+            ffmpeg_installed = True
+
+    return ffmpeg_installed
+
+
 def afterscan_init():
     global win, as_tooltips
     global TopWinX
@@ -5716,8 +6352,7 @@ def afterscan_init():
     global PreviewWidth, PreviewHeight
     global screen_height
     global BigSize, FontSize
-    global MergeMertens, AlignMtb
-    global match_level_average, horizontal_offset_average
+    global match_level_average, match_evaluations_average, ui_worker_context
 
     win = Tk()  # Create main window, store it in 'win'
 
@@ -5754,16 +6389,14 @@ def afterscan_init():
 
     # Init rolling Averages
     match_level_average = RollingAverage(50)
-    horizontal_offset_average = RollingAverage(50)
+    match_evaluations_average = RollingAverage(50)
 
     # Get Top window coordinates
     TopWinX = win.winfo_x()
     TopWinY = win.winfo_y()
 
-    # Create MergeMertens Object for HDR
-    MergeMertens = cv2.createMergeMertens()
-    # Create Align MTB object for HDR
-    AlignMtb = cv2.createAlignMTB()
+    # Worker context (HDR merge objects, rolling averages) for frames encoded from the UI thread
+    ui_worker_context = WorkerContext()
 
     WinInitDone = True
 
@@ -5819,6 +6452,7 @@ def build_ui():
     global Go_btn
     global Exit_btn
     global video_fps_dropdown_selected, skip_frame_regeneration_cb
+    global stream_to_ffmpeg, stream_to_ffmpeg_cb, keep_intermediate_frames, keep_intermediate_frames_cb
     global video_fps_dropdown, video_fps_label, video_filename_name, video_filename_str, video_title_name, video_title_str
     global resolution_dropdown, resolution_label, resolution_dropdown_selected
     global video_target_folder_btn, video_filename_label, video_title_label
@@ -5851,6 +6485,10 @@ def build_ui():
     global low_contrast_custom_template
     global display_template_popup_btn
     global stabilization_shift_value, stabilization_shift_label, stabilization_shift_spinbox
+    global analysis_only, analysis_only_checkbox, incremental_regeneration, incremental_regeneration_checkbox
+    global intermediate_format_selected, intermediate_format_dropdown, intermediate_format_benchmark_btn
+    global use_frame_store, frame_store_checkbox, frame_store_export_btn
+    global hdr_proxy_merge, hdr_proxy_merge_checkbox, hdr_fast_align, hdr_fast_align_checkbox
     global video_fps_dropdown, video_fps_label, video_filename_name, video_filename_str, video_title_name, video_title_str
     global resolution_dropdown, resolution_label, resolution_dropdown_selected
     global video_target_folder_btn, video_filename_label, video_title_label
@@ -6181,6 +6819,87 @@ def build_ui():
     stabilization_shift_spinbox.bind("<FocusOut>", select_stabilization_shift)
     postprocessing_row += 1
 
+    # Two-pass stabilization: analysis pass stores hole positions in the transforms cache, used when generating frames
+    analysis_only = tk.BooleanVar(value=False)
+    analysis_only_checkbox = tk.Checkbutton(
+        postprocessing_frame, text='Analysis only',
+        variable=analysis_only, onvalue=True, offvalue=False,
+        command=analysis_only_selection, font=("Arial", FontSize))
+    analysis_only_checkbox.grid(row=postprocessing_row, column=0, columnspan=1, sticky=W)
+    as_tooltips.add(analysis_only_checkbox, "Only detect sprocket holes and save their position in the source folder, "
+                                            "to be used when generating the frames. No frames nor video are generated")
+    # Incremental regeneration: Generate only the frames changed since they were generated
+    incremental_regeneration = tk.BooleanVar(value=False)
+    incremental_regeneration_checkbox = tk.Checkbutton(
+        postprocessing_frame, text='Changed frames only',
+        variable=incremental_regeneration, onvalue=True, offvalue=False,
+        command=incremental_regeneration_selection, font=("Arial", FontSize))
+    incremental_regeneration_checkbox.grid(row=postprocessing_row, column=1, columnspan=2, sticky=W)
+    as_tooltips.add(incremental_regeneration_checkbox, "Generate only frames not generated yet, or which settings or source "
+                                                       "files changed since they were generated. Corrections done in "
+                                                       "FrameSync viewer are applied as well")
+    postprocessing_row += 1
+
+    # Format of generated frames, and benchmark to choose it
+    intermediate_format_label = Label(postprocessing_frame, text='Frame format:', font=("Arial", FontSize))
+    intermediate_format_label.grid(row=postprocessing_row, column=0, sticky=W)
+    intermediate_format_selected = StringVar(value=intermediate_format_default)
+    intermediate_format_dropdown = OptionMenu(postprocessing_frame, intermediate_format_selected,
+                                              *intermediate_formats.keys(), command=set_intermediate_format)
+    intermediate_format_dropdown.config(takefocus=1, font=("Arial", FontSize))
+    intermediate_format_dropdown.grid(row=postprocessing_row, column=1, sticky=W)
+    as_tooltips.add(intermediate_format_dropdown, "Format of the generated frames. Lossless formats preserve quality, "
+                                                  "at the cost of bigger files. Uncompressed frames are the fastest "
+                                                  "to write and read back, if there is enough disk space")
+    intermediate_format_benchmark_btn = Button(postprocessing_frame, text='Benchmark', width=8, height=1,
+                                               command=benchmark_intermediate_format_selection,
+                                               activebackground='green', activeforeground='white',
+                                               font=("Arial", FontSize))
+    intermediate_format_benchmark_btn.grid(row=postprocessing_row, column=2, sticky=W)
+    as_tooltips.add(intermediate_format_benchmark_btn, "Measure write/read time and size per frame of each format, "
+                                                       "using a few frames of the current reel")
+    postprocessing_row += 1
+
+    # Frame store: All generated frames saved in a single file, instead of a file per frame
+    use_frame_store = tk.BooleanVar(value=False)
+    frame_store_checkbox = tk.Checkbutton(
+        postprocessing_frame, text='Single file frame store',
+        variable=use_frame_store, onvalue=True, offvalue=False,
+        command=frame_store_selection, font=("Arial", FontSize))
+    frame_store_checkbox.grid(row=postprocessing_row, column=0, columnspan=2, sticky=W)
+    as_tooltips.add(frame_store_checkbox, "Save generated frames, uncompressed, in a single file of the target folder "
+                                          "(AfterScan-frames.bin) instead of a file per frame. Video is encoded "
+                                          "from it. Space for all the frames of the reel is reserved when starting")
+    frame_store_export_btn = Button(postprocessing_frame, text='Export', width=8, height=1,
+                                    command=export_frame_store,
+                                    activebackground='green', activeforeground='white',
+                                    font=("Arial", FontSize))
+    frame_store_export_btn.grid(row=postprocessing_row, column=2, sticky=W)
+    as_tooltips.add(frame_store_export_btn, "Write the frames in the frame store to the target folder, as image files "
+                                            "in the selected frame format")
+    postprocessing_row += 1
+
+    # HDR proxy merge: Bracketed images merged at reduced resolution, for quick test renders
+    hdr_proxy_merge = tk.BooleanVar(value=False)
+    hdr_proxy_merge_checkbox = tk.Checkbutton(
+        postprocessing_frame, text='HDR proxy merge',
+        variable=hdr_proxy_merge, onvalue=True, offvalue=False,
+        command=hdr_proxy_merge_selection, font=("Arial", FontSize))
+    hdr_proxy_merge_checkbox.grid(row=postprocessing_row, column=0, columnspan=2, sticky=W)
+    as_tooltips.add(hdr_proxy_merge_checkbox, "Merge HDR bracketed images at half resolution, several times faster, "
+                                              "with some loss of detail. For test renders")
+    # HDR fast alignment: Alignment of bracketed images calculated at reduced resolution, reused while stable
+    hdr_fast_align = tk.BooleanVar(value=False)
+    hdr_fast_align_checkbox = tk.Checkbutton(
+        postprocessing_frame, text='Fast align',
+        variable=hdr_fast_align, onvalue=True, offvalue=False,
+        command=hdr_fast_align_selection, font=("Arial", FontSize))
+    hdr_fast_align_checkbox.grid(row=postprocessing_row, column=2, sticky=W)
+    as_tooltips.add(hdr_fast_align_checkbox, "Align HDR bracketed images with shifts calculated at half resolution "
+                                             "(2 pixel steps), reused while they do not change. Faster, slightly "
+                                             "less precise alignment")
+    postprocessing_row += 1
+
     ### Cropping controls
     # Check box to do cropping or not
     cropping_btn = Button(postprocessing_frame, text='Define crop area',
@@ -6312,6 +7031,30 @@ def build_ui():
 
     video_row += 1
 
+    # Check box to stream frames to ffmpeg while they are generated
+    stream_to_ffmpeg = tk.BooleanVar(value=False)
+    stream_to_ffmpeg_cb = tk.Checkbutton(
+        video_frame, text='Stream to FFmpeg',
+        variable=stream_to_ffmpeg, onvalue=True, offvalue=False,
+        command=stream_to_ffmpeg_selection,
+        width=15, font=("Arial", FontSize))
+    stream_to_ffmpeg_cb.grid(row=video_row, column=0, sticky=W, padx=5)
+    stream_to_ffmpeg_cb.config(state=DISABLED)
+    as_tooltips.add(stream_to_ffmpeg_cb, "Send frames to FFmpeg as they are generated, instead of encoding the video from the frame files once all of them have been generated. Faster, but video title is not supported")
+
+    # Check box to keep frame files when streaming
+    keep_intermediate_frames = tk.BooleanVar(value=False)
+    keep_intermediate_frames_cb = tk.Checkbutton(
+        video_frame, text='Keep frame files',
+        variable=keep_intermediate_frames, onvalue=True, offvalue=False,
+        width=20, font=("Arial", FontSize))
+    keep_intermediate_frames_cb.grid(row=video_row, column=1,
+                                     columnspan=2, sticky=W, padx=5)
+    keep_intermediate_frames_cb.config(state=DISABLED)
+    as_tooltips.add(keep_intermediate_frames_cb, "When streaming frames to FFmpeg, write generated frames to the target folder as well")
+
+    video_row += 1
+
     # Video target folder
     video_target_dir_str = StringVar()
     video_target_dir = Entry(video_frame, textvariable=video_target_dir_str, width=30, borderwidth=1, font=("Arial", FontSize))
@@ -6656,6 +7399,8 @@ def exit_app():  # Exit Application
     save_general_config()
     save_project_config()
     save_job_list()
+    if source_cache is not None:
+        source_cache.save()
     win.destroy()
 
 
@@ -6736,7 +7481,9 @@ def main(argv):
     global GenerateCsv
     global suspend_on_joblist_end
     global BatchAutostart
-    global num_threads
+    global num_threads, num_io_threads, frame_memory_budget, num_writer_threads
+    global use_process_engine
+    global source_cache_size, source_cache_dir, source_cache
     global use_simple_stabilization
     global dev_debug_enabled
     
@@ -6762,7 +7509,9 @@ def main(argv):
     template_list.add("WB", hole_template_filename_wb, "aux", (0, 0))
     template_list.add("Corner", hole_template_filename_corner, "aux", (0, 0))
 
-    opts, args = getopt.getopt(argv, "hiel:dcst:12nab", ["goanyway"])
+    headless = False
+
+    opts, args = getopt.gnu_getopt(argv, "hiel:dcst:r:m:w:k:12nabp", ["goanyway", "headless", "cache-dir="])
 
     for opt, arg in opts:
         if opt == '-l':
@@ -6779,6 +7528,18 @@ def main(argv):
             BatchAutostart = True
         elif opt == '-t':
             num_threads = int(arg)
+        elif opt == '-r':
+            num_io_threads = int(arg)
+        elif opt == '-m':
+            frame_memory_budget = int(arg) * 1024 * 1024
+        elif opt == '-w':
+            num_writer_threads = int(arg)
+        elif opt == '-k':
+            source_cache_size = int(float(arg) * 1024 * 1024 * 1024)
+        elif opt == '--cache-dir':
+            source_cache_dir = os.path.abspath(arg)
+        elif opt == '-p':
+            use_process_engine = True
         elif opt == '-1':
             ForceSmallSize = True
         elif opt == '-2':
@@ -6792,6 +7553,8 @@ def main(argv):
             dev_debug_enabled = True
         elif opt == '--goanyway':
             goanyway = True
+        elif opt == '--headless':
+            headless = True
         elif opt == '-h':
             print("AfterScan")
             print("  -l <log mode>  Set log level:")
@@ -6802,8 +7565,17 @@ def main(argv):
             print("  -c             Generate CSV file with misaligned frames")
             print("  -s             Initiate batch on startup (and suspend on batch completion)")
             print("  -t <num>       Number of threads")
+            print("  -r <num>       Number of threads reading frames ahead of the encoding threads (0 to disable)")
+            print("  -p             Encode frames in worker processes instead of threads (use -t to set how many)")
+            print("  -m <MB>        Memory for frames waiting to be displayed, written or sent to ffmpeg (default 1024)")
+            print("  -w <num>       Number of threads writing generated frames (0 to write them in the encoding threads)")
+            print("  -k <GB>        Size of local copy of source frames, for source folders in network shares (0, default, to disable)")
+            print("  --cache-dir <folder>")
+            print(f"                 Folder for local copy of source frames, saved in a subfolder '{source_cache_subfolder}' (default {source_cache_dir_default})")
             print("  -1             Initiate on 'small screen' mode (resolution lower than than Full HD)")
             print("  -a             Use simple stabilization algorithm, not requiring templates (but slightly less precise)")
+            print("  --headless [job list file]")
+            print("                 Run pending jobs of job list (default one if not specified) without UI, then exit")
             exit()
 
     if goanyway:
@@ -6811,6 +7583,14 @@ def main(argv):
         tk.messagebox.showerror("WIP", "Work in progress, version not usable yet.")
         return
 
+    if headless:    # Resolve job list path before changing CWD
+        if len(args) > 0:
+            headless_job_list = os.path.abspath(args[0])
+        elif os.path.isfile(default_job_list_filename):
+            headless_job_list = default_job_list_filename
+        else:   # Legacy job list (before 1.20.13)
+            headless_job_list = default_job_list_filename_legacy
+
     # Set our CWD to the same folder where the script is. 
     # Otherwise webbrowser failt to launch (cannot open path of the current working directory: Permission denied)
     os.chdir(script_dir) 
@@ -6821,11 +7601,23 @@ def main(argv):
     else:
         init_logging()
 
-    templates_ok, error_msg = verify_templates()
+    templates_ok, error_msg = verify_templates(not headless)
     if not templates_ok:
         logging.error(error_msg)
+        if headless:
+            print(error_msg)
+            sys.exit(1)
         return
 
+    if source_cache_size > 0:
+        source_cache = SourceCache(source_cache_dir, source_cache_size)
+
+    if headless:    # No UI: Run job list and exit
+        multiprocessing_init()
+        if not detect_ffmpeg():
+            print("FFmpeg is not installed in this computer, video generation will not be possible")
+        sys.exit(0 if headless_run_job_list(headless_job_list) else 1)
+
     load_general_config()
 
     afterscan_init()
@@ -6840,31 +7632,7 @@ def main(argv):
 
     multiprocessing_init()
 
-    ffmpeg_installed = False
-    if platform.system() == 'Windows':
-        IsWindows = True
-        logging.debug("Detected Windows OS")
-        FfmpegBinName = 'ffmpeg.exe'
-        if is_ffmpeg_installed():
-            ffmpeg_installed = True
-        else:
-            logging.warning("ffmpeg.exe not found in the PATH, the default path C:\\ffmpeg\\bin\\ffmpeg.exe is attempted.")
-            FfmpegBinName = 'C:\\ffmpeg\\bin\\ffmpeg.exe'
-            if is_ffmpeg_installed():
-                ffmpeg_installed = True
-    else:
-        if platform.system() == 'Linux':
-            IsLinux = True
-            logging.debug("Detected Linux OS")
-        elif platform.system() == 'Darwin':
-            IsMac = True
-            logging.debug("Detected Darwin (MacOS) OS")
-        else:
-            logging.debug("OS not recognized: " + platform.system())
-        
-        FfmpegBinName = 'ffmpeg'
-        if is_ffmpeg_installed():
-            ffmpeg_installed = True
+    ffmpeg_installed = detect_ffmpeg()
 
     if not ffmpeg_installed:
         tk.messagebox.showerror(
@@ -0,0 +1,2395 @@
+#!/usr/bin/env python
+"""
+AfterScan core - Frame processing functions of AfterScan, without UI
+
+Frame loading (including HDR merge), rotation, stabilization, cropping and filters, as used by
+AfterScan frame encoding workers. Can be imported by other tools without side effects: No UI,
+no folders created, no global state (per worker state is kept in a WorkerContext).
+
+Licensed under a MIT LICENSE.
+
+More info in README.md file
+"""
+
+__author__ = 'Juan Remirez de Esparza'
+__copyright__ = "Copyright 2022-25, Juan Remirez de Esparza"
+__credits__ = ["Juan Remirez de Esparza"]
+__license__ = "MIT"
+__module__ = "AfterScanCore"
+__version__ = "1.0.0"
+__date__ = "2025-03-16"
+__version_highlight__ = "Frame processing functions split from AfterScan"
+__maintainer__ = "Juan Remirez de Esparza"
+__email__ = "jremirez@hotmail.com"
+__status__ = "Development"
+
+import os
+import io
+import shutil
+import time
+import re
+import json
+import hashlib
+import logging
+import threading
+import queue
+import functools
+import tracemalloc
+import subprocess as sp
+import fnmatch
+import tempfile
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields, replace
+import cv2
+import numpy as np
+from rolling_average import RollingAverage
+
+# Check for temporalDenoise in OpenCV at startup
+HAS_TEMPORAL_DENOISE = hasattr(cv2, 'temporalDenoising')
+denoise_window_size = 3
+denoise_window_timeout = 60     # Seconds a frame waits for the previous ones to be denoised (see DenoiseWindow)
+
+# Source/target frame filenames
+FrameInputFilenamePatternList_jpg = "picture-?????.jpg"
+HdrInputFilenamePatternList_jpg = "picture-?????.3.jpg"   # In HDR mode, use 3rd frame as guide
+LegacyHdrInputFilenamePatternList_jpg = "hdrpic-?????.3.jpg"   # In legacy HDR mode, use 3rd frame as guide
+FrameInputFilenamePatternList_png = "picture-?????.png"
+HdrInputFilenamePatternList_png = "picture-?????.3.png"   # In HDR mode, use 3rd frame as guide
+LegacyHdrInputFilenamePatternList_png = "hdrpic-?????.3.png"   # In legacy HDR mode, use 3rd frame as guide
+FrameInputFilenamePattern = "picture-%05d.%s"   # HDR frames using standard filename (2/12/2023)
+FrameHdrInputFilenamePattern = "picture-%05d.%1d.%s"   # HDR frames using standard filename (2/12/2023)
+FrameOutputFilenamePattern = "picture_out-%05d.%s"
+HdrSetInputFilenamePattern = "hdrpic-%05d.%1d.%s"   # Req. to fetch each HDR frame set
+
+# Folder manifest (see FrameManifest), cached in the folder itself (source folder is the project folder)
+manifest_cache_basename = "AfterScan-manifest.json"
+manifest_cache_version = 1
+manifest_file_extensions = ('.jpg', '.png')
+manifest_frame_regex = re.compile(r"^picture-(\d{5})\.(jpg|png)$")
+manifest_hdr_frame_regex = re.compile(r"^picture-(\d{5})\.(\d)\.(jpg|png)$")
+manifest_legacy_hdr_frame_regex = re.compile(r"^hdrpic-(\d{5})\.(\d)\.(jpg|png)$")
+
+# Frame transforms cache (see FrameTransforms), saved in the source folder (project folder)
+transforms_sidecar_basename = "AfterScan-transforms.npz"
+transforms_cache_version = 2
+transforms_cache_max_entries = 200000   # Least recently used entries are evicted beyond this (about 60 bytes each)
+transform_dtype = np.dtype([('valid', np.bool_),
+                            ('move_x', np.int32), ('move_y', np.int32),         # Displacement to apply to the frame
+                            ('hole_move_x', np.int32), ('hole_move_y', np.int32),   # Displacement given by template match
+                            ('top_left_x', np.int32), ('top_left_y', np.int32), ('match_level', np.float32),
+                            ('threshold', np.int16), ('missing_rows', np.int32)])
+
+# Index of generated frames (see OutputIndex), saved in the target folder
+outputs_index_basename = "AfterScan-outputs.json"
+outputs_index_version = 1
+# Journal of frames completed by a frame generation job (see CompletionJournal), saved in the target folder
+journal_basename = "AfterScan-journal.txt"
+journal_version = 1
+journal_flush_frames = 32   # Frames completed are written to disk in batches of this size
+# HDR merge fast path (see align_hdr_images): Alignment shifts are calculated on images downscaled by hdr_align_scale,
+# and reused once the same shifts are found in hdr_shifts_stable_frames consecutive frames (calculated again every
+# hdr_shifts_recheck_frames frames, in case they change)
+hdr_align_scale = 0.5
+hdr_shifts_stable_frames = 4
+hdr_shifts_recheck_frames = 25
+hdr_proxy_merge_scale = 0.5     # HDR merge scale for proxy renders (see PipelineConfig.hdr_merge_scale)
+# Local copy of source files (see SourceCache), for source folders in network shares
+source_cache_dir_default = tempfile.gettempdir()
+source_cache_subfolder = "AfterScan-cache"  # Created in the cache folder given, files are cached only there
+source_cache_index_basename = "AfterScan-cache.json"
+source_cache_version = 1
+source_cache_subfolder_regex = re.compile(r'[0-9a-f]{16}')    # Subfolders of the source folders (see get_cached_name)
+source_cache_copy_buffer = 8 * 1024 * 1024  # Files copied to the cache with reads of this size
+source_cache_stage_ahead = 64   # Frames copied to the cache ahead of the frames being read (see create_source_stager)
+# Single file storing all generated frames (see FrameStore), saved in the target folder
+frame_store_basename = "AfterScan-frames.bin"
+frame_store_version = 1
+frame_store_alignment = 4096    # Header, index and frames start at page boundaries
+frame_store_written_key = b'\xff' * 20     # Index entry of a frame written without render key
+# Formats for generated (intermediate) frames, read once by ffmpeg to encode the video: File type (None for the type
+# of the source frames) and OpenCV imencode parameters. Uncompressed frames are written as BMP, readable by ffmpeg
+intermediate_formats = {
+    'Same as source': (None, ()),
+    'JPEG (quality 95)': ('jpg', (cv2.IMWRITE_JPEG_QUALITY, 95)),
+    'JPEG (quality 85)': ('jpg', (cv2.IMWRITE_JPEG_QUALITY, 85)),
+    'PNG (fast)': ('png', (cv2.IMWRITE_PNG_COMPRESSION, 1)),
+    'PNG (small)': ('png', (cv2.IMWRITE_PNG_COMPRESSION, 6)),
+    'WebP (lossless)': ('webp', (cv2.IMWRITE_WEBP_QUALITY, 101)),
+    'Uncompressed (BMP)': ('bmp', ()),
+}
+intermediate_format_default = 'Same as source'
+# Memory that frames waiting to be sent to ffmpeg can use (see FfmpegFrameStream), in bytes
+frame_memory_budget_default = 1024 * 1024 * 1024
+
+# Settings not affecting the contents of generated frames, not included in their render key (see get_render_key)
+# Threshold settings are included per frame, as they can be corrected for individual frames in the FrameSync viewer
+render_key_excluded_fields = ('target_dir', 'detect_holes', 'track_holes', 'debug_images', 'save_frames',
+                              'analysis_only', 'stabilization_threshold', 'threshold_sweep')
+
+# Range of thresholds explored by match_template when the expected one does not give a good match.
+# Search is done coarse to fine, with a limited number of template matches per frame
+match_threshold_min = 150
+match_threshold_max = 254
+match_threshold_coarse_steps = (237, 202, 167)  # Middle of each third of the range
+match_threshold_fine_step = 9  # Halved on each refine iteration
+match_threshold_max_evaluations = 6     # Including the initial (expected) threshold
+
+# Hole tracker: Consecutive frames have almost the same hole position and best threshold, so each worker first
+# searches the hole in a small area around the position found in its previous frame, using the same threshold.
+# Full search is done only if the match level in that area is below tracker_min_match_level
+tracker_min_match_level = 0.85
+tracker_max_frame_gap = 50  # Tracker not used if previous frame processed by the worker is further than this
+tracker_search_margin = 0.125   # Margin around predicted hole position, proportional to template height
+
+# Hole templates provided with AfterScan, with expected position for a 2028 pixel wide frame
+script_dir = os.path.dirname(os.path.realpath(__file__))
+hole_templates = {
+    'S8': (os.path.join(script_dir, "Pattern.S8.jpg"), (66, 728)),
+    'R8': (os.path.join(script_dir, "Pattern.R8.jpg"), (65, 1080))  # Default R8 (bottom hole)
+}
+
+
+# Snapshot of all settings required to encode a frame. It is taken from the UI variables when a job starts,
+# so that frame encoding workers (threads or processes) do not need to access Tk variables
+@dataclass(frozen=True)
+class PipelineConfig:
+    source_dir: str = ""
+    target_dir: str = ""
+    first_absolute_frame: int = 0
+    file_type: str = 'jpg'
+    file_type_out: str = 'jpg'
+    output_params: tuple = ()   # OpenCV imencode parameters for generated frames (see intermediate_formats)
+    hdr_files_only: bool = False
+    hdr_fast_align: bool = False    # Align HDR images with shifts calculated at reduced resolution, reused while stable
+    hdr_merge_scale: float = 1.0    # Merge HDR images at reduced resolution (proxy renders), scaled back to full size
+    perform_rotation: bool = False
+    rotation_angle: float = 0.0
+    perform_stabilization: bool = False
+    detect_holes: bool = False      # Perform hole detection even if not stabilizing (FrameSync viewer opened)
+    use_simple_stabilization: bool = False
+    film_type: str = 'S8'
+    stabilization_threshold: float = 220.0
+    threshold_sweep: bool = False   # Try several thresholds if match is not good (only while encoding)
+    low_contrast_custom_template: bool = False
+    precise_template_match: bool = False
+    template: np.ndarray = field(default=None, repr=False, compare=False)
+    template_position: tuple = (0, 0)
+    template_pyramid: tuple = field(default=(), repr=False, compare=False)    # See build_template_pyramid
+    stabilization_shift: int = 0
+    frame_fill_type: str = 'none'
+    fill_missing_rows: bool = False
+    perform_cropping: bool = False
+    crop_top_left: tuple = (0, 0)
+    crop_bottom_right: tuple = (0, 0)
+    perform_denoise: bool = False
+    perform_sharpness: bool = False
+    perform_gamma_correction: bool = False
+    gamma_correction_value: float = 2.2
+    debug_images: bool = False      # Return left stripes used for hole detection, for FrameSync viewer
+    track_holes: bool = True        # Seed hole search with results of previous frame (only while encoding)
+    source_manifest: object = field(default=None, repr=False, compare=False)    # FrameManifest of source_dir, if available
+    source_cache: object = field(default=None, repr=False, compare=False)   # SourceCache to read source files from, if enabled
+    save_frames: bool = True        # Write processed frames to target_dir (not required when streaming them to ffmpeg)
+    frame_store: bool = False       # Frames saved in the FrameStore of target_dir, instead of a file per frame
+    frame_corrections: dict = field(default=None, repr=False, compare=False)    # Frame index -> (offset x, offset y, threshold), set in FrameSync viewer
+    analysis_only: bool = False     # Detect frame displacement only (frames not stabilized nor saved), see FrameTransforms
+    frame_transforms: object = field(default=None, repr=False, compare=False)    # FrameTransforms to apply, instead of detecting displacement
+    denoise_window: object = field(default=None, repr=False, compare=False)     # DenoiseWindow shared by the workers of a job
+
+
+# Mutable state owned by a single frame encoding worker (thread or process). Each worker has its own, so that
+# workers do not share anything apart from the (immutable) PipelineConfig, and no locking is required
+class WorkerContext:
+    def __init__(self, id=-1):
+        self.id = id
+        self.horizontal_offset_average = RollingAverage(50)    # Used by simple stabilization algorithm
+        self.denoise_frames = deque(maxlen=denoise_window_size)
+        # Objects for HDR merge
+        self.merge_mertens = cv2.createMergeMertens()
+        self.align_mtb = cv2.createAlignMTB()
+        self.hdr_shifts = None      # Alignment shifts of the HDR images of the last frame (see align_hdr_images)
+        self.hdr_shifts_stable = 0  # Consecutive frames with the same shifts
+        self.hdr_shifts_reused = 0  # Frames the shifts have been reused without calculating them
+        # Hole tracker: Threshold and hole position found in the last frame processed by this worker
+        self.tracked_frame_idx = None
+        self.tracked_threshold = None
+        self.tracked_top_left = None
+        # Buffer arena: Work buffers reused from frame to frame, instead of allocating new ones (see get_buffer)
+        self.buffers = {}
+        self.buffer_allocations = 0
+        self.frame_store = None     # FrameStore frames are saved to, mapped by each worker
+
+    def update_tracker(self, frame_idx, threshold, top_left, match_level):
+        if match_level >= tracker_min_match_level:
+            self.tracked_frame_idx = frame_idx
+            self.tracked_threshold = threshold
+            self.tracked_top_left = top_left
+        else:   # Do not propagate a bad match to the next frames
+            self.tracked_frame_idx = None
+
+    def tracker_valid(self, frame_idx):
+        return self.tracked_frame_idx is not None and abs(frame_idx - self.tracked_frame_idx) <= tracker_max_frame_gap
+
+    # Returns FrameStore of folder (created by the job before starting the workers), None if there is none
+    def get_frame_store(self, folder):
+        if self.frame_store is None or self.frame_store.folder != folder:
+            store = FrameStore(folder)
+            if not store.load(writable=True):
+                return None
+            self.frame_store = store
+        return self.frame_store
+
+    # Returns work buffer of this worker with the requested shape (contents undefined), to be used as destination of
+    # OpenCV functions (dst=) or NumPy operations (out=). Buffer is only reallocated if a bigger one is required, so
+    # the same name can be used with different shapes. Contents are overwritten next time the name is requested
+    def get_buffer(self, name, shape, dtype = np.uint8):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=np.uint8)
+            self.buffers[name] = buffer
+            self.buffer_allocations += 1
+        return buffer[:size].view(dtype).reshape(shape)
+
+
+def get_frame_number_from_filename(filename):
+    try:
+        name_part = os.path.splitext(os.path.basename(filename))[0]
+        numbers = re.findall(r'\d+', name_part)
+        if numbers:
+            return int(numbers[-1])
+        else:
+            return None
+    except:
+        return None
+
+
+# Image files of a folder, listed with a single os.scandir pass: Name, size and modification time of each file,
+# plus an index of the frames (frame number -> base file, other files of its HDR set) and the gaps (ranges of
+# missing frame numbers) in the sequence. Size and modification time of the files listed are used as signature of
+# the frames (see get_frame_source_signature), no need to examine them again. Index is built again only if files are
+# added or removed. If save_cache is set, manifest is saved in the folder, and loaded from there next time
+# If stat_files is not set, size and modification time are not retrieved (one call less per file), and folder is
+# listed again only if modified (checked with the modification time of the folder)
+class FrameManifest:
+    def __init__(self, folder, save_cache = False, stat_files = True):
+        self.folder = folder
+        self.save_cache = save_cache
+        self.stat_files = stat_files
+        self.folder_mtime_ns = None
+        self.files = {}     # Filename -> (size, modification time in ns)
+        self.frames = {}    # Frame number -> {'file': base filename (None for legacy HDR sets), 'hdr': HDR set filenames}
+        self.gaps = []      # Ranges of missing frame numbers, as (first, last)
+        self.names = []     # Sorted filenames
+        self.matches = {}   # Filename pattern -> matching filenames
+        if save_cache:
+            self.load()
+        self.refresh()
+
+    def cache_filename(self):
+        return os.path.join(self.folder, manifest_cache_basename)
+
+    def load(self):
+        try:
+            with open(self.cache_filename()) as f:
+                data = json.load(f)
+            if data.get('version') != manifest_cache_version:
+                return
+            self.files = {name: tuple(info) for name, info in data['files'].items()}
+            self.frames = {int(number): frame for number, frame in data['frames'].items()}
+            self.gaps = [tuple(gap) for gap in data['gaps']]
+            self.names = sorted(self.files)
+            self.folder_mtime_ns = data['folder_mtime_ns']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.debug(f"Cannot load manifest of {self.folder}: {e}")
+            self.files = {}
+            self.folder_mtime_ns = None
+
+    def save(self):
+        filename = self.cache_filename()
+        try:
+            if not os.path.isfile(filename):
+                # Folder is modified by the creation of the manifest (but not when it is written later, in place)
+                open(filename, 'w').close()
+                self.folder_mtime_ns = os.stat(self.folder).st_mtime_ns
+            data = {'version': manifest_cache_version, 'folder_mtime_ns': self.folder_mtime_ns, 'files': self.files,
+                    'frames': self.frames, 'gaps': self.gaps}
+            with open(filename, 'w') as f:
+                f.write(json.dumps(data))
+        except OSError as e:     # Folder might be read only: Manifest is kept in memory only
+            logging.debug(f"Cannot save manifest of {self.folder}: {e}")
+
+    # Lists folder again, with size and modification time of each file (a file overwritten in place, or replaced by
+    # another with the same name, does not change the modification time of the folder). Index is built again only if
+    # files were added or removed. Without stat_files, folder is listed only if modified since last time
+    # Returns True if anything changed
+    def refresh(self):
+        try:
+            folder_mtime_ns = os.stat(self.folder).st_mtime_ns
+        except OSError:
+            folder_mtime_ns = None
+        if folder_mtime_ns is not None and folder_mtime_ns == self.folder_mtime_ns and not self.stat_files:
+            return False
+        files = {}
+        if folder_mtime_ns is not None:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if not entry.name.lower().endswith(manifest_file_extensions) or not entry.is_file():
+                        continue
+                    if self.stat_files:
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                    else:
+                        files[entry.name] = (None, None)
+        if files == self.files and folder_mtime_ns == self.folder_mtime_ns:
+            return False
+        names_changed = files.keys() != self.files.keys()
+        self.files = files
+        self.folder_mtime_ns = folder_mtime_ns
+        if names_changed:
+            self.names = sorted(files)
+            self.matches = {}
+            self.build_index()
+        if self.save_cache and folder_mtime_ns is not None:
+            self.save()
+        return True
+
+    # Size and modification time of file, as listed (None if not in folder, or files not examined)
+    def get_file_info(self, filename):
+        info = self.files.get(filename)
+        return info if info is not None and info[0] is not None else None
+
+    def build_index(self):
+        frames = {}
+        for name in self.names:
+            match = manifest_frame_regex.match(name)
+            if match:
+                frames.setdefault(int(match.group(1)), {'file': None, 'hdr': []})['file'] = name
+                continue
+            match = manifest_hdr_frame_regex.match(name) or manifest_legacy_hdr_frame_regex.match(name)
+            if match:
+                frames.setdefault(int(match.group(1)), {'file': None, 'hdr': []})['hdr'].append(name)
+        self.frames = frames
+        self.gaps = []
+        # Frames without base file are missing, unless there are no base files at all (legacy HDR sets)
+        numbers = sorted(number for number, frame in frames.items() if frame['file'] is not None)
+        if len(numbers) == 0:
+            numbers = sorted(frames)
+        for previous, number in zip(numbers, numbers[1:]):
+            if number > previous + 1:
+                self.gaps.append((previous + 1, number - 1))
+
+    def exists(self, filename):
+        return filename in self.files
+
+    # Full paths of files matching pattern, sorted. Same as glob (hidden files not matched by wildcards)
+    def match(self, pattern):
+        if pattern not in self.matches:
+            names = fnmatch.filter(self.names, pattern)
+            if not pattern.startswith('.'):
+                names = [name for name in names if not name.startswith('.')]
+            self.matches[pattern] = [os.path.join(self.folder, name) for name in names]
+        return self.matches[pattern]
+
+
+# Returns manifest of folder: The one provided if it is for the same folder (refreshed), a new one otherwise
+def get_folder_manifest(manifest, folder, save_cache = False, stat_files = True):
+    if manifest is not None and manifest.folder == folder:
+        manifest.refresh()
+        return manifest
+    return FrameManifest(folder, save_cache, stat_files)
+
+
+# Lists frames available in source folder, without accessing UI. Returns standard frame list, legacy HDR frame list,
+# number of HDR frames (new naming) and file type for generated frames
+# If any_sequence is set (skip frame regeneration), any JPG/PNG sequence is accepted as source
+# Folder is listed using manifest if provided (FrameManifest for source_dir), a new one is created otherwise
+def list_source_frames(source_dir, any_sequence = False, manifest = None):
+    if manifest is None:
+        manifest = FrameManifest(source_dir)
+    if any_sequence:
+        logging.debug("Skip Mode enabled. Searching for any JPG/PNG sequence in Source folder.")
+        # In skip mode, we are flexible and look for any JPG or PNG files.
+        file_list_jpg = sorted(list(manifest.match("*.jpg")))
+        file_list_png = sorted(list(manifest.match("*.png")))
+        if len(file_list_png) > 0 and len(file_list_jpg) == 0:
+            logging.debug("Found only PNG files.")
+            out_type = 'png'
+        else:
+            logging.debug("Found JPG files (or a mix). Defaulting to JPG.")
+            out_type = 'jpg'
+        return file_list_jpg + file_list_png, [], 0, out_type
+
+    file_list_jpg = list(manifest.match(FrameInputFilenamePatternList_jpg))
+    if len(file_list_jpg) == 0:
+        file_list = sorted(list(manifest.match(FrameInputFilenamePatternList_png)))
+        out_type = 'png'
+    else:
+        file_list = sorted(file_list_jpg)
+        out_type = 'jpg'
+
+    hdr_file_list_jpg = list(manifest.match(HdrInputFilenamePatternList_jpg))
+    hdr_file_list_png = list(manifest.match(HdrInputFilenamePatternList_png))
+    if len(hdr_file_list_png) != 0:
+        out_type = 'png'
+    elif len(hdr_file_list_jpg) != 0:
+        out_type = 'jpg'
+
+    legacy_hdr_file_list_jpg = list(manifest.match(LegacyHdrInputFilenamePatternList_jpg))
+    legacy_hdr_file_list_png = list(manifest.match(LegacyHdrInputFilenamePatternList_png))
+    legacy_hdr_file_list = sorted(legacy_hdr_file_list_jpg + legacy_hdr_file_list_png)
+    if len(legacy_hdr_file_list_png) != 0:
+        out_type = 'png'
+    elif len(legacy_hdr_file_list_jpg) != 0:
+        out_type = 'jpg'
+
+    return file_list, legacy_hdr_file_list, len(hdr_file_list_jpg) + len(hdr_file_list_png), out_type
+
+
+# Sharpness code taken from https://www.educative.io/answers/how-to-sharpen-a-blurred-image-using-opencv
+sharpen_filter = np.array([[-1, -1, -1],
+                           [-1, 9, -1],
+                           [-1, -1, -1]])
+sharpen_filter.setflags(write=False)
+
+
+def resize_image(img, ratio):
+    # Calculate the proportional size of original image
+    width = int(img.shape[1] * ratio)
+    height = int(img.shape[0] * ratio)
+
+    dsize = (width, height)
+
+    # resize image
+    return cv2.resize(img, dsize)
+
+
+# If copy is False, a view of img is returned (to be used only while img is not modified)
+def get_image_left_stripe(img, factor, copy = True):
+    stripe = img[0:img.shape[1], 0:int(img.shape[0] * factor)]
+    return np.copy(stripe) if copy else stripe
+
+
+# Lookup table for gamma correction, built once per gamma value
+@functools.lru_cache(maxsize=16)
+def get_gamma_table(gamma):
+    invGamma = 1 / gamma
+    table = np.array([((i / 255) ** invGamma) * 255 for i in range(256)], dtype=np.uint8)
+    table.setflags(write=False)
+    return table
+
+
+def gamma_correct_image(src, gamma):
+    """Apply gamma correction to an image using a lookup table."""
+    if gamma <= 0:
+        raise ValueError("Gamma must be positive")
+    
+    # Ensure uint8 input
+    if src.dtype != np.uint8:
+        src = cv2.convertScaleAbs(src, alpha=(255.0/src.max()))
+    
+    return cv2.LUT(src, get_gamma_table(gamma))
+
+
+def rotate_image(img, angle):
+    # grab the dimensions of the image and calculate the center of the
+    # image
+    (h, w) = img.shape[:2]
+    (cX, cY) = (w // 2, h // 2)
+    # rotate our image by 45 degrees around the center of the image
+    M = cv2.getRotationMatrix2D((cX, cY), float(angle), 1.0)
+    rotated = cv2.warpAffine(img, M, (w, h))
+    return rotated
+
+
+# img is directly the left stripe (search area)
+# Template pyramid: For frames wider than the 2028 pixel reference, the template (already scaled for the frame
+# size) is halved until it is not bigger than at reference resolution. Hole is searched with the smallest one in a
+# reduced image, and position is refined at full resolution in a small window (see match_template_pyramid)
+def build_template_pyramid(template, scale):
+    pyramid = []
+    level_template = template
+    while template is not None and scale > 1:
+        level_template = cv2.resize(level_template, (level_template.shape[1] // 2, level_template.shape[0] // 2),
+                                    interpolation=cv2.INTER_AREA)
+        level_template.setflags(write=False)
+        pyramid.append(level_template)
+        scale /= 2
+    return tuple(pyramid)
+
+
+# Returns match level and top left position of template in img (both already thresholded), using template pyramid
+def match_template_pyramid(img, template, pyramid):
+    factor = 2 ** len(pyramid)
+    coarse_img = cv2.resize(img, (img.shape[1] // factor, img.shape[0] // factor), interpolation=cv2.INTER_AREA)
+    aux = cv2.matchTemplate(coarse_img, pyramid[-1], cv2.TM_CCOEFF_NORMED)
+    (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(aux)
+    # Refine at full resolution. Margin covers position error at reduced resolution (+/- 1 pixel, plus rounding)
+    margin = 2 * factor
+    x = max(0, maxLoc[0] * factor - margin)
+    y = max(0, maxLoc[1] * factor - margin)
+    window = img[y:maxLoc[1] * factor + template.shape[0] + margin, x:maxLoc[0] * factor + template.shape[1] + margin]
+    aux = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+    (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(aux)
+    return maxVal, (maxLoc[0] + x, maxLoc[1] + y)
+
+
+# Search template in img, returning threshold used, top left position, match level, thresholded image and number of
+# template matches performed. Threshold and threshold_sweep default to the ones in config
+# If template pyramid is provided, matching is done at reduced resolution and refined at full resolution
+# If worker context is provided, its buffers are used for the grey and thresholded images: Thresholded image returned
+# is then only valid until the next call
+def match_template(frame_idx, template, img, config, threshold = None, threshold_sweep = None, pyramid = (), ctx = None):
+
+    tw = template.shape[1]
+    th = template.shape[0]
+    iw = img.shape[1]
+    ih = img.shape[0]
+
+    if (tw >= iw or th >= ih):
+        logging.error("Template (%ix%i) bigger than search area (%ix%i)",
+                      tw, th, iw, ih)
+        return 0, (0, 0), 0, 0, 0
+
+    def buffer(name):
+        return ctx.get_buffer(name, (ih, iw)) if ctx is not None else None
+
+    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=buffer('stripe_gray'))    # reduced left stripe to calculate white on black proportion
+    # Match level considered good enough to stop searching a better threshold
+    target_match_level = 0.95 if config.precise_template_match else 0.85
+    # Results of each threshold evaluated: threshold -> (match level, top left)
+    results = {}
+    # Thresholded image of the best match so far. Each threshold is evaluated in the first buffer, buffers are swapped
+    # when it gives the best match, so that the image of the best one is kept
+    best_img_final = None
+    threshold_buffers = [buffer('stripe_threshold'), buffer('stripe_threshold_best')]
+
+    def evaluate(threshold):
+        nonlocal best_img_final
+        # convert img to grey, checking various thresholds
+        # Not interested in best threshold returned usign this algorithm
+        _, img_final = cv2.threshold(img_gray, threshold, 255, cv2.THRESH_BINARY, dst=threshold_buffers[0])
+        #img_edges = cv2.Canny(image=img_bw, threshold1=100, threshold2=1)  # Canny Edge Detection
+        if pyramid:
+            maxVal, maxLoc = match_template_pyramid(img_final, template, pyramid)
+        else:
+            aux = cv2.matchTemplate(img_final, template, cv2.TM_CCOEFF_NORMED)
+            (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(aux)
+        results[threshold] = (maxVal, maxLoc)
+        if best_threshold() == threshold:
+            best_img_final = img_final
+            threshold_buffers.reverse()
+        return round(maxVal, 2) >= target_match_level
+
+    def best_threshold():
+        # Highest match level, highest threshold in case of tie (like the previous top-down sweep)
+        return max(results, key=lambda t: (round(results[t][0], 2), t))
+
+    if config.low_contrast_custom_template:
+        # Apply Otsu's thresholding: Only one try, best threshold is whathever it returns
+        otsu_threshold, best_img_final = cv2.threshold(img_gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU,
+                                                       dst=threshold_buffers[0])
+        aux = cv2.matchTemplate(best_img_final, template, cv2.TM_CCOEFF_NORMED)
+        (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(aux)
+        results[otsu_threshold] = (maxVal, maxLoc)
+    elif not evaluate(config.stabilization_threshold if threshold is None else threshold) and \
+            (config.threshold_sweep if threshold_sweep is None else threshold_sweep):
+        # Match not good enough with the expected threshold: Search the threshold giving the best match,
+        # coarse to fine, instead of a linear sweep (which took up to 25 template matches per frame)
+        # Coarse: One threshold in the middle of each third of the threshold range
+        done = False
+        for threshold in match_threshold_coarse_steps:
+            if threshold not in results and evaluate(threshold):
+                done = True
+                break
+        # Fine: Halve the step around the best threshold so far, while evaluations are available
+        step = match_threshold_fine_step
+        while not done and step >= 1 and len(results) < match_threshold_max_evaluations:
+            best = best_threshold()
+            for threshold in (best + step, best - step):
+                if len(results) >= match_threshold_max_evaluations:
+                    break
+                if match_threshold_min <= threshold <= match_threshold_max and threshold not in results:
+                    if evaluate(threshold):
+                        done = True
+                        break
+            step //= 2
+
+    best_thres = best_threshold()
+    best_maxVal, best_top_left = results[best_thres]
+
+    return int(best_thres), best_top_left, round(best_maxVal,2), best_img_final, len(results)
+
+
+def get_target_position(frame_idx, img, config, ctx, orientation='v', threshold=10, slice_width=10):
+    # Get dimensions of the binary image
+    height = img.shape[0]
+    width = img.shape[1]
+
+    # Get the slice to analyze: Vertical slice on the left of the image, or horizontal slice across the holes.
+    # For horizontal, only the last of the three rows previously tried had effect (results of the others were
+    # overwritten), so only that one is analyzed
+    if orientation == 'v':
+        if slice_width > width:
+            raise ValueError("Slice width exceeds image width")
+        sliced_image = img[:, 0:slice_width]
+    else:
+        if config.film_type == 'S8':
+            pos = height // 2 + int(height*0.07) - slice_width // 2
+        else:
+            pos = int(height*0.10)  # For R8, get a slice on the top of the image (top hole)
+        sliced_image = img[pos:pos+slice_width, :int(width*0.15)]    # Don't need a full horizontal slice, holes must be in the leftmost 15%
+
+    # Calculate the middle of the vertical and horizontal coordinated
+    if config.film_type == 'S8':
+        vertical_middle = height // 2
+    else:
+        vertical_middle = (height // 2) - int(height*0.05)
+
+    # Find rows (columns) with white pixels for S8 or horizontal search, or without them (black) for R8
+    # Brightest pixel of each row (column) is compared with the threshold, so the slice is thresholded only once
+    profile = cv2.reduce(sliced_image, 1 if orientation == 'v' else 0, cv2.REDUCE_MAX)
+    white = profile.reshape(profile.shape[0] * profile.shape[1], -1) > config.stabilization_threshold
+    selected = ~white if (config.film_type == 'R8' and orientation == 'v') else white
+    if selected.ndim > 1:   # Color image, row (column) is selected if it is in any of the channels
+        selected = selected.any(axis=1)
+    slice_values = np.flatnonzero(selected)
+
+    # Split in areas of consecutive rows (columns), keep the first two bigger than min_gap_size to skip small gaps
+    areas = []
+    min_gap_size = int((height*0.08) if orientation == 'v' else (width*0.05))  # Determine minimum hole size depending on the orientation
+    if slice_values.size > 0:
+        breaks = np.flatnonzero(np.diff(slice_values) > 1)
+        starts = slice_values[np.concatenate(([0], breaks + 1))]
+        ends = slice_values[np.concatenate((breaks, [slice_values.size - 1]))]
+        area_ends = ends - 1    # Areas are closed one row before their last one, except the last area
+        area_ends[-1] = ends[-1]
+        valid = np.flatnonzero(ends - starts > min_gap_size)[:2]
+        areas = list(zip(starts[valid].tolist(), area_ends[valid].tolist()))
+
+    result = 0
+    bigger = 0
+    for start, end in areas:
+        if end-start > bigger:
+            bigger = end-start
+            result = (start + end) // 2 if orientation == 'v' else end
+            result_start = start
+            result_end = end
+
+    if len(areas) > 0:
+        if orientation == 'v':
+            offset = vertical_middle-result   # Return offset of the center of the biggest area with respect to the frame enter
+            if abs(offset) > 300:
+                logging.warning(f"Frame {frame_idx}: Vertical offset too big {offset}.")
+        else:
+            offset = int(width*0.08) - result   # Return offset of the hole vertical edge with respect to the expected position
+            # Difference between actual horizontal offset and average one should be smaller than 30 pixels (not much horizontal movement expected)
+            offset_average = ctx.horizontal_offset_average.get_average()
+            if offset_average is not None and abs(offset_average-offset) > 30:
+                logging.warning(f"Frame {frame_idx}: Too much deviation of horizontal offset {offset}, respect to average {int(offset_average)}.")
+                offset = offset_average
+            else:
+                ctx.horizontal_offset_average.add_value(offset)
+    else:
+        offset = 0
+        result_start = 0
+        result_end = 0
+
+    return int(offset), result_start, result_end
+
+
+# Based on FrameAlignmentChecker 'is_frame_centered' algorithm
+# Templates to be dropped, vertical displacement to be calculated based on position 
+# of the center of the hole (S8) or the space between two holes (R8)
+def calculate_frame_displacement_simple(frame_idx, img, config, ctx, threshold=10, slice_width=10):
+    vertical_offset, _, _ = get_target_position(frame_idx, img, config, ctx, 'v')
+    horizontal_offset, _, _ = get_target_position(frame_idx, img, config, ctx, 'h')
+
+    return horizontal_offset, vertical_offset
+
+
+# Original algorithm based on templates
+# Extracted code to calculate displacement to use with the manual option
+def calculate_frame_displacement_with_templates(frame_idx, img_ref, config, ctx, img_ref_alt = None):
+    # Set hole template expected position
+    hole_template_pos = config.template_position
+    film_hole_template = config.template
+
+    # Search film hole pattern
+    best_match_level = 0
+    best_top_left = [0,0]
+
+    # Get sprocket hole area
+    left_stripe_image = get_image_left_stripe(img_ref, 0.3, False)
+    img_ref_alt_used = False
+    evaluations = 0     # Number of template matches performed, for performance analysis
+    tracked = False
+    # Use tracker only while encoding (threshold sweep enabled) and if matched image is not required for FrameSync viewer
+    use_tracker = config.track_holes and config.threshold_sweep and not config.debug_images and ctx.tracker_valid(frame_idx)
+    if use_tracker:
+        # Search only in a small area around the hole position found in the previous frame, using the same threshold
+        th, tw = film_hole_template.shape[:2]
+        margin = max(16, int(th * tracker_search_margin))
+        roi_x = max(0, ctx.tracked_top_left[0] - margin)
+        roi_y = max(0, ctx.tracked_top_left[1] - margin)
+        roi = left_stripe_image[roi_y:ctx.tracked_top_left[1] + th + margin, roi_x:ctx.tracked_top_left[0] + tw + margin]
+        frame_treshold, top_left, match_level, img_matched, match_evaluations = match_template(frame_idx, film_hole_template, roi, config,
+                                                                                               ctx.tracked_threshold, False, ctx=ctx)
+        evaluations += match_evaluations
+        if match_level >= tracker_min_match_level:
+            top_left = (top_left[0] + roi_x, top_left[1] + roi_y)
+            tracked = True
+    pyramid = config.template_pyramid
+    while not tracked:
+        # Full search, starting with the threshold of the previous frame if available
+        frame_treshold, top_left, match_level, img_matched, match_evaluations = match_template(frame_idx, film_hole_template, left_stripe_image, config,
+                                                                                               ctx.tracked_threshold if use_tracker else None,
+                                                                                               pyramid=pyramid, ctx=ctx)
+        evaluations += match_evaluations
+        match_level = max(0, match_level)   # in some cases, not sure why, match level is negative
+        if match_level >= 0.85:
+            break
+        else:
+            if match_level >= best_match_level:
+                best_match_level = match_level
+                best_top_left = top_left
+                best_img_matched = np.copy(img_matched)     # Buffer reused by next match_template
+        if pyramid:     # Match at reduced resolution not good enough, try again at full resolution
+            pyramid = ()
+        elif not img_ref_alt_used and img_ref_alt is not None:
+            left_stripe_image = get_image_left_stripe(img_ref_alt, 0.3, False)
+            img_ref_alt_used = True
+        else:
+            match_level = best_match_level
+            top_left = best_top_left
+            img_matched = best_img_matched
+            break
+
+    if top_left[1] != -1 and match_level > 0.1:
+        move_x = hole_template_pos[0] - top_left[0]
+        move_y = hole_template_pos[1] - top_left[1]
+        if abs(move_x) > 200 or abs(move_y) > 600:  # if shift too big, ignore it, probably for the better
+            logging.warning(f"Frame {frame_idx:5d}: Shift too big ({move_x}, {move_y}), ignoring it.")
+            move_x = 0
+            move_y = 0
+    else:   # If match is not good, keep the frame where it is, will probably look better
+        logging.warning(f"Frame {frame_idx:5d}: Template match not good ({match_level}""), ignoring it.")
+        move_x = 0
+        move_y = 0
+    log_line = f"T{ctx.id} - " if ctx.id != -1 else ""
+    logging.debug(log_line+f"Frame {frame_idx:5d}: threshold: {frame_treshold:3d}, template: ({hole_template_pos[0]:4d},{hole_template_pos[1]:4d}), top left: ({top_left[0]:4d},{top_left[1]:4d}), move_x:{move_x:4d}, move_y:{move_y:4d}, evaluations: {evaluations}{' (tracked)' if tracked else ''}")
+
+    ctx.update_tracker(frame_idx, frame_treshold, top_left, match_level)
+
+    return move_x, move_y, top_left, match_level, frame_treshold, img_matched, evaluations, tracked
+
+
+# Output area (x start, y start, x end, y end) of a frame of the given size: Crop area if cropping, whole frame
+# otherwise. Dimensions are even, as required by ffmpeg (same area as crop_image and even_image)
+def get_output_area(width, height, config):
+    if config.perform_cropping:
+        x_start, y_start = config.crop_top_left
+        x_end = min(config.crop_bottom_right[0], width)
+        y_end = min(config.crop_bottom_right[1], height)
+        x_end -= (x_end - x_start) % 2
+        y_end -= (y_end - y_start) % 2
+        return x_start, y_start, x_end, y_end
+    return 0, 0, width - width % 2, height - height % 2
+
+
+def crop_output_image(img, config):
+    if config.perform_cropping:
+        return crop_image(img, config.crop_top_left, config.crop_bottom_right)
+    return even_image(img)
+
+
+# Rotation (if enabled), shift and crop (output area) of a frame with a single warpAffine, directly into a buffer of the
+# size of the output area. Same result as rotate_image, shift_image and crop_output_image, without resampling the full
+# frame up to three times
+def warp_frame(img, config, move_x, move_y):
+    height, width = img.shape[:2]
+    x_start, y_start, x_end, y_end = get_output_area(width, height, config)
+    if not (0 <= x_start < x_end and 0 <= y_start < y_end):     # Crop area out of frame, do it step by step
+        if config.perform_rotation:
+            img = rotate_image(img, config.rotation_angle)
+        return crop_output_image(shift_image(img, width, height, move_x, move_y), config)
+    if not config.perform_rotation and move_x == 0 and move_y == 0:
+        return img[y_start:y_end, x_start:x_end]
+    if config.perform_rotation:     # Same matrix as rotate_image
+        matrix = cv2.getRotationMatrix2D((width // 2, height // 2), float(config.rotation_angle), 1.0)
+    else:
+        matrix = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)
+    matrix[0, 2] += move_x - x_start
+    matrix[1, 2] += move_y - y_start
+    warped = cv2.warpAffine(img, matrix, (x_end - x_start, y_end - y_start))
+    if config.perform_rotation:
+        # Rotated frame has the size of the original one: Area shifted in from outside of it is left black, as
+        # shift_image does (without rotation, warpAffine already does it)
+        left = min(max(move_x - x_start, 0), x_end - x_start)
+        right = min(max(move_x + width - x_start, 0), x_end - x_start)
+        top = min(max(move_y - y_start, 0), y_end - y_start)
+        bottom = min(max(move_y + height - y_start, 0), y_end - y_start)
+        warped[:top] = 0
+        warped[bottom:] = 0
+        warped[:, :left] = 0
+        warped[:, right:] = 0
+    return warped
+
+
+def shift_image(img, width, height, move_x, move_y):
+    translation_matrix = np.array([
+        [1, 0, move_x],
+        [0, 1, move_y]
+    ], dtype=np.float32)
+    # Apply the translation to the image
+    return cv2.warpAffine(src=img, M=translation_matrix, dsize=(width, height))
+
+
+# Detection part of the stabilization: Calculates frame displacement (hole position), without modifying the frame
+# Returns displacement to apply, a dictionary with the detection results (see stabilize_image) and the thresholded
+# left stripe used for template matching (None if not available)
+# If img_rotated is False, img has not been rotated yet (see warp_frame): It is rotated only if required
+def detect_frame_displacement(frame_idx, img, img_ref, config, ctx, img_ref_alt = None, img_rotated = True):
+    top_left = (0, 0)
+    img_matched = None
+    evaluations = 0
+    tracked = False
+    if config.use_simple_stabilization:  # Standard stabilization using templates
+        move_x, move_y = calculate_frame_displacement_simple(frame_idx, img_ref, config, ctx)
+        match_level = 1
+        frame_threshold = config.stabilization_threshold
+    else:
+        move_x, move_y, top_left, match_level, frame_threshold, img_matched, evaluations, tracked = calculate_frame_displacement_with_templates(frame_idx, img_ref, config, ctx, img_ref_alt)
+
+    stabilization_info = {'move_x': move_x, 'move_y': move_y, 'top_left': top_left, 'match_level': match_level,
+                          'threshold': frame_threshold, 'missing_rows': 0, 'match_evaluations': evaluations,
+                          'match_tracked': tracked}
+
+    if match_level < 0.4:   # If match level is too bad, revert to simple algorithm
+        if not img_rotated and config.perform_rotation:
+            img = rotate_image(img, config.rotation_angle)
+        move_x, move_y = calculate_frame_displacement_simple(frame_idx, img, config, ctx)
+    stabilization_info['applied_move'] = (move_x, move_y)
+    stabilization_info['missing_rows'] = get_missing_rows(stabilization_info['move_y'], img_ref.shape[0], config)[0]
+    return move_x, move_y, stabilization_info, img_matched
+
+
+# Number of rows missing (at the top or the bottom of the crop area) once frame is shifted move_y rows
+# Returns total missing rows plus missing top and missing bottom (negative)
+def get_missing_rows(move_y, height, config):
+    crop_top_left = config.crop_top_left
+    crop_bottom_right = config.crop_bottom_right
+    missing_rows = 0
+    missing_bottom = 0
+    missing_top = 0
+    if move_y < 0:
+        if height + move_y < crop_bottom_right[1]:
+            missing_bottom = -(crop_bottom_right[1] - (height + move_y))
+        missing_rows = -missing_bottom
+    if move_y > 0:
+        if move_y > crop_top_left[1]:
+            missing_top = crop_top_left[1] - move_y
+        missing_rows = -missing_top
+
+    if missing_rows > 0 and config.perform_rotation:
+        missing_rows = missing_rows + 10  # If image is rotated, add 10 to cover gap between image and fill
+    return missing_rows, missing_top, missing_bottom
+
+
+# Calculates frame displacement and shifts the frame accordingly. Does not access UI, so that it can be called from
+# any worker. Results required to update the UI (match level, bad frames, FrameSync viewer) are returned in a dictionary
+# If displacement detected previously is provided (transform, see FrameTransforms), it is used instead of detecting it
+# If warp is True, img is not rotated yet, and the output area (crop) is returned instead of the full frame (see
+# warp_frame). Not compatible with debug_images, as FrameSync viewer requires the full frame
+def stabilize_image(frame_idx, img, img_ref, config, ctx, offset_x = 0, offset_y = 0, img_ref_alt = None, transform = None,
+                    warp = False):
+    # Get image dimensions to perform image shift later
+    width = img_ref.shape[1]
+    height = img_ref.shape[0]
+    crop_top_left = config.crop_top_left
+    crop_bottom_right = config.crop_bottom_right
+
+    if transform is None:
+        move_x, move_y, stabilization_info, img_matched = detect_frame_displacement(frame_idx, img, img_ref, config, ctx,
+                                                                                    img_ref_alt, not warp)
+    else:
+        move_x, move_y, stabilization_info = transform
+        img_matched = None
+    top_left = stabilization_info['top_left']
+
+    # Try to figure out if there will be a part missing
+    # at the bottom, or the top
+    missing_rows, missing_top, missing_bottom = get_missing_rows(stabilization_info['move_y'], height, config)
+    stabilization_info['missing_rows'] = missing_rows
+
+    # Create the translation matrix using move_x and move_y (NumPy array): This is the actual stabilization
+    # We double-check the check box since this function might be called just to debug template detection
+    fill = missing_rows > 0 and config.fill_missing_rows and config.frame_fill_type in ('fake', 'dumb')
+    if config.perform_stabilization and warp and not fill:
+        # Rotation, shift and crop in a single pass
+        translated_image = warp_frame(img, config, move_x + offset_x, move_y + offset_y + config.stabilization_shift)
+    elif config.perform_stabilization:
+        if warp and config.perform_rotation:
+            img = rotate_image(img, config.rotation_angle)
+        move_x += offset_x
+        move_y += offset_y
+        # Check if frame fill is enabled, and required: Extract missing fragment
+        if config.frame_fill_type == 'fake' and config.fill_missing_rows and missing_rows > 0:
+            # Perform temporary horizontal stabilization only first, to extract missing fragment
+            translated_image = shift_image(img, width, height, move_x, 0)
+            if missing_top < 0:
+                missing_fragment = translated_image[crop_bottom_right[1]-missing_rows:crop_bottom_right[1],0:width]
+            elif missing_bottom < 0:
+                missing_fragment = translated_image[crop_top_left[1]:crop_top_left[1]+missing_rows, 0:width]
+        # Add vertical offset as decided by user, to compensate for vertically assimmetrical films
+        translated_image = shift_image(img, width, height, move_x, move_y + config.stabilization_shift)
+        # Check if frame fill is enabled, and required: Add missing fragment
+        # Check if there is a gap in the frame, if so, and one of the 'fill' functions is enabled, fill accordingly
+        if missing_rows > 0 and config.fill_missing_rows:
+            if config.frame_fill_type == 'fake':
+                if missing_top < 0:
+                    translated_image[crop_top_left[1]:crop_top_left[1]+missing_rows,0:width] = missing_fragment
+                elif missing_bottom < 0:
+                    translated_image[crop_bottom_right[1]-missing_rows:crop_bottom_right[1],0:width] = missing_fragment
+            elif config.frame_fill_type == 'dumb':
+                if missing_top < 0:
+                    translated_image = translated_image[missing_rows+crop_top_left[1]:height,0:width]
+                    translated_image = cv2.copyMakeBorder(src=translated_image, top=missing_rows+crop_top_left[1], bottom=0, left=0, right=0,
+                                                          borderType=cv2.BORDER_REPLICATE)
+                elif missing_bottom < 0:
+                    translated_image = translated_image[0:crop_bottom_right[1]-missing_rows, 0:width]
+                    translated_image = cv2.copyMakeBorder(src=translated_image, top=0, bottom=crop_bottom_right[1]-missing_rows, left=0, right=0,
+                                                          borderType=cv2.BORDER_REPLICATE)
+        if warp:
+            translated_image = crop_output_image(translated_image, config)
+    elif warp:
+        translated_image = warp_frame(img, config, 0, 0)
+    else:
+        translated_image = img
+    # Keep left stripes for the FrameSync viewer (only if requested, to keep results small)
+    if config.debug_images and not config.use_simple_stabilization and top_left[1] != -1:
+        if not config.perform_stabilization:
+            move_x = 0
+            move_y = 0
+        else:   # Do not move rectangle when manually stabilizing frames
+            move_x -= offset_x
+            move_y -= offset_y
+        stabilization_info['stripe_matched'] = np.copy(img_matched) if img_matched is not None else None
+        stabilization_info['stripe_stabilized'] = get_image_left_stripe(translated_image, 0.2)
+        stabilization_info['stripe_stabilized_pos'] = (top_left[0] + move_x, top_left[1] + move_y)
+
+    return translated_image, stabilization_info
+
+
+# Settings affecting frame displacement detection, as a hash. Transforms detected with different settings are not used
+# Crop area is not included: Missing rows are calculated again when transforms are applied
+# HDR alignment and merge settings are included, as they change the images of HDR sets holes are detected on (images
+# are aligned in place, see merge_hdr_images)
+def get_detection_key(config):
+    digest = hashlib.sha1(repr((config.hdr_files_only, config.perform_rotation, config.rotation_angle,
+                                config.use_simple_stabilization, config.film_type, config.stabilization_threshold,
+                                config.threshold_sweep, config.low_contrast_custom_template,
+                                config.precise_template_match, tuple(config.template_position),
+                                config.hdr_fast_align, config.hdr_merge_scale)).encode())
+    if config.template is not None and not config.use_simple_stabilization:
+        digest.update(repr(config.template.shape).encode())
+        digest.update(config.template.tobytes())
+    return digest.hexdigest()
+
+
+# Key of a frame in the transforms cache: Detection settings plus name, size and modification time of the files of
+# the frame, so that frames are identified by their contents without reading them. None if a file is missing
+def get_frame_transform_key(frame_idx, config, detection_key):
+    signature = get_frame_source_signature(frame_idx, config)
+    if signature is None:
+        return None
+    return hashlib.sha1((detection_key + signature).encode()).hexdigest().encode()
+
+
+# Name, size and modification time of the files of a frame, as a string. None if a file is missing
+def get_frame_source_signature(frame_idx, config):
+    signature = []
+    for file in get_frame_source_files(frame_idx, config):
+        # Size and modification time taken from source folder manifest if available
+        info = config.source_manifest.get_file_info(file) if config.source_manifest is not None else None
+        if info is None:
+            try:
+                stat = os.stat(os.path.join(config.source_dir, file))
+            except OSError:
+                return None
+            info = (stat.st_size, stat.st_mtime_ns)
+        signature.append(f"{file}:{info[0]}:{info[1]};")
+    return ''.join(signature)
+
+
+# Frame displacement detected for each frame (hole detection results), kept in a compact table, so that frames can be
+# generated again (different crop, filters, video resolution...) without detecting the holes again: Either from a
+# previous encoding, or from an analysis pass (frames not rendered, see PipelineConfig.analysis_only)
+# Results are saved in a cache file in the source folder, addressed by frame key (see get_frame_transform_key): A
+# frame modified, or detection settings changed, gives a different key. Cache is bounded to
+# transforms_cache_max_entries, evicting the entries not used for the longest time
+# Encoding workers only read the table (get). Results are recorded (record) by the thread receiving them
+class FrameTransforms:
+    def __init__(self, folder, config, frame_count):
+        self.filename = os.path.join(folder, transforms_sidecar_basename)
+        detection_key = get_detection_key(config)
+        self.keys = [get_frame_transform_key(frame_idx, config, detection_key) for frame_idx in range(frame_count)]
+        self.table = np.zeros(frame_count, dtype=transform_dtype)
+        self.modified = False
+
+    # Returns keys, transforms and last use (generation number) of the entries in the cache file
+    def load_cache(self):
+        try:
+            with np.load(self.filename) as data:
+                if int(data['version']) != transforms_cache_version:
+                    raise ValueError(f"version {int(data['version'])} not supported")
+                return data['keys'], data['transforms'], data['last_used']
+        except (OSError, KeyError, ValueError) as e:
+            logging.debug(f"Cannot load frame transforms from {self.filename}: {e}")
+            return np.zeros(0, dtype='S40'), np.zeros(0, dtype=transform_dtype), np.zeros(0, dtype=np.int64)
+
+    # Loads transforms of the frames available in the cache. Returns number of frames loaded
+    def load(self):
+        keys, transforms, last_used = self.load_cache()
+        index = {key: i for i, key in enumerate(keys.tolist())}
+        loaded = 0
+        for frame_idx, key in enumerate(self.keys):
+            i = index.get(key)
+            if i is not None:
+                self.table[frame_idx] = transforms[i]
+                loaded += 1
+        self.modified = loaded > 0    # Entries used have to be saved again, to keep them from being evicted
+        return loaded
+
+    # Merges transforms of this set of frames into the cache file (might have been updated by other jobs meanwhile)
+    def save(self):
+        if not self.modified:
+            return
+        keys, transforms, last_used = self.load_cache()
+        used = self.table['valid'] & np.array([key is not None for key in self.keys], dtype=np.bool_)
+        new_keys = np.array([key for key, valid in zip(self.keys, used) if valid], dtype='S40')
+        kept = ~np.isin(keys, new_keys)
+        generation = int(last_used.max()) + 1 if len(last_used) > 0 else 1
+        keys = np.concatenate((keys[kept], new_keys))
+        transforms = np.concatenate((transforms[kept], self.table[used]))
+        last_used = np.concatenate((last_used[kept], np.full(len(new_keys), generation, dtype=np.int64)))
+        if len(keys) > transforms_cache_max_entries:
+            recent = np.argsort(last_used, kind='stable')[-transforms_cache_max_entries:]
+            keys, transforms, last_used = keys[recent], transforms[recent], last_used[recent]
+        temp_filename = self.filename + '.tmp'
+        try:
+            with open(temp_filename, 'wb') as f:
+                np.savez(f, version=np.array(transforms_cache_version), keys=keys, transforms=transforms,
+                         last_used=last_used)
+            os.replace(temp_filename, self.filename)
+            self.modified = False
+        except OSError as e:
+            logging.warning(f"Cannot save frame transforms to {self.filename}: {e}")
+
+    def count(self):
+        return int(np.count_nonzero(self.table['valid']))
+
+    # Returns transform of frame, as expected by stabilize_image, or None if not available
+    def get(self, frame_idx):
+        if not 0 <= frame_idx < len(self.table) or not self.table['valid'][frame_idx]:
+            return None
+        entry = self.table[frame_idx]
+        info = {'move_x': int(entry['hole_move_x']), 'move_y': int(entry['hole_move_y']),
+                'top_left': (int(entry['top_left_x']), int(entry['top_left_y'])),
+                'match_level': round(float(entry['match_level']), 2), 'threshold': int(entry['threshold']),
+                'missing_rows': int(entry['missing_rows']), 'match_evaluations': 0, 'match_tracked': False,
+                'applied_move': (int(entry['move_x']), int(entry['move_y'])), 'cached': True}
+        return int(entry['move_x']), int(entry['move_y']), info
+
+    # Records stabilization info returned by encode_frame (frames with missing files cannot be cached, frames corrected
+    # in FrameSync viewer are not detected with the settings of the cache)
+    def record(self, frame_idx, info):
+        if (0 <= frame_idx < len(self.table) and 'applied_move' in info and not info.get('corrected', False)
+                and self.keys[frame_idx] is not None):
+            self.table[frame_idx] = (True, info['applied_move'][0], info['applied_move'][1], info['move_x'], info['move_y'],
+                                     info['top_left'][0], info['top_left'][1], info['match_level'], info['threshold'],
+                                     info['missing_rows'])
+            self.modified = True
+
+
+# Settings affecting the contents of generated frames (all but those in render_key_excluded_fields), as a hash
+def get_render_key(config):
+    settings = [(f.name, getattr(config, f.name)) for f in fields(config)
+                if f.compare and f.name not in render_key_excluded_fields]
+    digest = hashlib.sha1(repr(settings).encode())
+    if config.template is not None and config.perform_stabilization and not config.use_simple_stabilization:
+        digest.update(config.template.tobytes())
+    return digest.hexdigest()
+
+
+# Render key of a frame: Settings (render_key, see get_render_key), files of the frame and threshold used to detect its
+# holes (or correction set in FrameSync viewer). Frame has to be generated again if its key changes. None if a file is
+# missing
+def get_frame_render_key(frame_idx, config, render_key):
+    signature = get_frame_source_signature(frame_idx, config)
+    if signature is None:
+        return None
+    correction = config.frame_corrections.get(frame_idx) if config.frame_corrections else None
+    detection = correction if correction is not None else (config.stabilization_threshold, config.threshold_sweep)
+    return hashlib.sha1(f"{render_key}{signature}{detection}".encode()).hexdigest()
+
+
+def get_output_filename(frame_idx, config):
+    return FrameOutputFilenamePattern % (config.first_absolute_frame + frame_idx, config.file_type_out)
+
+
+# Render key of each generated frame in a folder, together with size and modification time of the file when generated,
+# so that frames modified or deleted afterwards are detected. Used to generate again only the frames which settings or
+# source files changed (incremental regeneration). Index is saved in the folder itself
+# If frames are saved in a FrameStore, render keys are kept in the index of the store instead
+class OutputIndex:
+    def __init__(self, folder, store = None):
+        self.folder = folder
+        self.store = store
+        self.filename = os.path.join(folder, outputs_index_basename)
+        self.entries = {}       # Filename -> [render key, size, modification time in ns]
+        self.frame_keys = {}    # Frame index -> render key, for the frames being generated (see check_frames)
+        self.modified = False
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            if data.get('version') == outputs_index_version:
+                self.entries = data['entries']
+        except (OSError, ValueError, KeyError) as e:
+            logging.debug(f"Cannot load index of generated frames {self.filename}: {e}")
+
+    def save(self):
+        if not self.modified:
+            return
+        temp_filename = self.filename + '.tmp'
+        try:
+            with open(temp_filename, 'w') as f:
+                f.write(json.dumps({'version': outputs_index_version, 'entries': self.entries}))
+            os.replace(temp_filename, self.filename)
+            self.modified = False
+        except OSError as e:
+            logging.warning(f"Cannot save index of generated frames {self.filename}: {e}")
+
+    def is_up_to_date(self, filename, key):
+        entry = self.entries.get(filename)
+        if entry is None or entry[0] != key:
+            return False
+        try:
+            stat = os.stat(os.path.join(self.folder, filename))
+        except OSError:
+            return False
+        return entry[1] == stat.st_size and entry[2] == stat.st_mtime_ns
+
+    # Calculates render key of frames to generate with config. Returns the set of frames already up to date
+    def check_frames(self, config, frames):
+        render_key = get_render_key(config)
+        up_to_date = set()
+        for frame_idx in frames:
+            key = get_frame_render_key(frame_idx, config, render_key)
+            self.frame_keys[frame_idx] = key
+            if key is None:
+                continue
+            if self.store is not None:
+                if self.store.get_key(config.first_absolute_frame + frame_idx) == key:
+                    up_to_date.add(frame_idx)
+            elif self.is_up_to_date(get_output_filename(frame_idx, config), key):
+                up_to_date.add(frame_idx)
+        return up_to_date
+
+    # Records frame as generated (file written) with its render key (as calculated by check_frames)
+    def record_frame(self, frame_idx, config):
+        if self.store is not None:
+            self.store.set_key(config.first_absolute_frame + frame_idx, self.frame_keys.get(frame_idx))
+            return
+        filename = get_output_filename(frame_idx, config)
+        key = self.frame_keys.get(frame_idx)
+        try:
+            stat = os.stat(os.path.join(self.folder, filename))
+        except OSError:
+            key = None
+        if key is None:
+            self.entries.pop(filename, None)
+        else:
+            self.entries[filename] = [key, stat.st_size, stat.st_mtime_ns]
+        self.modified = True
+
+
+# Size of a file, 0 if missing
+def get_file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+# Append-only journal of the frames completed (output file written) by a frame generation job, so that a job
+# interrupted (crash, power failure, stopped by user) can be resumed without generating again the frames already done.
+# Journal is tied to the settings of the job (render key): It is discarded if the job is started with other settings
+# Completed frames are flushed to disk in batches (journal_flush_frames): At most that many frames are generated again
+class CompletionJournal:
+    def __init__(self, folder):
+        self.folder = folder
+        self.filename = os.path.join(folder, journal_basename)
+        self.file = None
+        self.first_absolute_frame = 0
+        self.pending = []       # Frame numbers completed, not written yet
+        self.store = None       # FrameStore of the job, flushed before recording frames saved to it
+        self.lock = threading.Lock()
+
+    # Opens journal for a job. Returns the frames (among frames) completed by a previous run of the same job, and
+    # still available in the folder (or in store, if frames are saved in a FrameStore)
+    def open(self, config, frames, store = None):
+        header = f"AfterScan journal {journal_version} {get_render_key(config)}:{config.stabilization_threshold}:{config.threshold_sweep}\n"
+        self.first_absolute_frame = config.first_absolute_frame
+        self.store = store
+        completed = set()
+        try:
+            with open(self.filename) as f:
+                if f.readline() == header:
+                    for line in f:
+                        if line.endswith('\n') and line.strip().lstrip('-').isdigit():   # Last line might be incomplete
+                            completed.add(int(line) - config.first_absolute_frame)
+        except OSError:
+            pass
+        try:
+            if len(completed) > 0:
+                self.file = open(self.filename, 'a')
+            else:
+                self.file = open(self.filename, 'w')
+                self.file.write(header)
+                self.file.flush()
+        except OSError as e:
+            logging.warning(f"Cannot open journal {self.filename}, job will not be resumable: {e}")
+        if store is not None:
+            return {frame_idx for frame_idx in frames if frame_idx in completed
+                    and store.is_written(config.first_absolute_frame + frame_idx)}
+        return {frame_idx for frame_idx in frames if frame_idx in completed
+                and get_file_size(os.path.join(self.folder, get_output_filename(frame_idx, config))) > 0}
+
+    # Records frame as completed (saved with its absolute frame number, as output files)
+    def record(self, frame_idx):
+        with self.lock:
+            self.pending.append(frame_idx + self.first_absolute_frame)
+            if len(self.pending) >= journal_flush_frames:
+                self.flush()
+
+    def flush(self):
+        if self.file is None or len(self.pending) == 0:
+            return
+        try:
+            # Frames on disk before being recorded (frame files are synced by write_image_file)
+            if self.store is not None:
+                self.store.flush()
+            self.file.write(''.join(f"{frame_number}\n" for frame_number in self.pending))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            logging.warning(f"Cannot write journal {self.filename}: {e}")
+        self.pending.clear()
+
+    # Closes journal. If job is complete, journal is deleted (a new run of the job generates all frames again)
+    def close(self, job_completed):
+        with self.lock:
+            self.flush()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.store = None
+        if job_completed:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+
+def even_image(img):
+    # Get image dimensions to check whether one dimension is odd
+    width = img.shape[1]
+    height = img.shape[0]
+
+    X_end = width
+    Y_end = height
+
+    # FFmpeg does not like odd dimensions
+    # Adjust (decreasing BottomRight)in case of odd width/height
+    if width % 2 == 1:
+        X_end -= 1
+    if height % 2 == 1:
+        Y_end -= 1
+    if X_end != 0 or Y_end != 0:
+        return img[0:Y_end, 0:X_end]
+    else:
+        return img
+
+
+def crop_image(img, top_left, botton_right):
+    # Get image dimensions to perform image shift later
+    width = img.shape[1]
+    height = img.shape[0]
+
+    Y_start = top_left[1]
+    Y_end = min(botton_right[1], height)
+    X_start = top_left[0]
+    X_end = min (botton_right[0], width)
+
+    # FFmpeg does not like odd dimensions
+    # Adjust (decreasing BottomRight)in case of odd width/height
+    if (X_end - X_start) % 2 == 1:
+        X_end -= 1
+    if (Y_end - Y_start) % 2 == 1:
+        Y_end -= 1
+
+    return img[Y_start:Y_end, X_start:X_end]
+
+
+def denoise_image(img, denoise_frames):
+    denoise_frames.append(img)
+    if len(denoise_frames) == denoise_window_size:
+        if not HAS_TEMPORAL_DENOISE:
+            # denoised_img = np.median(np.array(list(denoise_frames)), axis=0).astype(np.uint8)   # Temporal median filtering does not work very well for moving images
+            denoised_img = cv2.fastNlMeansDenoisingColored(img, None, 5, 5, 21, 7)
+        else:
+            denoised_img = cv2.temporalDenoising(np.array(list(denoise_frames)), None, 3)
+    else:
+        # For the first denoise_window_size frames, return the original frame
+        denoised_img = img 
+    return denoised_img
+
+
+# Temporal denoise of the frames of a job encoded by several workers (threads): Each frame is denoised with the
+# frames preceding it in the sequence, whichever worker processed them, as when encoded one after the other
+# Frames are dispatched in order, so the previous ones are always being processed already: Workers add their frame
+# (before denoise) and wait for the previous ones. Frames not available (before first_frame, or not read) restart
+# the window, as at the start of the sequence. Not available to worker processes (see process_engine_active)
+class DenoiseWindow:
+    def __init__(self, first_frame):
+        self.first_frame = first_frame
+        self.frames = {}    # Frame index -> image before denoise (None if not available), until used by the next ones
+        self.uses = {}      # Frame index -> frames denoised with it so far
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def denoise(self, frame_idx, img):
+        previous = range(max(self.first_frame, frame_idx - denoise_window_size + 1), frame_idx)
+        window = deque(maxlen=denoise_window_size)
+        with self.condition:
+            self.frames[frame_idx] = img
+            self.condition.notify_all()
+            deadline = time.time() + denoise_window_timeout
+            while img is not None and not self.closed and any(i not in self.frames for i in previous):
+                if time.time() >= deadline:
+                    logging.warning(f"Frame {frame_idx}: Previous frames not available for temporal denoise")
+                    break
+                self.condition.wait(deadline - time.time())
+            for i in previous:
+                if self.frames.get(i) is None:
+                    window.clear()
+                else:
+                    window.append(self.frames[i])
+            # Frame is used by itself and by the next denoise_window_size - 1 frames
+            for i in [*previous, frame_idx]:
+                if i in self.frames:
+                    self.uses[i] = self.uses.get(i, 0) + 1
+                    if self.uses[i] >= denoise_window_size:
+                        del self.frames[i], self.uses[i]
+        return denoise_image(img, window) if img is not None else None
+
+    # Frame not available (cannot be read): Next frames are denoised without it
+    def skip(self, frame_idx):
+        self.denoise(frame_idx, None)
+
+    # Workers waiting for frames are released (job stopped)
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+# Files of a source frame: The frame itself plus, if present, the other frames of its HDR set. Contents are read
+# first (read_frame_source), and decoded later (decode_frame_source), so that both steps can be done ahead of the
+# encoding workers (see FramePrefetcher), or only the first one when frames are encoded in another process
+class FrameSource:
+    def __init__(self, frame_idx, hdr_set = False):
+        self.frame_idx = frame_idx
+        self.hdr_set = hdr_set      # Legacy HDR set (4 files, dedicated filename)
+        self.file_data = []         # Encoded contents of each file (None if not readable), released once decoded
+        self.images = None          # Decoded images, same order as files
+
+
+def read_image_file(filename):
+    try:
+        return np.fromfile(filename, dtype=np.uint8)
+    except OSError:
+        return None
+
+
+# Returns file type and imencode parameters of generated frames for an intermediate format (see intermediate_formats)
+def get_intermediate_format(name, source_file_type):
+    file_type, params = intermediate_formats.get(name, intermediate_formats[intermediate_format_default])
+    return file_type if file_type is not None else source_file_type, params
+
+
+# Encodes sample images with each intermediate format. Returns, for each format: Name, encoding time and decoding
+# time per frame (ms) and size per frame (MB), to choose the format for a reel
+def benchmark_intermediate_formats(images, source_file_type):
+    results = []
+    for name in intermediate_formats:
+        file_type, params = get_intermediate_format(name, source_file_type)
+        encode_time = decode_time = 0.0
+        size = 0
+        for img in images:
+            start = time.perf_counter()
+            ok, data = cv2.imencode('.' + file_type, img, list(params))
+            encoded = time.perf_counter()
+            cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+            decode_time += time.perf_counter() - encoded
+            encode_time += encoded - start
+            size += data.nbytes
+        results.append((name, encode_time * 1000 / len(images), decode_time * 1000 / len(images),
+                        size / len(images) / (1024 * 1024)))
+    return results
+
+
+# Writes image to a temporary file, renamed once complete: An interrupted write never leaves a truncated frame
+# (format given by extension of filename, as in cv2.imwrite, with imencode parameters params). Returns True if written
+def write_image_file(filename, img, params = ()):
+    ok, data = cv2.imencode(os.path.splitext(filename)[1], img, list(params))
+    if not ok:
+        return False
+    temp_filename = filename + '.tmp'
+    try:
+        # Data on disk before the file is renamed (and recorded in the journal, see CompletionJournal)
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+    except OSError as e:
+        logging.error(f"Cannot write {filename}: {e}")
+        return False
+    return True
+
+
+# Writes processed frames (image compression and file write) in a pool of threads of its own, so that encoding
+# workers do not spend their time compressing PNG/JPEG, and writer threads can be sized independently of them.
+# write returns a Future with the result of write_image_file (files are written atomically). Workers requesting a
+# write wait while the images pending to be written use more than max_pending_bytes
+# Latency (from write requested to file written) and time spent writing are recorded for each frame
+class FrameWriter:
+    def __init__(self, threads = 2, max_pending_bytes = frame_memory_budget_default):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='writer')
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.condition = threading.Condition()
+        self.frames_written = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.write_time_total = 0.0
+
+    def write(self, filename, img, params = ()):
+        with self.condition:
+            while self.pending_bytes > 0 and self.pending_bytes + img.nbytes > self.max_pending_bytes:
+                self.condition.wait()
+            self.pending_bytes += img.nbytes
+        return self.executor.submit(self.write_frame, filename, img, params, time.perf_counter())
+
+    def write_frame(self, filename, img, params, requested):
+        start = time.perf_counter()
+        try:
+            return write_image_file(filename, img, params)
+        finally:
+            end = time.perf_counter()
+            with self.condition:
+                self.pending_bytes -= img.nbytes
+                self.frames_written += 1
+                self.latency_total += end - requested
+                self.latency_max = max(self.latency_max, end - requested)
+                self.write_time_total += end - start
+                self.condition.notify_all()
+
+    # Returns frames written, average latency and average time writing (in seconds), plus maximum latency
+    def get_stats(self):
+        with self.condition:
+            if self.frames_written == 0:
+                return 0, 0.0, 0.0, 0.0
+            return (self.frames_written, self.latency_total / self.frames_written,
+                    self.write_time_total / self.frames_written, self.latency_max)
+
+    # Waits for pending writes to complete
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+# Returns image as raw frame (bgr24, 8 bits) of frame_size (width, height), as sent to ffmpeg (rawvideo) or kept in a
+# FrameStore. Frames of a different size are resized
+def get_bgr24_image(img, frame_size):
+    if img.dtype != np.uint8:   # 16 bit PNG
+        img = np.uint8(img >> 8)
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    if (img.shape[1], img.shape[0]) != tuple(frame_size):
+        logging.warning(f"Frame size {img.shape[1]}x{img.shape[0]} different from expected size {frame_size[0]}x{frame_size[1]}, resizing")
+        img = cv2.resize(img, tuple(frame_size), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(img)
+
+
+def get_frame_store_layout(num_frames, frame_size):
+    index_size = -(-num_frames * len(frame_store_written_key) // frame_store_alignment) * frame_store_alignment
+    frames_offset = frame_store_alignment + index_size
+    return frames_offset, frames_offset + num_frames * frame_size[0] * frame_size[1] * 3
+
+
+# Generated frames stored in a single file instead of a file per frame, as tens of thousands of files make folder
+# listings slow, and add a per-file overhead on network storage. File is preallocated for all the frames of a reel
+# and made of a header (JSON: First frame number, frame count and size), an index (render key of each frame, see
+# OutputIndex, zeros if the frame was never written) and the frames, as raw images of the same size (see
+# get_bgr24_image). It is memory-mapped, so that frames can be read or written by frame number from any worker thread
+# or process. Frames are sent to ffmpeg from the store (see FfmpegStoreStream), and can be exported to image files
+class FrameStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.filename = os.path.join(folder, frame_store_basename)
+        self.first_frame = 0    # Absolute frame number of first frame in store
+        self.num_frames = 0
+        self.frame_size = None  # Width, height
+        self.map = None
+        self.index = None
+        self.frames = None
+
+    # Maps the existing store of the folder. Returns False if there is none, or it is not valid
+    def load(self, writable = False):
+        self.close()
+        try:
+            with open(self.filename, 'rb') as f:
+                header = json.loads(f.read(frame_store_alignment))
+            if header.get('version') != frame_store_version:
+                return False
+            frame_size = tuple(header['frame_size'])
+            if os.path.getsize(self.filename) < get_frame_store_layout(header['num_frames'], frame_size)[1]:
+                return False
+            self.map_file(header['first_frame'], header['num_frames'], frame_size, 'r+' if writable else 'r')
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.debug(f"Cannot load frame store {self.filename}: {e}")
+            return False
+        return True
+
+    # Opens the store for a job generating frames of a reel (num_frames frames from first_frame) of frame_size. Store
+    # is kept if it matches, so that frames not generated again are preserved, otherwise it is created again.
+    # Raises OSError if it cannot be created (not enough disk space: It is allocated in full, so that frame writes
+    # to the mapped file cannot fail later)
+    def open(self, first_frame, num_frames, frame_size):
+        frame_size = tuple(frame_size)
+        if self.load(writable=True) and (self.first_frame, self.num_frames, self.frame_size) == (first_frame, num_frames,
+                                                                                                 frame_size):
+            return
+        self.close()
+        size = get_frame_store_layout(num_frames, frame_size)[1]
+        available = shutil.disk_usage(self.folder).free
+        if os.path.isfile(self.filename):
+            available += os.path.getsize(self.filename)
+        if size > available:
+            raise OSError(f"Not enough disk space for frame store {self.filename}: {size // 1048576} MB required, "
+                          f"{available // 1048576} MB available")
+        header = json.dumps({'version': frame_store_version, 'first_frame': first_frame, 'num_frames': num_frames,
+                             'frame_size': frame_size}).encode()
+        with open(self.filename, 'wb') as f:
+            f.write(header.ljust(frame_store_alignment))
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):   # Not available (Windows) or not supported by file system
+                f.truncate(size)
+        self.map_file(first_frame, num_frames, frame_size, 'r+')
+
+    def map_file(self, first_frame, num_frames, frame_size, mode):
+        frames_offset, size = get_frame_store_layout(num_frames, frame_size)
+        self.map = np.memmap(self.filename, dtype=np.uint8, mode=mode, shape=(size,))
+        self.index = self.map[frame_store_alignment:frame_store_alignment + num_frames * len(frame_store_written_key)]
+        self.index = self.index.reshape(num_frames, len(frame_store_written_key))
+        self.frames = self.map[frames_offset:].reshape(num_frames, frame_size[1], frame_size[0], 3)
+        self.first_frame = first_frame
+        self.num_frames = num_frames
+        self.frame_size = frame_size
+
+    def get_slot(self, frame_number):
+        slot = frame_number - self.first_frame
+        return slot if self.map is not None and 0 <= slot < self.num_frames else None
+
+    # Frame is flagged as written (without render key) before copying it, so that a frame being written when the
+    # job is interrupted is never taken as up to date
+    def write(self, frame_number, img):
+        slot = self.get_slot(frame_number)
+        if slot is None:
+            logging.error(f"Frame {frame_number} out of range of frame store {self.filename}")
+            return False
+        self.index[slot] = np.frombuffer(frame_store_written_key, dtype=np.uint8)
+        self.frames[slot] = get_bgr24_image(img, self.frame_size)
+        return True
+
+    # Returns frame (read-only view of the mapped file), None if never written
+    def read(self, frame_number):
+        if not self.is_written(frame_number):
+            return None
+        img = self.frames[self.get_slot(frame_number)]
+        img.flags.writeable = False
+        return img
+
+    def is_written(self, frame_number):
+        slot = self.get_slot(frame_number)
+        return slot is not None and self.index[slot].any()
+
+    # Render key of frame (see OutputIndex), as an hexadecimal string
+    def get_key(self, frame_number):
+        slot = self.get_slot(frame_number)
+        return self.index[slot].tobytes().hex() if slot is not None else None
+
+    def set_key(self, frame_number, key):
+        slot = self.get_slot(frame_number)
+        if slot is not None and self.index[slot].any():
+            self.index[slot] = np.frombuffer(bytes.fromhex(key) if key is not None else frame_store_written_key,
+                                             dtype=np.uint8)
+
+    # Writes the frames in the store to image files in folder, named as frames generated as files, by a FrameWriter
+    # with the given threads. progress(frames_exported, total) is called after each frame is queued. Returns the
+    # number of frames exported
+    def export(self, folder, file_type, params = (), threads = 2, progress = None):
+        frames = [slot for slot in range(self.num_frames) if self.index[slot].any()]
+        writer = FrameWriter(max(threads, 1))
+        results = []
+        try:
+            for count, slot in enumerate(frames):
+                filename = os.path.join(folder, FrameOutputFilenamePattern % (self.first_frame + slot, file_type))
+                results.append(writer.write(filename, self.frames[slot], params))
+                if progress is not None:
+                    progress(count + 1, len(frames))
+        finally:
+            writer.close()
+        return sum(1 for result in results if result.result())
+
+    def flush(self):
+        if self.map is not None and self.map.mode != 'r':
+            self.map.flush()
+
+    def close(self):
+        self.flush()
+        self.map = self.index = self.frames = None
+
+
+# Names of the files making up a frame (in source_dir): Base file, followed by HDR files if any
+def get_frame_source_files(frame_idx, config):
+    file_type = config.file_type
+    frame_number = frame_idx + config.first_absolute_frame
+    # Existence of files checked in source folder manifest if available
+    if config.source_manifest is not None:
+        exists = config.source_manifest.exists
+    else:
+        exists = lambda filename: os.path.isfile(os.path.join(config.source_dir, filename))
+
+    if config.hdr_files_only:    # Legacy HDR (before 2 Dec 2023): Dedicated filename
+        return [HdrSetInputFilenamePattern % (frame_number, i, file_type) for i in range(1, 5)]
+    file1 = FrameInputFilenamePattern % (frame_number, file_type)
+    if not exists(file1):
+        file_type = 'png' if file_type == 'jpg' else 'jpg'  # Try with the other file type
+        file1 = FrameInputFilenamePattern % (frame_number, file_type)
+    files = [file1]
+    # Check if HDR frames exist. Can handle between 2 and 5
+    for i in range(2, 6):
+        file = FrameHdrInputFilenamePattern % (frame_number, i, file_type)
+        if not exists(file):
+            break
+        files.append(file)
+    return files
+
+
+# Reads (without decoding) the file(s) of a source frame, including the existence checks of HDR files
+def read_frame_source(frame_idx, config):
+    source = FrameSource(frame_idx, config.hdr_files_only)
+    source.file_data = [read_source_file(file, config) for file in get_frame_source_files(frame_idx, config)]
+    return source
+
+
+# Reads a file of the source folder, from its local copy if source cache is enabled (copied now if not cached yet)
+def read_source_file(filename, config):
+    source_file = os.path.join(config.source_dir, filename)
+    if config.source_cache is not None:
+        file = config.source_cache.get_file(config.source_dir, filename, get_source_file_info(filename, config))
+        data = read_image_file(file)
+        if data is not None or file == source_file:
+            return data
+    return read_image_file(source_file)   # Copy evicted meanwhile
+
+
+# Size and modification time of a source file, from source folder manifest (None if not available)
+def get_source_file_info(filename, config):
+    if config.source_manifest is None:
+        return None
+    info = config.source_manifest.files.get(filename)
+    return info if info is not None and info[0] is not None else None
+
+
+# Copies the files of a source frame to the source cache, without reading them (see create_source_stager)
+def stage_frame_source(frame_idx, config):
+    for file in get_frame_source_files(frame_idx, config):
+        config.source_cache.get_file(config.source_dir, file, get_source_file_info(file, config))
+
+
+# Creates the prefetcher copying source frames to the source cache ahead of their use (None if cache not enabled),
+# to be chained to the prefetcher reading them (see FramePrefetcher). A single thread copies one file after another,
+# with large reads, which is what network shares do best
+def create_source_stager(config, frames):
+    if config.source_cache is None or config.source_cache.read_only:
+        return None
+    return FramePrefetcher(lambda frame_idx: stage_frame_source(frame_idx, config), frames, 1,
+                           source_cache_stage_ahead)
+
+
+# Local copy of the files of source folders in network shares, which are slow for the random access of the encoding
+# workers, and for frames read repeatedly (preview, FrameSync viewer). Files are copied once, when first read (or
+# ahead of their use, see create_source_stager), and read from the copy afterwards. Each source folder has a
+# subfolder of its own, kept across runs, in a dedicated folder (source_cache_subfolder) of the folder given, so
+# that only files created by the cache are ever deleted. Total size is limited to max_bytes, deleting the files (of any folder) not
+# used for the longest time. Copies are valid as long as size and modification time of the source file, recorded
+# when copied, do not change. Index of the files cached is saved in the cache folder
+# Worker processes receive a read-only copy: They use the files cached when the job started, and copy none
+class SourceCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = os.path.join(folder, source_cache_subfolder)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # Cached file (relative to folder) -> source size, modification time in ns. Least recently used first
+        self.cached_bytes = 0
+        self.copying = {}   # Cached file -> Event set once copy is done
+        self.lock = threading.Lock()
+        self.read_only = False
+        self.load()
+
+    def __getstate__(self):
+        with self.lock:
+            return {'folder': self.folder, 'max_bytes': self.max_bytes, 'entries': OrderedDict(self.entries),
+                    'cached_bytes': self.cached_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.copying = {}
+        self.lock = threading.Lock()
+        self.read_only = True
+
+    # Loads index, and deletes the files not in it (copies interrupted, or index not saved). Clean up is done only
+    # if the index was found (folder created by the cache), in the subfolders of the source folders (named by
+    # get_cached_name)
+    def load(self):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(os.path.join(self.folder, source_cache_index_basename)) as f:
+                data = json.load(f)
+            if data.get('version') != source_cache_version:
+                return
+            for name, size, mtime_ns in data['entries']:
+                if os.path.isfile(os.path.join(self.folder, name)):
+                    self.entries[name] = (size, mtime_ns)
+                    self.cached_bytes += size
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.debug(f"Cannot load index of source cache {self.folder}: {e}")
+            return
+        try:
+            with os.scandir(self.folder) as subfolders:
+                for subfolder in subfolders:
+                    if subfolder.is_dir(follow_symlinks=False) and source_cache_subfolder_regex.fullmatch(subfolder.name):
+                        with os.scandir(subfolder.path) as entries:
+                            for entry in entries:
+                                if (entry.is_file(follow_symlinks=False)
+                                        and os.path.join(subfolder.name, entry.name) not in self.entries):
+                                    os.remove(entry.path)
+        except OSError as e:
+            logging.debug(f"Cannot clean up source cache {self.folder}: {e}")
+        with self.lock:
+            self.evict()
+
+    def save(self):
+        if self.read_only:
+            return
+        with self.lock:
+            data = {'version': source_cache_version,
+                    'entries': [[name, size, mtime_ns] for name, (size, mtime_ns) in self.entries.items()]}
+        filename = os.path.join(self.folder, source_cache_index_basename)
+        try:
+            with open(filename + '.tmp', 'w') as f:
+                f.write(json.dumps(data))
+            os.replace(filename + '.tmp', filename)
+        except OSError as e:
+            logging.warning(f"Cannot save index of source cache {self.folder}: {e}")
+
+    # Cached files of a source folder are kept in a subfolder named by a hash of its path
+    def get_cached_name(self, source_dir, filename):
+        return os.path.join(hashlib.sha1(os.path.abspath(source_dir).encode()).hexdigest()[:16], filename)
+
+    # Returns the file to read a source file from: Its copy in the cache (copied now if required), or the source
+    # file itself if it cannot be copied. info is (size, modification time in ns) of the source file, retrieved if
+    # not provided
+    def get_file(self, source_dir, filename, info = None):
+        source_file = os.path.join(source_dir, filename)
+        if info is None:
+            try:
+                stat = os.stat(source_file)
+            except OSError:
+                return source_file
+            info = (stat.st_size, stat.st_mtime_ns)
+        info = tuple(info)
+        name = self.get_cached_name(source_dir, filename)
+        while True:
+            with self.lock:
+                if self.entries.get(name) == info:
+                    if not self.read_only:
+                        self.entries.move_to_end(name)
+                    return os.path.join(self.folder, name)
+                if self.read_only or info[0] > self.max_bytes:
+                    return source_file
+                copy_done = self.copying.get(name)
+                if copy_done is None:
+                    copy_done = self.copying[name] = threading.Event()
+                    break
+            copy_done.wait()    # Being copied by another thread, check again once done
+        cached_file = os.path.join(self.folder, name)
+        copied = self.copy_file(source_file, cached_file)
+        with self.lock:
+            del self.copying[name]
+            previous = self.entries.pop(name, None)
+            if previous is not None:
+                self.cached_bytes -= previous[0]
+            if copied:
+                self.entries[name] = info
+                self.cached_bytes += info[0]
+                self.evict()
+        copy_done.set()
+        return cached_file if copied else source_file
+
+    def copy_file(self, source_file, cached_file):
+        temp_file = cached_file + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+            with open(source_file, 'rb') as source, open(temp_file, 'wb') as target:
+                shutil.copyfileobj(source, target, source_cache_copy_buffer)
+            os.replace(temp_file, cached_file)
+        except OSError as e:
+            logging.warning(f"Cannot copy {source_file} to source cache: {e}")
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+            return False
+        return True
+
+    # Called with lock held. Most recently used file is never evicted
+    def evict(self):
+        while self.cached_bytes > self.max_bytes and len(self.entries) > 1:
+            name, (size, mtime_ns) = self.entries.popitem(last=False)
+            self.cached_bytes -= size
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:     # In use (Windows): Deleted when cache is loaded next time
+                pass
+
+
+def decode_frame_source(source):
+    if source.images is None:
+        source.images = [cv2.imdecode(data, cv2.IMREAD_UNCHANGED) if data is not None and data.size > 0 else None
+                         for data in source.file_data]
+        source.file_data = None
+    return source
+
+
+def load_frame_source(frame_idx, config):
+    return decode_frame_source(read_frame_source(frame_idx, config))
+
+
+# Loads items ahead of their consumers, in a dedicated pool of I/O threads (sized independently of the encoding
+# workers), so that consumers do not wait for file access (slow on network shares). Items are requested to load_item
+# in the order given by frames (ascending), keeping no more than depth of them loaded and not yet consumed.
+# Consumers can request them in any order: get returns None for frames not loaded ahead (consumer has to load them)
+# Prefetchers can be chained: get of upstream prefetcher is called before loading each frame (for example, to wait for
+# the frame to be copied to the source cache), and upstream is closed together with this one
+class FramePrefetcher:
+    def __init__(self, load_item, frames, io_threads = 4, depth = 8, upstream = None):
+        self.load_item = load_item
+        self.upstream = upstream
+        self.frames = iter(frames)
+        self.next_frame = next(self.frames, None)
+        self.depth = depth
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='prefetch')
+        self.schedule()
+
+    # Called with lock held (or from constructor)
+    def schedule(self):
+        while not self.closed and self.next_frame is not None and len(self.futures) < self.depth:
+            self.futures[self.next_frame] = self.executor.submit(self.load, self.next_frame)
+            self.next_frame = next(self.frames, None)
+
+    def load(self, frame_idx):
+        if self.upstream is not None:
+            self.upstream.get(frame_idx)
+        return self.load_item(frame_idx)
+
+    def get(self, frame_idx):
+        with self.lock:
+            future = self.futures.pop(frame_idx, None)
+            if future is None:  # Not loaded ahead: Do not load it later either
+                while self.next_frame is not None and self.next_frame <= frame_idx:
+                    self.next_frame = next(self.frames, None)
+            self.schedule()
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logging.error(f"Error reading frame {frame_idx} ahead: {e}")
+            return None
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.futures.clear()
+        if self.upstream is not None:
+            self.upstream.close()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Merges HDR images (aligned in place) into an 8 bit image. Merge result (float) is kept in a worker buffer, and
+# normalized in place, so that the only full frame allocated is the image returned
+# If config.hdr_merge_scale is set, images are merged at reduced resolution (much faster), result is scaled back
+def merge_hdr_images(images, config, ctx):
+    height, width = images[0].shape[:2]
+    if config.hdr_merge_scale < 1.0:
+        images = [resize_image(img, config.hdr_merge_scale) for img in images]
+    if config.hdr_fast_align and images[0].dtype == np.uint8 and images[0].ndim == 3:
+        align_hdr_images(images, ctx)
+    else:
+        ctx.align_mtb.process(images, images)
+    img = ctx.merge_mertens.process(images, dst=ctx.get_buffer('hdr_merge', images[0].shape, np.float32))
+    np.subtract(img, img.min(), out=img)  # Now between 0 and 8674
+    np.divide(img, img.max(), out=img)
+    np.multiply(img, 255, out=img)
+    if config.hdr_merge_scale < 1.0:
+        return cv2.resize(img, (width, height), interpolation=cv2.INTER_LINEAR).astype(np.uint8)
+    return img.astype(np.uint8)
+
+
+# Aligns HDR images in place, as AlignMTB.process (shifts relative to the middle image, same grayscale conversion),
+# but calculating the shifts on images downscaled by hdr_align_scale, and reusing them while they are stable (see
+# hdr_shifts_stable_frames). Images without shift (usually all of them) are not modified
+def align_hdr_images(images, ctx):
+    if (ctx.hdr_shifts is not None and len(ctx.hdr_shifts) == len(images)
+            and ctx.hdr_shifts_stable >= hdr_shifts_stable_frames and ctx.hdr_shifts_reused < hdr_shifts_recheck_frames):
+        ctx.hdr_shifts_reused += 1
+        shifts = ctx.hdr_shifts
+    else:
+        shifts = calculate_hdr_shifts(images, ctx)
+        ctx.hdr_shifts_stable = ctx.hdr_shifts_stable + 1 if shifts == ctx.hdr_shifts else 1
+        ctx.hdr_shifts = shifts
+        ctx.hdr_shifts_reused = 0
+    for img, shift in zip(images, shifts):
+        if shift != (0, 0):
+            np.copyto(img, ctx.align_mtb.shiftMat(img, shift))
+
+
+def calculate_hdr_shifts(images, ctx):
+    height, width = images[0].shape[:2]
+    size = (max(1, int(width * hdr_align_scale)), max(1, int(height * hdr_align_scale)))
+    grays = []
+    for img in images:
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY, dst=ctx.get_buffer('hdr_gray', (height, width)))
+        grays.append(cv2.resize(gray, size, interpolation=cv2.INTER_AREA))
+    pivot = grays[len(grays) // 2]
+    shifts = []
+    for gray in grays:
+        shift = ctx.align_mtb.calculateShift(pivot, gray)
+        shifts.append((round(shift[0] * width / size[0]), round(shift[1] * height / size[1])))
+    return shifts
+
+
+# Loads source frame (merging HDR set if present) and performs all processing steps requested in config.
+# Neither UI nor global settings are accessed, so that it can be run by any worker (thread or process)
+# Source frame is loaded here, unless already done (source, see FrameSource)
+# Returns processed image (None if frame cannot be read) plus a dictionary with frame info for the UI
+# If writer is provided (see FrameWriter), frame is saved by it: Frame info contains the Future of the write ('write')
+# instead of the result ('saved')
+# If memory allocations are being traced (python -X tracemalloc), memory allocated while encoding
+# the frame (peak, in addition to the memory already in use) and number of worker buffers allocated are returned in
+# frame info. Allocations of other workers running at the same time are included, use a single worker to measure
+def encode_frame(frame_idx, config, ctx, do_save = True, offset_x = 0, offset_y = 0, source = None, writer = None):
+    if not tracemalloc.is_tracing():
+        return encode_frame_image(frame_idx, config, ctx, do_save, offset_x, offset_y, source, writer)
+    tracemalloc.reset_peak()
+    memory_in_use = tracemalloc.get_traced_memory()[0]
+    buffer_allocations = ctx.buffer_allocations
+    img, frame_info = encode_frame_image(frame_idx, config, ctx, do_save, offset_x, offset_y, source, writer)
+    frame_info['allocated_bytes'] = tracemalloc.get_traced_memory()[1] - memory_in_use
+    frame_info['buffer_allocations'] = ctx.buffer_allocations - buffer_allocations
+    return img, frame_info
+
+
+def encode_frame_image(frame_idx, config, ctx, do_save = True, offset_x = 0, offset_y = 0, source = None, writer = None):
+    images_to_merge = []
+    img_ref_aux = None
+    frame_info = {'merged': False, 'odd_size': False}
+    frame_number = frame_idx + config.first_absolute_frame
+
+    # Get current file(s)
+    if source is None:
+        source = read_frame_source(frame_idx, config)
+    images = decode_frame_source(source).images
+    if source.hdr_set:    # Legacy HDR (before 2 Dec 2023): Dedicated filename
+        img_ref = images[0]   # Keep first frame of the set for stabilization reference
+        images_to_merge.extend(images)
+        img = merge_hdr_images(images_to_merge, config, ctx)
+    else:
+        img = images[0]
+        img_ref = img   # Reference image is the same image for standard capture
+        if len(images) > 1:   # If hdr frames exist, merge them
+            images_to_merge.extend(images)
+            img_ref_aux = img_ref
+            img_ref = images[1] # Override stabilization reference with HDR#2
+
+            img = merge_hdr_images(images_to_merge, config, ctx)
+    frame_info['merged'] = len(images_to_merge) != 0
+
+    if img is None:
+        logging.error(
+            "Error reading frame %i, skipping", frame_idx)
+        if config.perform_denoise and config.denoise_window is not None:
+            config.denoise_window.skip(frame_idx)
+        return None, frame_info
+
+    # Rotation, stabilization shift and crop done with a single warp of the frame (see warp_frame). Not possible if
+    # full frame is required (FrameSync viewer)
+    warp = not config.debug_images
+    if config.perform_rotation and not warp:
+        img = rotate_image(img, config.rotation_angle)
+    correction = config.frame_corrections.get(frame_idx) if config.frame_corrections else None
+    if correction is not None and config.perform_stabilization:
+        # Frame corrected in FrameSync viewer: Detect holes with the threshold selected there, and apply its offsets
+        offset_x, offset_y = correction[0], correction[1]
+        config = replace(config, stabilization_threshold=float(correction[2]), threshold_sweep=False,
+                         frame_transforms=None)
+    else:
+        correction = None
+    if config.perform_stabilization or config.detect_holes:
+        # Use displacement detected previously if available (not for FrameSync viewer, as it displays detection)
+        transform = None
+        if config.frame_transforms is not None and not config.debug_images:
+            transform = config.frame_transforms.get(frame_idx)
+        if config.analysis_only:    # Frame is not modified, only its displacement is required
+            if transform is None:
+                transform = detect_frame_displacement(frame_idx, img, img_ref, config, ctx, img_ref_aux, not warp)
+            frame_info['stabilization'] = transform[2]
+            return img, frame_info
+        img, frame_info['stabilization'] = stabilize_image(frame_idx, img, img_ref, config, ctx, offset_x, offset_y,
+                                                           img_ref_aux, transform, warp)
+        frame_info['stabilization']['corrected'] = correction is not None
+    elif config.analysis_only:
+        return img, frame_info
+    elif warp:
+        img = warp_frame(img, config, 0, 0)
+    if not warp:
+        img = crop_output_image(img, config)
+    if config.perform_denoise:
+        if config.denoise_window is not None:   # Encoding job, frames denoised in sequence order
+            img = config.denoise_window.denoise(frame_idx, img)
+        else:
+            img = denoise_image(img, ctx.denoise_frames)
+    if config.perform_sharpness:
+        # applying kernels to the input image to get the sharpened image
+        img = cv2.filter2D(img, -1, sharpen_filter)
+    if config.perform_gamma_correction:
+        img = gamma_correct_image(img, config.gamma_correction_value)
+
+    frame_info['odd_size'] = img.shape[1] % 2 == 1 or img.shape[0] % 2 == 1
+
+    if do_save and config.save_frames and os.path.isdir(config.target_dir):
+        target_file = os.path.join(config.target_dir, FrameOutputFilenamePattern % (frame_number, config.file_type_out))
+        if config.frame_store:  # Copied to the store, no need for writer threads
+            store = ctx.get_frame_store(config.target_dir)
+            frame_info['saved'] = store is not None and store.write(frame_number, img)
+        elif writer is not None:
+            frame_info['write'] = writer.write(target_file, img, config.output_params)
+        else:
+            frame_info['saved'] = write_image_file(target_file, img, config.output_params)
+
+    return img, frame_info
+
+
+# Memory used by the images (NumPy arrays) in an item: Image itself, or tuple/list containing images
+def get_item_bytes(item):
+    if isinstance(item, np.ndarray):
+        return item.nbytes
+    if isinstance(item, (tuple, list)):
+        return sum(get_item_bytes(element) for element in item)
+    return 0
+
+
+# Queue bounded by the memory used by the images in its items (see get_item_bytes), instead of by their number only,
+# as the size of a frame depends on the resolution of the scan. Producers wait while adding an item would exceed
+# max_bytes, but an item is always accepted by a queue without images, so that a single item bigger than max_bytes
+# does not block forever. max_items still applies (0 for no limit). Timeout in put is not supported
+class FrameQueue(queue.Queue):
+    def __init__(self, max_bytes, max_items = 0):
+        super().__init__(max_items)
+        self.max_bytes = max_bytes
+        self.queued_bytes = 0
+
+    def put(self, item, block = True, timeout = None):
+        item_bytes = get_item_bytes(item)
+        with self.not_full:
+            while (self.queued_bytes > 0 and self.queued_bytes + item_bytes > self.max_bytes) or \
+                    0 < self.maxsize <= self._qsize():
+                if not block:
+                    raise queue.Full
+                self.not_full.wait()
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _put(self, item):
+        self.queued_bytes += get_item_bytes(item)
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        self.queued_bytes -= get_item_bytes(item)
+        self.not_full.notify_all()  # Producers wait for different amounts of memory
+        return item
+
+
+# Feeds processed frames to ffmpeg through its standard input (rawvideo, bgr24), so that frames do not need to be
+# written to disk and read back to generate the video. Frames can be delivered in any order by several workers:
+# They are kept in a reorder buffer until all previous ones have been written. When the buffer is full (frames
+# pending use max_pending_bytes), workers delivering frames other than the next one wait, so ffmpeg encoding speed
+# limits the memory used, whatever the resolution of the frames.
+# ffmpeg is started with the first frame, as command_builder(frame_size) requires the size of the frames
+class FfmpegFrameStream:
+    needs_images = True     # Workers have to deliver the processed images (see FfmpegFileStream)
+
+    def __init__(self, command_builder, first_frame_idx, max_pending_bytes=frame_memory_budget_default):
+        self.command_builder = command_builder
+        self.next_frame_idx = first_frame_idx
+        self.max_pending_bytes = max_pending_bytes
+        self.pending = {}
+        self.pending_bytes = 0
+        self.condition = threading.Condition()
+        self.process = None
+        self.output_thread = None
+        self.frame_size = None
+        self.frames_written = 0
+        self.frames_skipped = 0
+        self.encoded_frames = 0     # As reported by ffmpeg
+        self.closed = False
+        self.failed = False
+
+    # Delivers processed frame. img is None for frames that could not be processed, they are left out of the video
+    def put(self, frame_idx, img):
+        with self.condition:
+            while self.pending_full(img) and frame_idx != self.next_frame_idx and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return
+            self.pending[frame_idx] = img
+            self.pending_bytes += get_item_bytes(img)
+            while self.next_frame_idx in self.pending:
+                frame = self.pending.pop(self.next_frame_idx)
+                self.pending_bytes -= get_item_bytes(frame)
+                self.write(frame)
+                self.next_frame_idx += 1
+            self.condition.notify_all()
+
+    # Called with condition held. A frame is always accepted if none is pending
+    def pending_full(self, item):
+        return self.pending_bytes > 0 and self.pending_bytes + get_item_bytes(item) > self.max_pending_bytes
+
+    def start(self, frame):
+        self.frame_size = self.get_frame_size(frame)
+        if self.frame_size is None:
+            logging.error("Cannot get frame size to start ffmpeg")
+            self.failed = True
+            return
+        cmd_ffmpeg = self.command_builder(self.frame_size)
+        logging.debug("Generated ffmpeg command: %s", cmd_ffmpeg)
+        try:
+            self.process = sp.Popen(cmd_ffmpeg, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.STDOUT)
+        except OSError as e:
+            logging.error(f"Cannot start ffmpeg: {e}")
+            self.failed = True
+            return
+        self.output_thread = threading.Thread(target=self.read_output, daemon=True)
+        self.output_thread.start()
+
+    # ffmpeg output has to be consumed while frames are written, otherwise ffmpeg would block
+    def read_output(self):
+        for line in io.TextIOWrapper(self.process.stdout, encoding='utf-8', errors='ignore'):
+            line = line.strip()
+            if not line:
+                continue
+            logging.debug(line)
+            match = re.search(r"frame=\s*(\d+)", line)
+            if match:
+                self.encoded_frames = int(match.group(1))
+
+    def get_frame_size(self, img):
+        return img.shape[1], img.shape[0]
+
+    # Returns frame in the format expected by ffmpeg (rawvideo, bgr24, all frames with the same size)
+    def get_frame_data(self, img):
+        return get_bgr24_image(img, self.frame_size).data
+
+    def write(self, frame):
+        if frame is None:
+            self.frames_skipped += 1
+            return
+        if self.failed:
+            return
+        if self.process is None:
+            self.start(frame)
+            if self.failed:
+                return
+        try:
+            self.process.stdin.write(self.get_frame_data(frame))
+            self.frames_written += 1
+        except OSError as e:   # ffmpeg exited (BrokenPipeError)
+            logging.error(f"Cannot write frame to ffmpeg: {e}")
+            self.failed = True
+
+    # Called once all frames have been delivered: Writes those still pending (if any frame was never delivered,
+    # it is skipped) and closes ffmpeg input, so that it finishes encoding. Does not wait for ffmpeg to finish
+    def close(self):
+        with self.condition:
+            if not self.closed:
+                for frame_idx in sorted(self.pending):
+                    self.write(self.pending[frame_idx])
+                self.pending.clear()
+                self.pending_bytes = 0
+                self.closed = True
+                self.condition.notify_all()
+        if self.process is not None and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    # Closes input and waits for ffmpeg to finish. Returns True if video was generated successfully
+    def wait(self):
+        self.close()
+        if self.process is None:
+            return False
+        return_code = self.process.wait()
+        self.output_thread.join()
+        return return_code == 0 and not self.failed
+
+    # Stops encoding, waking up any worker waiting to deliver a frame. ffmpeg is terminated first, in case a
+    # worker is blocked writing to it
+    def abort(self):
+        if self.process is not None and self.process.poll() is None:
+            logging.warning("Terminating ffmpeg process")
+            self.process.terminate()
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.pending_bytes = 0
+            self.condition.notify_all()
+        self.close()
+
+
+# Follow mode: Same as FfmpegFrameStream, but for frames written to disk (frame files are kept). Workers only report
+# whether each frame was generated, and files are sent to ffmpeg (image2pipe) as soon as all previous ones are
+# available, so that video encoding overlaps frame generation instead of starting once all frames are done
+# Only filenames are pending, so the reorder buffer is never full: Frames can be delivered by FrameWriter threads
+# once written, without waiting for each other (a writer thread waiting could block the write of the next frame)
+class FfmpegFileStream(FfmpegFrameStream):
+    needs_images = False
+
+    # frame_filename(frame_idx) returns the name of the file of a frame
+    def __init__(self, command_builder, first_frame_idx, frame_filename):
+        super().__init__(command_builder, first_frame_idx)
+        self.frame_filename = frame_filename
+
+    def put(self, frame_idx, generated):
+        super().put(frame_idx, self.frame_filename(frame_idx) if generated else None)
+
+    def pending_full(self, item):
+        return False
+
+    def get_frame_size(self, filename):
+        img = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+        return (img.shape[1], img.shape[0]) if img is not None else None
+
+    def get_frame_data(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+
+# Frame store mode: Same as FfmpegFileStream, for frames saved in a FrameStore. Frames are sent to ffmpeg as raw
+# images (rawvideo) straight from the mapped store, no file has to be read nor decoded
+class FfmpegStoreStream(FfmpegFileStream):
+    def __init__(self, command_builder, first_frame_idx, store, first_absolute_frame):
+        super().__init__(command_builder, first_frame_idx, lambda frame_idx: first_absolute_frame + frame_idx)
+        self.store = store
+
+    def get_frame_size(self, frame_number):
+        return self.store.frame_size
+
+    def get_frame_data(self, frame_number):
+        img = self.store.read(frame_number)
+        if img is None:     # Black frame, so that the following ones are not shifted
+            logging.error(f"Frame {frame_number} missing in frame store")
+            return bytes(self.store.frame_size[0] * self.store.frame_size[1] * 3)
+        return img.data
+
+
+# Loads the hole template for a film type ('S8' or 'R8'), scaled for the width of the frames to process
+# Returns template and its expected position, as required by PipelineConfig
+def load_hole_template(film_type, frame_width):
+    filename, position = hole_templates[film_type]
+    template = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+    if template is None:
+        raise FileNotFoundError(f"Cannot load hole template {filename}")
+    scale = frame_width / 2028
+    template = resize_image(template, scale)
+    template.setflags(write=False)
+    return template, (int(position[0] * scale), int(position[1] * scale))
+
+
+def iter_stabilized_frames(source_dir, config, start = 0, count = None):
+    """
+    Processes frames of source_dir, as defined in config, yielding (frame_idx, image, metrics) for each one.
+    Frames are processed lazily, one per iteration, and are not written to disk.
+    frame_idx is relative to the first frame in source_dir. If count is None, all frames from start are processed.
+    metrics contains the frame info returned by encode_frame ('merged', 'odd_size' and, if
+    stabilization is enabled, 'stabilization' with displacement and match level).
+    Frames that cannot be read are logged and skipped.
+    """
+    manifest = FrameManifest(source_dir)
+    file_list, legacy_hdr_file_list, _, _ = list_source_frames(source_dir, manifest=manifest)
+    hdr_files_only = len(legacy_hdr_file_list) > len(file_list)
+    if hdr_files_only:
+        file_list = legacy_hdr_file_list
+    if len(file_list) == 0:
+        return
+    first_absolute_frame = get_frame_number_from_filename(file_list[0])
+    if first_absolute_frame is None:
+        raise ValueError(f"Files in {source_dir} do not have sequential numbers in their names")
+    config = replace(config, source_dir=source_dir, first_absolute_frame=first_absolute_frame,
+                     hdr_files_only=hdr_files_only, debug_images=False, source_manifest=manifest)
+    if count is None:
+        count = len(file_list) - start
+
+    ctx = WorkerContext()
+    for frame_idx in range(start, start + count):
+        img, frame_info = encode_frame(frame_idx, config, ctx, do_save=False)
+        if img is not None:
+            yield frame_idx, img, frame_info